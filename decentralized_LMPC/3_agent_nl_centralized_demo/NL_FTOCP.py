@@ -90,6 +90,26 @@ class NL_FTOCP(object):
 
         self.cost = []
 
+        # Parametric solvers are built once per horizon length and number of exploration halfspaces and then reused
+        # for every safe set point and time step, only parameter values and initial guesses change between solves
+        self.opti_solvers = {}
+
+        self.solver_opts = {
+            "mu_strategy" : "adaptive",
+            "mu_init" : 1e-5,
+            "mu_min" : 1e-15,
+            "barrier_tol_factor" : 1,
+            "print_level" : 0,
+            "linear_solver" : "ma27"
+            }
+        self.plugin_opts = {"verbose" : False, "print_time" : False, "print_out" : False}
+
+    def __getstate__(self):
+        # CasADi solver objects cannot be pickled, they are rebuilt on demand after unpickling
+        state = self.__dict__.copy()
+        state['opti_solvers'] = {}
+        return state
+
     def solve(self, abs_t, x_0, x_ss, N, last_u, x_guess=None, u_guess=None, expl_constraints=None, verbose=False):
         x = ca.SX.sym('x', self.n_x*(N+1))
         u = ca.SX.sym('y', self.n_u*N)
@@ -215,38 +235,42 @@ class NL_FTOCP(object):
 
         return x_pred, u_pred, cost_val
 
-    def solve_opti(self, abs_t, x_0, x_ss, N, last_u, x_guess=None, u_guess=None, expl_constraints=None, verbose=False):
+    def build_opti_solver(self, N, n_h=0):
+        """
+        Build a parametric NLP for horizon N with n_h exploration halfspaces per time step. The initial state, terminal
+        safe set point, last applied input and the exploration halfspaces are opti parameters
+        """
         opti = ca.Opti()
 
         x = opti.variable(self.n_x*self.n_a, N+1)
         u = opti.variable(self.n_u*self.n_a, N)
         slack = opti.variable(self.n_x*self.n_a)
 
-        if x_guess is not None:
-            opti.set_initial(x, x_guess)
-        if u_guess is not None:
-            opti.set_initial(u, u_guess)
-        opti.set_initial(slack, np.zeros(self.n_x*self.n_a))
+        x_0 = opti.parameter(self.n_x*self.n_a)
+        x_ss = opti.parameter(self.n_x*self.n_a)
+        last_u = opti.parameter(self.n_u*self.n_a)
+        V = [opti.parameter(n_h, 2) for _ in range(N)] if n_h > 0 else []
+        w = [opti.parameter(n_h) for _ in range(N)] if n_h > 0 else []
 
         da_lim = self.da_lim
         ddf_lim = self.ddf_lim
 
         pairs = list(itertools.combinations(range(self.n_a), 2))
 
-        opti.subject_to(x[:,0] == np.squeeze(x_0))
+        opti.subject_to(x[:,0] == x_0)
         for j in range(self.n_a):
             opti.subject_to(opti.bounded(ddf_lim[0]*self.dt, u[j*self.n_u+0,0]-last_u[j*self.n_u+0], ddf_lim[1]*self.dt))
             opti.subject_to(opti.bounded(da_lim[0]*self.dt, u[j*self.n_u+1,0]-last_u[j*self.n_u+1], da_lim[1]*self.dt))
 
+        # Discrete dynamics of each agent with the integrator of the centralized agent
+        f_dt = self.agent.get_step_function()
+
         stage_cost = 0
         for i in range(N):
             stage_cost = stage_cost + 1
 
             for j in range(self.n_a):
-                opti.subject_to(x[j*self.n_x+0,i+1] == x[j*self.n_x+0,i] + self.dt*x[j*self.n_x+3,i]*ca.cos(x[j*self.n_x+2,i] + ca.atan2(self.l_r*ca.tan(u[j*self.n_u+0,i]), self.l_f + self.l_r)))
-                opti.subject_to(x[j*self.n_x+1,i+1] == x[j*self.n_x+1,i] + self.dt*x[j*self.n_x+3,i]*ca.sin(x[j*self.n_x+2,i] + ca.atan2(self.l_r*ca.tan(u[j*self.n_u+0,i]), self.l_f + self.l_r)))
-                opti.subject_to(x[j*self.n_x+2,i+1] == x[j*self.n_x+2,i] + self.dt*x[j*self.n_x+3,i]*ca.sin(ca.atan2(self.l_r*ca.tan(u[j*self.n_u+0,i]), self.l_f + self.l_r)))
-                opti.subject_to(x[j*self.n_x+3,i+1] == x[j*self.n_x+3,i] + self.dt*u[j*self.n_u+1,i])
+                opti.subject_to(x[j*self.n_x:(j+1)*self.n_x,i+1] == f_dt(x[j*self.n_x:(j+1)*self.n_x,i], u[j*self.n_u:(j+1)*self.n_u,i]))
 
                 if i < N-1:
                     opti.subject_to(opti.bounded(ddf_lim[0]*self.dt, u[j*self.n_u+0,i+1]-u[j*self.n_u+0,i], ddf_lim[1]*self.dt))
@@ -257,10 +281,8 @@ class NL_FTOCP(object):
             if self.H is not None:
                 opti.subject_to(ca.mtimes(self.H, u[:,i]) <= self.g)
 
-            if expl_constraints is not None:
-                V = expl_constraints[i][0]
-                w = expl_constraints[i][1]
-                opti.subject_to(ca.mtimes(V, x[:2,i]) + w <= np.zeros(len(w)))
+            if n_h > 0:
+                opti.subject_to(ca.mtimes(V[i], x[:2,i]) + w[i] <= np.zeros(n_h))
 
             # Collision avoidance constraint
             for p in pairs:
@@ -272,21 +294,65 @@ class NL_FTOCP(object):
         total_cost = stage_cost + slack_cost
         opti.minimize(total_cost)
 
-        solver_opts = {
-            "mu_strategy" : "adaptive",
-            "mu_init" : 1e-5,
-            "mu_min" : 1e-15,
-            "barrier_tol_factor" : 1,
-            "print_level" : 0,
-            "linear_solver" : "ma27"
-            }
-        # solver_opts = {}
-        plugin_opts = {"verbose" : False, "print_time" : False, "print_out" : False}
-        opti.solver('ipopt', plugin_opts, solver_opts)
+        opti.solver('ipopt', self.plugin_opts, self.solver_opts)
 
-        sol = opti.solve()
+        solver = {'opti' : opti, 'x' : x, 'u' : u, 'slack' : slack,
+            'x_0' : x_0, 'x_ss' : x_ss, 'last_u' : last_u, 'V' : V, 'w' : w,
+            'N' : N, 'n_h' : n_h, 'cost' : stage_cost}
 
-        slack_val = sol.value(slack)
+        return solver
+
+    def get_opti_solver(self, N, n_h=0):
+        # Look up the cached parametric solver for this horizon length and number of halfspaces, build it on a miss
+        if (N, n_h) not in self.opti_solvers:
+            self.opti_solvers[(N, n_h)] = self.build_opti_solver(N, n_h=n_h)
+        return self.opti_solvers[(N, n_h)]
+
+    def solve_opti(self, abs_t, x_0, x_ss, N, last_u, x_guess=None, u_guess=None, expl_constraints=None, verbose=False):
+        if expl_constraints is not None:
+            n_h = max([len(expl_constraints[i][1]) for i in range(N)])
+        else:
+            n_h = 0
+        solver = self.get_opti_solver(N, n_h=n_h)
+        opti = solver['opti']
+
+        opti.set_value(solver['x_0'], np.squeeze(x_0))
+        opti.set_value(solver['x_ss'], np.squeeze(x_ss))
+        opti.set_value(solver['last_u'], last_u)
+
+        # Time steps with fewer halfspaces are padded with trivially satisfied constraints (0'x - 1 <= 0)
+        if n_h > 0:
+            for i in range(N):
+                V = np.zeros((n_h, 2))
+                w = -np.ones(n_h)
+                n_h_i = len(expl_constraints[i][1])
+                if n_h_i > 0:
+                    V[:n_h_i] = expl_constraints[i][0]
+                    w[:n_h_i] = expl_constraints[i][1]
+                opti.set_value(solver['V'][i], V)
+                opti.set_value(solver['w'][i], w)
+
+        # Initial guesses are always reset since the opti object persists across solves
+        if x_guess is not None:
+            opti.set_initial(solver['x'], x_guess)
+        else:
+            opti.set_initial(solver['x'], np.zeros((self.n_x*self.n_a, N+1)))
+        if u_guess is not None:
+            opti.set_initial(solver['u'], u_guess)
+        else:
+            opti.set_initial(solver['u'], np.zeros((self.n_u*self.n_a, N)))
+        opti.set_initial(solver['slack'], np.zeros(self.n_x*self.n_a))
+        # Multipliers of the last solve are otherwise kept as the initial dual guess of the next one
+        opti.set_initial(opti.lam_g, np.zeros(opti.lam_g.shape[0]))
+
+        # Solves which stop early return their last iterate, solves which fail (e.g. infeasible safe set points) raise and
+        # their last iterate is read through the debug interface instead. Both are rejected below
+        try:
+            sol = opti.solve_limited()
+        except RuntimeError:
+            sol = opti.debug
+
+        slack_val = sol.value(solver['slack'])
         slack_valid = True
         for j in range(self.n_a):
             if la.norm(slack_val[j*self.n_x:(j+1)*self.n_x]) > 2e-8:
@@ -297,9 +363,9 @@ class NL_FTOCP(object):
         if sol.stats()['success'] and slack_valid:
             feasible = True
 
-            x_pred = sol.value(x)
-            u_pred = sol.value(u)
-            sol_cost = sol.value(stage_cost)
+            x_pred = sol.value(solver['x'])
+            u_pred = sol.value(solver['u'])
+            sol_cost = sol.value(solver['cost'])
         else:
             # print(sol.stats()['return_status'])
             # print(opti.debug.show_infeasibilities())
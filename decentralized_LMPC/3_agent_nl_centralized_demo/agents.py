@@ -100,8 +100,8 @@ class Centralized_DT_Kin_Bike_Agent(Centralized_DT_Kin_Bike_Model):
 	def __init__(self, l_r, l_f, w, dt, n_a, col_buf=None,
 		a_lim=[-3.0, 3.0], df_lim=[-0.5, 0.5], x_lim=[-10.0, 10.0],
 		y_lim=[-10.0, 10.0], psi_lim=None, v_lim=[-10.0, 10.0],
-		da_lim=[-7.0, 7.0], ddf_lim=[-0.7, 0.7]):
-		super(Centralized_DT_Kin_Bike_Agent, self).__init__(l_r, l_f, dt, n_a)
+		da_lim=[-7.0, 7.0], ddf_lim=[-0.7, 0.7], integrator='euler', n_steps=1):
+		super(Centralized_DT_Kin_Bike_Agent, self).__init__(l_r, l_f, dt, n_a, integrator=integrator, n_steps=n_steps)
 
 		self.w = w
 		self.l = l_r + l_f
@@ -1,6 +1,9 @@
 import numpy as np
+import casadi as ca
 from scipy import linalg as sla
 
+from utils.kin_bike_dynamics import INTEGRATORS, get_kin_bike_step_function
+
 class DT_Kin_Bike_Model(object):
 
     def __init__(self, l_r, l_f, dt):
@@ -91,7 +94,10 @@ class DT_Kin_Bike_Model(object):
         return A_d, B_d, c_d
 
 class Centralized_DT_Kin_Bike_Model(object):
-    def __init__(self, l_r, l_f, dt, n_a):
+    def __init__(self, l_r, l_f, dt, n_a, integrator='euler', n_steps=1):
+        if integrator not in INTEGRATORS:
+            raise(ValueError('Integrator %s not recognized' % integrator))
+
         self.l_r = l_r
         self.l_f = l_f
         self.dt = dt
@@ -100,7 +106,23 @@ class Centralized_DT_Kin_Bike_Model(object):
         self.n_x = 4
         self.n_u = 2
 
+        # Discretization of the dynamics of each agent used by sim and the FTOCP dynamics constraints
+        self.integrator = integrator
+        self.n_steps = n_steps
+
+    def get_step_function(self):
+        # Step function of a single agent, the agents are decoupled
+        return get_kin_bike_step_function(self.l_r, self.l_f, self.dt,
+            integrator=getattr(self, 'integrator', 'euler'),
+            n_steps=getattr(self, 'n_steps', 1))
+
     def sim(self, x_k, u_k):
+        if getattr(self, 'integrator', 'euler') != 'euler':
+            # All agents are stepped in one call of the step function mapped over the agents
+            f = self.get_step_function().map(self.n_a)
+            x_kp1 = f(np.reshape(x_k, (self.n_a, self.n_x)).T, np.reshape(u_k, (self.n_a, self.n_u)).T)
+            return np.array(x_kp1).T.ravel()
+
         x_kp1 = np.zeros(self.n_x*self.n_a)
         for i in range(self.n_a):
             beta = np.arctan2(self.l_r*np.tan(u_k[i*self.n_u+0]), self.l_f + self.l_r)
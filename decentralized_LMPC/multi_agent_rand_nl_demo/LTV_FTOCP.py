@@ -6,9 +6,14 @@ import scipy as sp
 import cvxpy as cp
 import itertools, sys, pdb
 
+from utils.prediction_buffer import Prediction_Buffer
+
 class LTV_FTOCP(object):
 
-	def __init__(self, Q, P, R, Rd, N, agent, x_refs=None, obstacles=[]):
+	def __init__(self, Q, P, R, Rd, N, agent, x_refs=None, obstacles=[], pred_capacity=1, pred_spill_prefix=None, solver='MOSEK'):
+		if solver not in ['MOSEK', 'OSQP', 'ECOS']:
+			raise(ValueError('Solver %s not recognized' % solver))
+
 		self.Q = Q
 		self.P = P
 		self.R = R
@@ -35,43 +40,64 @@ class LTV_FTOCP(object):
 
 		self.cost = []
 
-		self.x_preds = np.zeros((self.n_x, self.N+1, 1))
-		self.u_preds = np.zeros((self.n_u, self.N, 1))
-
-	def solve(self, x_0, abs_t, verbose=False):
+		# QP solver and the parametric problem, which is built on the first solve
+		self.solver = solver
+		self.problem = None
+
+		# Only the latest prediction is needed for linearization, older ones are kept up to pred_capacity and optionally
+		# spilled to disk at pred_spill_prefix
+		x_spill = None if pred_spill_prefix is None else pred_spill_prefix + '_x_preds.bin'
+		u_spill = None if pred_spill_prefix is None else pred_spill_prefix + '_u_preds.bin'
+		self.x_preds = Prediction_Buffer((self.n_x, self.N+1), capacity=pred_capacity, spill_path=x_spill, init=np.zeros((self.n_x, self.N+1)))
+		self.u_preds = Prediction_Buffer((self.n_u, self.N), capacity=pred_capacity, spill_path=u_spill, init=np.zeros((self.n_u, self.N)))
+
+	def __getstate__(self):
+		# The compiled problem is rebuilt on first use after unpickling
+		state = self.__dict__.copy()
+		state['problem'] = None
+		return state
+
+	"""
+	The FTOCP is built once as a DPP compliant cvxpy problem, i.e. one which cvxpy only canonicalizes on the first solve.
+	The linearized dynamics x_i+1 = x_i + A_i x_i + B_i u_i + d_i, the initial state, the last applied input and the
+	reference are parameters which are updated before each solve
+	"""
+	def build_problem(self):
 		x = cp.Variable((self.n_x, self.N+1))
 		u = cp.Variable((self.n_u, self.N))
+		# Deviation from the reference, the quadratic forms of parameter dependent expressions are not DPP for QP solvers
+		x_err = cp.Variable((self.n_x, self.N+1))
 
-		if len(self.obstacles) > 0:
-			M = 1000
+		params = {'x_0' : cp.Parameter(self.n_x), 'last_u' : cp.Parameter(self.n_u), 'x_ref' : cp.Parameter(self.n_x),
+			'A' : [cp.Parameter((self.n_x, self.n_x)) for _ in range(self.N)],
+			'B' : [cp.Parameter((self.n_x, self.n_u)) for _ in range(self.N)],
+			'd' : [cp.Parameter(self.n_x) for _ in range(self.N)]}
 
 		da_lim = self.agent.da_lim[1]
 		ddf_lim = self.agent.ddf_lim[1]
 
 		# Initial condition
-		constr = [x[:,0] == np.squeeze(x_0)]
-		constr += [cp.abs(u[0,0]-self.u_preds[0,0,-1]) <= ddf_lim*self.dt] # Steering rate
-		constr += [cp.abs(u[1,0]-self.u_preds[1,0,-1]) <= da_lim*self.dt] # Throttle rate
+		constr = [x[:,0] == params['x_0']]
+		constr += [cp.abs(u[0,0]-params['last_u'][0]) <= ddf_lim*self.dt] # Steering rate
+		constr += [cp.abs(u[1,0]-params['last_u'][1]) <= da_lim*self.dt] # Throttle rate
 
 		cost = 0
 
+		constr += [x_err[:,i] == x[:,i] - params['x_ref'] for i in range(self.N+1)]
+
 		# Horizon constraints
 		for i in range(self.N):
 			# Time varying dynamics constraints
-			x_lin = self.x_preds[:,i,-1]
-			u_lin = self.u_preds[:,i,-1]
-			A, B, c = self.agent.get_jacobians(x_lin, u_lin, 0.0001)
-
-			constr += [x[:,i+1] == (np.eye(self.n_x) + A)*x[:,i] - A.dot(x_lin) + B*(u[:,i]-u_lin) + c]
+			constr += [x[:,i+1] == x[:,i] + params['A'][i] @ x[:,i] + params['B'][i] @ u[:,i] + params['d'][i]]
 
 			# State and input constraints
 			if self.F is not None:
-				constr += [self.F*x[:,i] <= self.b]
+				constr += [self.F @ x[:,i] <= self.b]
 			if self.H is not None:
-				constr += [self.H*u[:,i] <= self.g]
+				constr += [self.H @ u[:,i] <= self.g]
 
 			# Stage cost
-			cost += cp.quad_form(x[:,i]-self.x_refs[self.x_refs_idx], self.Q) + cp.quad_form(u[:,i], self.R)
+			cost += cp.quad_form(x_err[:,i], self.Q) + cp.quad_form(u[:,i], self.R)
 			if i < self.N-1:
 				constr += [cp.abs(u[0,i+1]-u[0,i]) <= ddf_lim*self.dt] # Steering rate
 				constr += [cp.abs(u[1,i+1]-u[1,i]) <= da_lim*self.dt] # Throttle rate
@@ -79,13 +105,39 @@ class LTV_FTOCP(object):
 
 		# Terminal state constraints
 		if self.F is not None:
-			constr += [self.F*x[:,self.N] <= self.b]
+			constr += [self.F @ x[:,self.N] <= self.b]
 		# Terminal cost
-		cost += cp.quad_form(x[:,self.N]-self.x_refs[self.x_refs_idx], self.P)
+		cost += cp.quad_form(x_err[:,self.N], self.P)
 
-		# Solve the Finite Time Optimal Control Problem
 		problem = cp.Problem(cp.Minimize(cost), constr)
-		problem.solve(solver=cp.MOSEK, verbose=verbose)
+		if not problem.is_dpp():
+			raise(ValueError('LTV FTOCP is not DPP compliant'))
+
+		self.problem = {'problem' : problem, 'x' : x, 'u' : u, 'cost' : cost, 'params' : params}
+
+	def solve(self, x_0, abs_t, verbose=False):
+		if getattr(self, 'problem', None) is None:
+			self.build_problem()
+		problem = self.problem['problem']
+		x = self.problem['x']
+		u = self.problem['u']
+		params = self.problem['params']
+
+		# Linearize about the previous solution along the whole horizon in one call
+		x_lin = self.x_preds[-1][:,:self.N]
+		u_lin = self.u_preds[-1]
+		A_lin, B_lin, c_lin = self.agent.get_jacobians_batch(x_lin, u_lin)
+
+		params['x_0'].value = np.squeeze(x_0)
+		params['last_u'].value = u_lin[:,0]
+		params['x_ref'].value = self.x_refs[self.x_refs_idx]
+		for i in range(self.N):
+			params['A'][i].value = A_lin[i]
+			params['B'][i].value = B_lin[i]
+			params['d'][i].value = c_lin[i] - A_lin[i].dot(x_lin[:,i]) - B_lin[i].dot(u_lin[:,i])
+
+		# Solve the Finite Time Optimal Control Problem, warm started from the previous solution for OSQP
+		problem.solve(solver=getattr(cp, self.solver), warm_start=True, verbose=verbose)
 
 		if problem.status != cp.OPTIMAL:
 			if problem.status == cp.INFEASIBLE:
@@ -99,11 +151,11 @@ class LTV_FTOCP(object):
 			elif problem.status == cp.OPTIMAL_INACCURATE:
 				print('Optimization was optimal inaccurate for time %g' % abs_t)
 
-		self.cost.append(cost.value)
+		self.cost.append(self.problem['cost'].value)
 
 		if x.value is not None and u.value is not None:
-			self.x_preds = np.append(self.x_preds, np.expand_dims(x.value, axis=-1), axis=-1)
-			self.u_preds = np.append(self.u_preds, np.expand_dims(u.value, axis=-1), axis=-1)
+			self.x_preds.append(x.value)
+			self.u_preds.append(u.value)
 		else:
 			print('Optimization variables returned None')
 			print(problem.status)
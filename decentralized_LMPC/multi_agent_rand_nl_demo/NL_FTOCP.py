@@ -5,8 +5,10 @@ import numpy.linalg as la
 import pdb
 
 class NL_FTOCP(object):
-    def __init__(self, agent):
+    def __init__(self, agent, warm_start_duals=False, hull_capacity=16):
         self.agent = agent
+        # Initialize IPOPT from the constraint multipliers passed in to the solve functions
+        self.warm_start_duals = warm_start_duals
 
         self.n_x = self.agent.n_x
         self.n_u = self.agent.n_u
@@ -86,170 +88,279 @@ class NL_FTOCP(object):
             self.input_rate_lb += [-1000.0]
             self.input_rate_ub += [1000.0]
 
-        self.cost = None
-        self.opti = None
-        self.x_s = None
-        self.x_f = None
-        self.x = None
-        self.u = None
-
-        self.opti0 = None
-        self.cost0 = None
-        self.x_s0 = None
-        self.x_f0 = None
-        self.x0 = None
-        self.u0 = None
-
-    def solve_opti(self, abs_t, x_0, x_ss, N, last_u, x_guess=None, u_guess=None, expl_constraints=None, verbose=False):
+        # Parametric solvers are built once per horizon length and number of exploration halfspaces and then reused
+        # for every safe set point and time step, only parameter values and initial guesses change between solves
+        self.opti_solvers = {}
+        self.opti0_solvers = {}
+        # Safe sets of the relaxed terminal set formulation are padded to this number of points, it is doubled whenever a
+        # larger safe set is passed in so that only a few hull solvers are ever built
+        self.hull_capacity = hull_capacity
+
+        self.solver_opts = {
+            "mu_strategy" : "adaptive",
+            "mu_init" : 1e-5,
+            "mu_min" : 1e-15,
+            "barrier_tol_factor" : 1,
+            "print_level" : 0,
+            "linear_solver" : "ma27"
+            }
+        self.plugin_opts = {"verbose" : False, "print_time" : False, "print_out" : False}
+
+    def __getstate__(self):
+        # CasADi solver objects cannot be pickled, they are rebuilt on demand after unpickling
+        state = self.__dict__.copy()
+        state['opti_solvers'] = {}
+        state['opti0_solvers'] = {}
+        return state
+
+    def build_opti_solver(self, N, n_h=0, rate_con=True, n_ss=None, warm=False):
+        """
+        Build a parametric NLP for horizon N with n_h exploration halfspaces per time step. The initial state, terminal
+        safe set point, last applied input (if rate_con) and the exploration halfspaces are opti parameters. If n_ss is
+        given, the terminal state is instead constrained to the convex hull of up to n_ss safe set points with the terminal
+        cost given by barycentric interpolation of their cost-to-go, both of which are then parameters. The upper bounds of
+        the multipliers are parameters as well, unused points are masked by setting their bound to zero
+        """
         opti = ca.Opti()
 
         x = opti.variable(self.n_x, N+1)
         u = opti.variable(self.n_u, N)
         slack = opti.variable(self.n_x)
 
-        if x_guess is not None:
-            opti.set_initial(x, x_guess)
-        if u_guess is not None:
-            opti.set_initial(u, u_guess)
-        opti.set_initial(slack, np.zeros(self.n_x))
+        x_0 = opti.parameter(self.n_x)
+        if n_ss is None:
+            x_ss = opti.parameter(self.n_x)
+            SS, Qfun, lamb, lamb_ub = None, None, None, None
+        else:
+            x_ss = None
+            SS = opti.parameter(self.n_x, n_ss)
+            Qfun = opti.parameter(n_ss)
+            lamb = opti.variable(n_ss)
+            lamb_ub = opti.parameter(n_ss)
+        last_u = opti.parameter(self.n_u) if rate_con else None
+        V = [opti.parameter(n_h, 2) for _ in range(N)] if n_h > 0 else []
+        w = [opti.parameter(n_h) for _ in range(N)] if n_h > 0 else []
 
         da_lim = self.agent.da_lim
         ddf_lim = self.agent.ddf_lim
 
-        opti.subject_to(x[:,0] == np.squeeze(x_0))
-        opti.subject_to(opti.bounded(ddf_lim[0]*self.dt, u[0,0]-last_u[0], ddf_lim[1]*self.dt))
-        opti.subject_to(opti.bounded(da_lim[0]*self.dt, u[1,0]-last_u[1], da_lim[1]*self.dt))
+        opti.subject_to(x[:,0] == x_0)
+        if rate_con:
+            opti.subject_to(opti.bounded(ddf_lim[0]*self.dt, u[0,0]-last_u[0], ddf_lim[1]*self.dt))
+            opti.subject_to(opti.bounded(da_lim[0]*self.dt, u[1,0]-last_u[1], da_lim[1]*self.dt))
+
+        # Discrete dynamics with the integrator of the agent
+        f_dt = self.agent.get_step_function()
 
         stage_cost = 0
         for i in range(N):
             stage_cost = stage_cost + 1
 
-            beta = ca.atan2(self.l_r*ca.tan(u[0,i]), self.l_f+self.l_r)
-            opti.subject_to(x[0,i+1] == x[0,i] + self.dt*x[3,i]*ca.cos(x[2,i] + beta))
-            opti.subject_to(x[1,i+1] == x[1,i] + self.dt*x[3,i]*ca.sin(x[2,i] + beta))
-            opti.subject_to(x[2,i+1] == x[2,i] + self.dt*x[3,i]*ca.sin(beta))
-            opti.subject_to(x[3,i+1] == x[3,i] + self.dt*u[1,i])
+            opti.subject_to(x[:,i+1] == f_dt(x[:,i], u[:,i]))
 
             if self.F is not None:
                 opti.subject_to(ca.mtimes(self.F, x[:,i]) <= self.b)
             if self.H is not None:
                 opti.subject_to(ca.mtimes(self.H, u[:,i]) <= self.g)
 
-            if expl_constraints is not None:
-                V = expl_constraints[i][0]
-                w = expl_constraints[i][1]
-                opti.subject_to(ca.mtimes(V, x[:2,i]) + w <= np.zeros(len(w)))
+            if n_h > 0:
+                opti.subject_to(ca.mtimes(V[i], x[:2,i]) + w[i] <= np.zeros(n_h))
 
             if i < N-1:
                 opti.subject_to(opti.bounded(ddf_lim[0]*self.dt, u[0,i+1]-u[0,i], ddf_lim[1]*self.dt))
                 opti.subject_to(opti.bounded(da_lim[0]*self.dt, u[1,i+1]-u[1,i], da_lim[1]*self.dt))
 
-        opti.subject_to(x[:,N] - x_ss == slack)
+        if n_ss is None:
+            opti.subject_to(x[:,N] - x_ss == slack)
+            sol_cost = stage_cost
+        else:
+            # Terminal state in ConvHull(SS), cost-to-go from barycentric interpolation of Qfun
+            opti.subject_to(opti.bounded(0, lamb, lamb_ub))
+            opti.subject_to(ca.sum1(lamb) == 1)
+            opti.subject_to(x[:,N] - ca.mtimes(SS, lamb) == slack)
+            sol_cost = stage_cost + ca.dot(Qfun, lamb)
 
         slack_cost = 1e6*ca.sumsqr(slack)
-        total_cost = stage_cost + slack_cost
+        total_cost = sol_cost + slack_cost
         opti.minimize(total_cost)
 
-        solver_opts = {
-            "mu_strategy" : "adaptive",
-            "mu_init" : 1e-5,
-            "mu_min" : 1e-15,
-            "barrier_tol_factor" : 1,
-            "print_level" : 0,
-            "linear_solver" : "ma27"
-            }
-        # solver_opts = {}
-        plugin_opts = {"verbose" : False, "print_time" : False, "print_out" : False}
-        opti.solver('ipopt', plugin_opts, solver_opts)
+        # Warm solvers start IPOPT from the primal and dual initial guesses, which is only useful when duals are known
+        solver_opts = dict(self.solver_opts)
+        if warm:
+            solver_opts["warm_start_init_point"] = "yes"
+        opti.solver('ipopt', self.plugin_opts, solver_opts)
 
-        sol = opti.solve()
+        solver = {'opti' : opti, 'x' : x, 'u' : u, 'slack' : slack,
+            'x_0' : x_0, 'x_ss' : x_ss, 'last_u' : last_u, 'V' : V, 'w' : w,
+            'SS' : SS, 'Qfun' : Qfun, 'lamb' : lamb, 'lamb_ub' : lamb_ub,
+            'N' : N, 'n_h' : n_h, 'n_ss' : n_ss, 'warm' : warm, 'cost' : sol_cost}
 
-        slack_val = sol.value(slack)
-        if la.norm(slack_val) > 1e-6:
-            print('Warning! Solved, but with slack norm of %g is greater than 1e-8!' % la.norm(slack_val))
+        return solver
 
-        if sol.stats()['success'] and la.norm(slack_val) <= 1e-6:
-            print('Solve success, with slack norm of %g!' % la.norm(slack_val))
-            feasible = True
-
-            x_pred = sol.value(x)
-            u_pred = sol.value(u)
-            sol_cost = sol.value(stage_cost)
-        else:
-            # print(sol.stats()['return_status'])
-            # print(opti.debug.show_infeasibilities())
-            feasible = False
-            x_pred = None
-            u_pred = None
-            sol_cost = None
-
-            # pdb.set_trace()
+    def get_constraint_blocks(self, N, n_h=0, rate_con=True, n_ss=None):
+        """
+        Returns the sizes of the blocks of the scalarized constraint vector of the NLP from build_opti_solver in the order
+        they are declared: [initial, step 0, ..., step N-1, terminal]
+        """
+        n_F = self.F.shape[0] if self.F is not None else 0
+        n_H = self.H.shape[0] if self.H is not None else 0
 
+        blocks = [self.n_x + (2 if rate_con else 0)]
+        for i in range(N):
+            blocks.append(self.n_x + n_F + n_H + n_h + (2 if i < N-1 else 0))
+        blocks.append(self.n_x if n_ss is None else n_ss + 1 + self.n_x)
+
+        return blocks
+
+    def shift_duals(self, lam_g, N, n_h=0, rate_con_prev=True, rate_con=True):
+        """
+        Shift the constraint multipliers of a solution with horizon N forward by one time step for use as the initial dual
+        guess of the next time step. The multipliers of step i+1 are moved to step i, blocks which change size are copied
+        up to their common length and the remaining entries are set to zero
+        """
+        blocks_prev = self.get_constraint_blocks(N, n_h=n_h, rate_con=rate_con_prev)
+        blocks = self.get_constraint_blocks(N, n_h=n_h, rate_con=rate_con)
+        starts_prev = np.cumsum([0] + blocks_prev)
+        starts = np.cumsum([0] + blocks)
+        if len(lam_g) != starts_prev[-1]:
+            return None
+
+        # Block index in the previous solution for each block of the shifted solution
+        src_blocks = [0] + [min(i+2, N) for i in range(N)] + [N+1]
+
+        lam_g_shift = np.zeros(starts[-1])
+        for (k, l) in enumerate(src_blocks):
+            n = min(blocks[k], blocks_prev[l])
+            lam_g_shift[starts[k]:starts[k]+n] = lam_g[starts_prev[l]:starts_prev[l]+n]
+
+        return lam_g_shift
+
+    def get_opti_solver(self, N, n_h=0, rate_con=True, n_ss=None, warm=False):
+        # Look up the cached parametric solver for this horizon length, number of halfspaces, terminal set capacity and
+        # warm start, build it on a miss
+        solvers = self.opti_solvers if rate_con else self.opti0_solvers
+        if n_ss is not None:
+            n_ss = self.get_hull_capacity(n_ss)
+        if (N, n_h, n_ss, warm) not in solvers:
+            solvers[(N, n_h, n_ss, warm)] = self.build_opti_solver(N, n_h=n_h, rate_con=rate_con, n_ss=n_ss, warm=warm)
+        return solvers[(N, n_h, n_ss, warm)]
+
+    def get_hull_capacity(self, n_ss):
+        # Grow the capacity to fit n_ss points, hull solvers of the previous capacity can no longer be looked up and are
+        # dropped
+        if n_ss > self.hull_capacity:
+            while n_ss > self.hull_capacity:
+                self.hull_capacity *= 2
+            for solvers in [self.opti_solvers, self.opti0_solvers]:
+                for key in [k for k in solvers.keys() if k[2] is not None]:
+                    del solvers[key]
+        return self.hull_capacity
+
+    def solve_opti(self, abs_t, x_0, x_ss, N, last_u, x_guess=None, u_guess=None, expl_constraints=None, lam_g_guess=None, return_duals=False, verbose=False):
+        n_h = self.get_num_halfspaces(expl_constraints, N)
+        solver = self.get_opti_solver(N, n_h=n_h, rate_con=True, warm=self.is_warm(lam_g_guess))
+        solver['opti'].set_value(solver['last_u'], last_u)
+        solver['opti'].set_value(solver['x_ss'], np.squeeze(x_ss))
+
+        x_pred, u_pred, sol_cost, _, lam_g = self._solve_parametric(solver, x_0, x_guess, u_guess, expl_constraints, lam_g_guess)
+
+        if return_duals:
+            return x_pred, u_pred, sol_cost, lam_g
         return x_pred, u_pred, sol_cost
 
-    def solve_opti0(self, abs_t, x_0, x_ss, N, x_guess=None, u_guess=None, expl_constraints=None, verbose=False):
-        opti = ca.Opti()
+    def solve_opti0(self, abs_t, x_0, x_ss, N, x_guess=None, u_guess=None, expl_constraints=None, lam_g_guess=None, return_duals=False, verbose=False):
+        n_h = self.get_num_halfspaces(expl_constraints, N)
+        solver = self.get_opti_solver(N, n_h=n_h, rate_con=False, warm=self.is_warm(lam_g_guess))
+        solver['opti'].set_value(solver['x_ss'], np.squeeze(x_ss))
 
-        x = opti.variable(self.n_x, N+1)
-        u = opti.variable(self.n_u, N)
-        slack = opti.variable(self.n_x)
+        x_pred, u_pred, sol_cost, _, lam_g = self._solve_parametric(solver, x_0, x_guess, u_guess, expl_constraints, lam_g_guess)
+
+        if return_duals:
+            return x_pred, u_pred, sol_cost, lam_g
+        return x_pred, u_pred, sol_cost
 
+    def solve_opti_hull(self, abs_t, x_0, SS, Qfun, N, last_u=None, x_guess=None, u_guess=None, expl_constraints=None, verbose=False):
+        """
+        Relaxed terminal set formulation, a single solve with the terminal state in the convex hull of the columns of SS.
+        The returned cost includes the interpolated terminal cost. If last_u is None, the input rate is not constrained
+        at the first step (as in solve_opti0). Also returns the convex multipliers lamb of the columns of SS
+        """
+        n_h = self.get_num_halfspaces(expl_constraints, N)
+        n_ss = SS.shape[1]
+        solver = self.get_opti_solver(N, n_h=n_h, rate_con=(last_u is not None), n_ss=n_ss)
+        if last_u is not None:
+            solver['opti'].set_value(solver['last_u'], last_u)
+
+        # Pad the safe set to the capacity of the solver, the multipliers of the padding points are fixed to zero
+        n_cap = solver['n_ss']
+        SS_pad = np.zeros((self.n_x, n_cap))
+        SS_pad[:,:n_ss] = SS
+        Qfun_pad = np.zeros(n_cap)
+        Qfun_pad[:n_ss] = Qfun
+        lamb_ub = np.zeros(n_cap)
+        lamb_ub[:n_ss] = 1
+        solver['opti'].set_value(solver['SS'], SS_pad)
+        solver['opti'].set_value(solver['Qfun'], Qfun_pad)
+        solver['opti'].set_value(solver['lamb_ub'], lamb_ub)
+        solver['opti'].set_initial(solver['lamb'], lamb_ub/n_ss)
+
+        x_pred, u_pred, sol_cost, lamb_pred, _ = self._solve_parametric(solver, x_0, x_guess, u_guess, expl_constraints)
+        if lamb_pred is not None:
+            lamb_pred = np.atleast_1d(lamb_pred)[:n_ss]
+
+        return x_pred, u_pred, sol_cost, lamb_pred
+
+    def is_warm(self, lam_g_guess):
+        # Candidates are only warm started if shifted duals of their previous solution exist, all others are solved cold
+        return self.warm_start_duals and lam_g_guess is not None
+
+    def get_num_halfspaces(self, expl_constraints, N):
+        if expl_constraints is None:
+            return 0
+        return max([len(expl_constraints[i][1]) for i in range(N)])
+
+    def _solve_parametric(self, solver, x_0, x_guess, u_guess, expl_constraints, lam_g_guess=None):
+        opti = solver['opti']
+        N = solver['N']
+        n_h = solver['n_h']
+
+        opti.set_value(solver['x_0'], np.squeeze(x_0))
+
+        # Time steps with fewer halfspaces are padded with trivially satisfied constraints (0'x - 1 <= 0)
+        if n_h > 0:
+            for i in range(N):
+                V = np.zeros((n_h, 2))
+                w = -np.ones(n_h)
+                n_h_i = len(expl_constraints[i][1])
+                if n_h_i > 0:
+                    V[:n_h_i] = expl_constraints[i][0]
+                    w[:n_h_i] = expl_constraints[i][1]
+                opti.set_value(solver['V'][i], V)
+                opti.set_value(solver['w'][i], w)
+
+        # Initial guesses are always reset since the opti object persists across solves
         if x_guess is not None:
-            opti.set_initial(x, x_guess)
+            opti.set_initial(solver['x'], x_guess)
+        else:
+            opti.set_initial(solver['x'], np.zeros((self.n_x, N+1)))
         if u_guess is not None:
-            opti.set_initial(u, u_guess)
-        opti.set_initial(slack, np.zeros(self.n_x))
-
-        da_lim = self.agent.da_lim
-        ddf_lim = self.agent.ddf_lim
-
-        opti.subject_to(x[:,0] == np.squeeze(x_0))
-
-        stage_cost = 0
-        for i in range(N):
-            stage_cost = stage_cost + 1
-
-            beta = ca.atan2(self.l_r*ca.tan(u[0,i]), self.l_f+self.l_r)
-            opti.subject_to(x[0,i+1] == x[0,i] + self.dt*x[3,i]*ca.cos(x[2,i] + beta))
-            opti.subject_to(x[1,i+1] == x[1,i] + self.dt*x[3,i]*ca.sin(x[2,i] + beta))
-            opti.subject_to(x[2,i+1] == x[2,i] + self.dt*x[3,i]*ca.sin(beta))
-            opti.subject_to(x[3,i+1] == x[3,i] + self.dt*u[1,i])
-
-            if self.F is not None:
-                opti.subject_to(ca.mtimes(self.F, x[:,i]) <= self.b)
-            if self.H is not None:
-                opti.subject_to(ca.mtimes(self.H, u[:,i]) <= self.g)
-
-            if expl_constraints is not None:
-                V = expl_constraints[i][0]
-                w = expl_constraints[i][1]
-                opti.subject_to(ca.mtimes(V, x[:2,i]) + w <= np.zeros(len(w)))
-
-            if i < N-1:
-                opti.subject_to(opti.bounded(ddf_lim[0]*self.dt, u[0,i+1]-u[0,i], ddf_lim[1]*self.dt))
-                opti.subject_to(opti.bounded(da_lim[0]*self.dt, u[1,i+1]-u[1,i], da_lim[1]*self.dt))
-
-        opti.subject_to(x[:,N] - x_ss == slack)
-
-        slack_cost = 1e6*ca.sumsqr(slack)
-        total_cost = stage_cost + slack_cost
-        opti.minimize(total_cost)
-
-        solver_opts = {
-            "mu_strategy" : "adaptive",
-            "mu_init" : 1e-5,
-            "mu_min" : 1e-15,
-            "barrier_tol_factor" : 1,
-            "print_level" : 0,
-            "linear_solver" : "ma27"
-            }
-        # solver_opts = {}
-        plugin_opts = {"verbose" : False, "print_time" : False, "print_out" : False}
-        opti.solver('ipopt', plugin_opts, solver_opts)
+            opti.set_initial(solver['u'], u_guess)
+        else:
+            opti.set_initial(solver['u'], np.zeros((self.n_u, N)))
+        opti.set_initial(solver['slack'], np.zeros(self.n_x))
+        if solver['warm']:
+            opti.set_initial(opti.lam_g, lam_g_guess)
+        else:
+            opti.set_initial(opti.lam_g, np.zeros(opti.lam_g.shape[0]))
 
-        sol = opti.solve()
+        # Solves which stop early return their last iterate, solves which fail (e.g. infeasible safe set points) raise and
+        # their last iterate is read through the debug interface instead. Both are rejected below
+        try:
+            sol = opti.solve_limited()
+        except RuntimeError:
+            sol = opti.debug
 
-        slack_val = sol.value(slack)
+        slack_val = sol.value(solver['slack'])
         if la.norm(slack_val) > 1e-6:
             print('Warning! Solved, but with slack norm of %g is greater than 1e-8!' % la.norm(slack_val))
 
@@ -257,9 +368,11 @@ class NL_FTOCP(object):
             print('Solve success, with slack norm of %g!' % la.norm(slack_val))
             feasible = True
 
-            x_pred = sol.value(x)
-            u_pred = sol.value(u)
-            sol_cost = sol.value(stage_cost)
+            x_pred = sol.value(solver['x'])
+            u_pred = sol.value(solver['u'])
+            sol_cost = sol.value(solver['cost'])
+            lamb_pred = sol.value(solver['lamb']) if solver['n_ss'] is not None else None
+            lam_g = sol.value(opti.lam_g)
         else:
             # print(sol.stats()['return_status'])
             # print(opti.debug.show_infeasibilities())
@@ -267,7 +380,9 @@ class NL_FTOCP(object):
             x_pred = None
             u_pred = None
             sol_cost = None
+            lamb_pred = None
+            lam_g = None
 
             # pdb.set_trace()
 
-        return x_pred, u_pred, sol_cost
+        return x_pred, u_pred, sol_cost, lamb_pred, lam_g
@@ -6,6 +6,8 @@ import pdb, copy, sys
 
 import utils.utils
 
+from candidate_executors import Serial_Executor
+
 class NL_LMPC(object):
 	"""Learning Model Predictive Controller (LMPC)
 	Inputs:
@@ -13,10 +15,16 @@ class NL_LMPC(object):
 	Methods:
 		- addTrajectory: adds a trajectory to the safe set SS and update value function
 		- computeCost: computes the cost associated with a feasible trajectory
-		- solve: uses ftocp and the stored data to comptute the predicted trajectory"""
-	def __init__(self, ftocp, N):
+		- solve: uses ftocp and the stored data to comptute the predicted trajectory
+		- export_state/from_state: saves and restores the primary data of the controller"""
+	# Version of the format written by export_state
+	STATE_VERSION = 1
+
+	def __init__(self, ftocp, N, executor=None, ss_search='exhaustive', terminal_set='enumerate', warm_start_cache=False):
 		# Initialization
 		self.ftocp = ftocp
+		# Backend used to solve the FTOCP for each safe set candidate (see candidate_executors)
+		self.executor = executor if executor is not None else Serial_Executor()
 		self.N = N
 		self.ftocp_N = self.N
 		self.ftocp_N_last = self.N
@@ -34,7 +42,17 @@ class NL_LMPC(object):
 		self.x_cls = []
 		self.u_cls = []
 
+		# Closed loop states, inputs and cost-to-go of all iterations packed into contiguous arrays, the data of
+		# iteration j starts at column cl_offsets[j]
+		self.x_cls_packed = np.empty((self.n_x,0))
+		self.u_cls_packed = np.empty((self.n_u,0))
+		self.Qfun_packed = np.empty(0)
+		self.cl_offsets = []
+
 		self.ss_idxs = []
+		self.ss_packed_idxs_t = []
+		# Set when the safe sets need to be rebuilt from ss_idxs before they are used
+		self.ss_stale = False
 
 		self.last_cost = np.inf
 
@@ -50,6 +68,19 @@ class NL_LMPC(object):
 
 		self.expl_constrs = None
 
+		self.set_ss_search(ss_search)
+		self.set_terminal_set(terminal_set)
+		self.set_warm_start_cache(warm_start_cache)
+
+	"""
+	Rebuild the packed closed loop data from the per iteration lists
+	"""
+	def pack_closed_loop_data(self):
+		self.cl_offsets = np.cumsum([0] + [x.shape[1] for x in self.x_cls[:-1]]).astype(int).tolist() if len(self.x_cls) > 0 else []
+		self.x_cls_packed = np.concatenate([np.empty((self.n_x,0))] + self.x_cls, axis=1)
+		self.u_cls_packed = np.concatenate([np.empty((self.n_u,0))] + self.u_cls, axis=1)
+		self.Qfun_packed = np.concatenate([np.empty(0)] + [np.asarray(q).reshape(-1) for q in self.Qfun])
+
 	"""
 	Add state trajectory and input sequence to the set of candidate points for safe set creation
 	"""
@@ -66,10 +97,26 @@ class NL_LMPC(object):
 		self.last_cost = cost[0]
 		self.Qfun.append(cost)
 
+		# Append to the packed closed loop data
+		if len(getattr(self, 'cl_offsets', [])) != len(self.x_cls)-1:
+			self.pack_closed_loop_data()
+		else:
+			self.cl_offsets.append(self.x_cls_packed.shape[1])
+			self.x_cls_packed = np.concatenate((self.x_cls_packed, x), axis=1)
+			self.u_cls_packed = np.concatenate((self.u_cls_packed, u), axis=1)
+			self.Qfun_packed = np.concatenate((self.Qfun_packed, cost))
+
 		# Reset horizon length
 		self.ftocp_N = self.N
 		self.ftocp_N_last = self.N
 
+		# Cached solutions are only valid within an iteration
+		self.ws_cache = {}
+
+		# Reset candidate solve counters
+		self.n_ss_solves = 0
+		self.n_ss_solves_avoided = 0
+
 		# Save best predictions and safe set indicies
 		if self.it > 0:
 			self.x_preds_best.append(self.x_preds_best_it)
@@ -105,6 +152,8 @@ class NL_LMPC(object):
 		return np.flip(cost).tolist()
 
 	def solve(self, ts, x_t, x_f, tol, verbose=True):
+		self.check_safe_sets()
+
 		# Get the safe set, cost-to-go, and indicies at this time step
 		# SS = self.SS_t[min(ts+self.ftocp_N, self.traj_lens[-1]-1)]
 		# Qfun = self.Qfun_t[min(ts+self.ftocp_N, self.traj_lens[-1]-1)]
@@ -127,8 +176,9 @@ class NL_LMPC(object):
 
 		# Form candidate solution
 		if len(self.x_preds_best_it) == 0:
-			if len(self.x_preds_best) == 0:
-				# Use initial feasible trajectory for first timestep of first iteration
+			if len(self.x_preds_best) == 0 or len(self.x_preds_best[-1]) == 0:
+				# Use initial feasible trajectory for first timestep of first iteration, or when the predictions of the last
+				# iteration are not available
 				x_guess = self.x_cls[-1][:,:self.N+1]
 				u_guess = self.u_cls[-1][:,:self.N]
 			else:
@@ -155,53 +205,99 @@ class NL_LMPC(object):
 
 		# pdb.set_trace()
 
-		# Solve for each element in safe set
+		# Collect the safe set points which offer the possibility of cost improvement
+		ss_cands = []
+		if self.ftocp_N == 1:
+			# The rest of the previous solution does not depend on the safe set point, roll out its remaining inputs once
+			u_rem = self.u_preds_best_it[-1][:,1:]
+			x_rem = self.ftocp.agent.rollout(x_t, u_rem)
+			x_tp1 = x_rem[:,-1]
 		for i in range(SS.shape[1]):
-			# pdb.set_trace()
 			x_ss = SS[:,i]
 			term_cost = Qfun[i]
 			idx = idxs[i]
 
-			# We only attempt to solve with safe set points which offer the possibility of cost improvement
 			if self.ftocp_N > 1:
 				if self.ftocp_N + term_cost <= self.last_cost:
-				# if True:
-					if ts == 0:
-						x_pred, u_pred, cost = self.ftocp.solve_opti0(ts, x_t, x_ss, self.ftocp_N,
-							x_guess=x_guess,
-							u_guess=u_guess,
-							expl_constraints=expl_con,
-							verbose=verbose)
-					else:
-						x_pred, u_pred, cost = self.ftocp.solve_opti(ts, x_t, x_ss, self.ftocp_N, last_u,
-							x_guess=x_guess,
-							u_guess=u_guess,
-							expl_constraints=expl_con,
-							verbose=verbose)
-					# x_pred, u_pred, cost = self.ftocp.solve(ts, x_t, x_ss, self.ftocp_N, last_u,
-					# 	x_guess=x_guess,
-					# 	u_guess=u_guess,
-					# 	expl_constraints=expl_con,
-					# 	verbose=verbose)
-					if cost is not None:
-						x_pred_cands.append(x_pred)
-						u_pred_cands.append(u_pred)
-						cost_cands.append(cost + term_cost)
-						idx_cands.append(idx)
-						x_ss_cands.append(x_ss)
+					ss_cands.append((x_ss, term_cost, idx))
 				else:
 					print('No performance improvement possible, skipping...')
 			else:
-				u_t = self.u_preds_best_it[-1][:,1]
-				x_tp1 = self.ftocp.agent.sim(x_t, u_t)
 				# Check for feasibility and store the solution
 				if la.norm(x_tp1 - x_f) <= 10**tol:
 					cost_cands.append(1 + term_cost)
-					x_pred_cands.append(np.hstack((x_t.reshape((-1,1)), x_f.reshape((-1,1)))))
-					u_pred_cands.append(u_t.reshape((-1,1)))
+					x_pred_cands.append(x_rem)
+					u_pred_cands.append(u_rem)
 					idx_cands.append(None)
 					x_ss_cands.append(None)
 
+		if self.terminal_set == 'hull' and len(ss_cands) > 0:
+			# Relaxed terminal set, a single solve with the terminal state in the convex hull of the candidate points.
+			# The safe set point with the largest multiplier is recorded as the selected point
+			SS_cands = np.array([x_ss for (x_ss, _, _) in ss_cands]).T
+			Qfun_cands = np.array([term_cost for (_, term_cost, _) in ss_cands])
+			x_pred, u_pred, cost, lamb = self.ftocp.solve_opti_hull(ts, x_t, SS_cands, Qfun_cands, self.ftocp_N,
+				last_u=(last_u if ts > 0 else None),
+				x_guess=x_guess,
+				u_guess=u_guess,
+				expl_constraints=expl_con,
+				verbose=verbose)
+			if cost is not None:
+				lamb = np.atleast_1d(lamb)
+				x_pred_cands.append(x_pred)
+				u_pred_cands.append(u_pred)
+				cost_cands.append(cost)
+				idx_cands.append(ss_cands[np.argmax(lamb)][2])
+				x_ss_cands.append(SS_cands.dot(lamb))
+		else:
+			if self.ss_search == 'best_first':
+				# Visit candidates in order of their cost lower bound ftocp_N + term_cost, ties are broken by safe set order.
+				# Candidates are solved in batches the size of the executor pool
+				order = np.argsort([self.ftocp_N + term_cost for (_, term_cost, _) in ss_cands], kind='mergesort')
+				ss_cands = [ss_cands[k] for k in order]
+				batch_size = self.executor.n_workers
+			else:
+				batch_size = len(ss_cands)
+
+			# Solve for each candidate safe set point, the solves are independent so they are dispatched to the executor together
+			n_solved = 0
+			while n_solved < len(ss_cands):
+				# Stop once no remaining candidate can improve on the incumbent
+				if self.ss_search == 'best_first' and len(cost_cands) > 0 and np.amin(cost_cands) <= self.ftocp_N + ss_cands[n_solved][1]:
+					break
+
+				batch = ss_cands[n_solved:n_solved+batch_size]
+				jobs = []
+				for (x_ss, _, idx) in batch:
+					job = {'ts' : ts, 'x_t' : x_t, 'x_ss' : x_ss, 'N' : self.ftocp_N, 'last_u' : last_u,
+						'x_guess' : x_guess, 'u_guess' : u_guess, 'expl_constraints' : expl_con, 'verbose' : verbose}
+					if self.warm_start_cache:
+						job.update(self.get_candidate_warm_start(ts, idx, expl_con))
+						job['return_duals'] = self.ftocp.warm_start_duals
+						if job['x_guess'] is None:
+							job['x_guess'], job['u_guess'] = x_guess, u_guess
+					jobs.append(job)
+				sols = self.executor.solve(self.ftocp, jobs)
+
+				for ((x_ss, term_cost, idx), sol) in zip(batch, sols):
+					x_pred, u_pred, cost = sol[:3]
+					if self.warm_start_cache and cost is not None:
+						self.ws_cache[idx] = {'ts' : ts, 'N' : self.ftocp_N,
+							'n_h' : self.ftocp.get_num_halfspaces(expl_con, self.ftocp_N),
+							'x' : x_pred, 'u' : u_pred, 'lam_g' : (sol[3] if len(sol) > 3 else None)}
+					if cost is not None:
+						x_pred_cands.append(x_pred)
+						u_pred_cands.append(u_pred)
+						cost_cands.append(cost + term_cost)
+						idx_cands.append(idx)
+						x_ss_cands.append(x_ss)
+				n_solved += len(batch)
+
+			self.n_ss_solves += n_solved
+			self.n_ss_solves_avoided += len(ss_cands) - n_solved
+			if self.ss_search == 'best_first':
+				print('Best-first search solved %i of %i safe set candidates' % (n_solved, len(ss_cands)))
+
 		if len(cost_cands) > 0:
 			min_idx = np.argmin(cost_cands)
 			x_pred_best = x_pred_cands[min_idx]
@@ -214,13 +310,9 @@ class NL_LMPC(object):
 			self.u_preds_best_it.append(u_pred_best)
 			self.idxs_best_it.append(idx_best)
 		else:
-			print('None of the safe set points are feasible terminal conditions')
-			x_pred_best = None
-			u_pred_best = None
-			cost_best = np.inf
-			pdb.set_trace()
+			raise(RuntimeError('None of the safe set points are feasible terminal conditions at time step %i' % ts))
 
-		if x_pred_best is not None and self.ftocp_N > 1:
+		if self.ftocp_N > 1:
 			self.ftocp_N_last = self.ftocp_N
 			if la.norm(x_pred_best[:,-1] - x_f) <= 10**tol:
 				print('Reaching goal state at end of horizon, decreasing horizon from %i to %i' % (self.ftocp_N, self.ftocp_N-1))
@@ -234,40 +326,188 @@ class NL_LMPC(object):
 
 		return x_pred_best, u_pred_best, cost_best, SS, self.ftocp_N_last
 
+	def get_candidate_warm_start(self, ts, idx, expl_con):
+		"""
+		Warm start for the safe set point idx = (it_idx, ts_idx) from the cached solutions of the last time step. With the
+		same horizon, the solution ending at the predecessor (it_idx, ts_idx-1) is shifted by one step and extended with
+		the recorded state and input of iteration it_idx. If the horizon has shrunk, the solution ending at the same point
+		is shifted instead. Constraint multipliers are only reused in the first case
+		"""
+		ws = {'x_guess' : None, 'u_guess' : None, 'lam_g_guess' : None}
+		it_idx, ts_idx = idx
+		N = self.ftocp_N
+
+		prev = self.ws_cache.get((it_idx, ts_idx-1))
+		if ts_idx > 0 and prev is not None and prev['ts'] == ts-1 and prev['N'] == N:
+			ws['x_guess'] = np.append(prev['x'][:,1:], self.x_cls[it_idx][:,ts_idx].reshape((-1,1)), axis=1)
+			ws['u_guess'] = np.append(prev['u'][:,1:], self.u_cls[it_idx][:,ts_idx-1].reshape((-1,1)), axis=1)
+			n_h = self.ftocp.get_num_halfspaces(expl_con, N)
+			if prev['lam_g'] is not None and prev['n_h'] == n_h:
+				ws['lam_g_guess'] = self.ftocp.shift_duals(prev['lam_g'], N, n_h=n_h, rate_con_prev=(prev['ts'] > 0), rate_con=(ts > 0))
+			return ws
+
+		prev = self.ws_cache.get((it_idx, ts_idx))
+		if prev is not None and prev['ts'] == ts-1 and prev['N'] == N+1:
+			ws['x_guess'] = prev['x'][:,1:]
+			ws['u_guess'] = prev['u'][:,1:]
+
+		return ws
+
 	def get_safe_set_q_func(self):
+		self.check_safe_sets()
 		return (self.SS_t, self.uSS_t, self.Qfun_t)
 
+	def check_safe_sets(self):
+		# Safe sets of a restored state are only built once they are needed
+		if getattr(self, 'ss_stale', False):
+			self.update_safe_sets(self.ss_idxs)
+
 	"""
 	Update the safe sets given time and iteration indicies for each step
 	"""
 	def update_safe_sets(self, ss_idxs):
 		self.ss_idxs = ss_idxs
+		self.ss_stale = False
+
+		# Objects restored from older checkpoints do not carry the packed closed loop data
+		if len(getattr(self, 'cl_offsets', [])) != len(self.x_cls):
+			self.pack_closed_loop_data()
 
 		self.idxs_t = []
+		self.ss_packed_idxs_t = []
 		self.SS_t = []
 		self.uSS_t = []
 		self.Qfun_t = []
 		for t in range(len(self.ss_idxs)-1):
-			ss = np.empty((self.n_x,0))
-			uss = np.empty((self.n_u,0))
-			qfun = np.empty(0)
-			idxs = []
-			for (i, j) in enumerate(self.ss_idxs[t]['it_range']):
-				# Collect states corresponding to iteration and timestep indicies
-				ss = np.append(ss, self.x_cls[j][:,self.ss_idxs[t]['ts_range'][i]], axis=1)
-				# Collect inputs corresponding to iteration and timestep indicies
-				uss = np.append(uss, self.u_cls[j][:,self.ss_idxs[t]['ts_range'][i]], axis=1)
-				# Collect cost-to-gos corresponding to iteration and timestep indicies
-				qfun = np.append(qfun, self.Qfun[j][self.ss_idxs[t]['ts_range'][i]])
-				# Collect iteration and timestep indicies
-				for k in self.ss_idxs[t]['ts_range'][i]:
-					idxs.append((j, k))
-			self.SS_t.append(ss)
-			self.uSS_t.append(uss)
-			self.Qfun_t.append(qfun)
-			self.idxs_t.append(idxs)
+			it_range = self.ss_idxs[t]['it_range']
+			ts_range = self.ss_idxs[t]['ts_range']
+			# Iteration and timestep indicies of the safe set and their column indicies in the packed data
+			its = np.concatenate([j*np.ones(len(ts_range[i]), dtype=int) for (i, j) in enumerate(it_range)] + [np.empty(0, dtype=int)])
+			tss = np.concatenate([np.asarray(ts_range[i], dtype=int) for i in range(len(it_range))] + [np.empty(0, dtype=int)])
+			packed_idxs = np.asarray(self.cl_offsets, dtype=int)[its] + tss
+
+			self.SS_t.append(self.x_cls_packed[:,packed_idxs])
+			self.uSS_t.append(self.u_cls_packed[:,packed_idxs])
+			self.Qfun_t.append(self.Qfun_packed[packed_idxs])
+			self.idxs_t.append(list(zip(its.tolist(), tss.tolist())))
+			self.ss_packed_idxs_t.append(packed_idxs)
 
 		# pdb.set_trace()
 
+	def set_executor(self, executor):
+		# Checkpoints pickled before executors were introduced do not have this attribute
+		if getattr(self, 'executor', None) is not None:
+			self.executor.close()
+		self.executor = executor
+
+	def set_ss_search(self, ss_search):
+		# exhaustive: solve for all candidates, best_first: solve in order of cost lower bound until the bound is met
+		if ss_search not in ['exhaustive', 'best_first']:
+			raise(ValueError('Safe set search mode %s not recognized' % ss_search))
+		self.ss_search = ss_search
+		self.n_ss_solves = 0
+		self.n_ss_solves_avoided = 0
+
+	def set_terminal_set(self, terminal_set):
+		# enumerate: one FTOCP per safe set point (exact), hull: one FTOCP over the convex hull of the safe set (relaxed)
+		if terminal_set not in ['enumerate', 'hull']:
+			raise(ValueError('Terminal set formulation %s not recognized' % terminal_set))
+		self.terminal_set = terminal_set
+
+	def set_warm_start_cache(self, warm_start_cache):
+		# Solutions of the last time step for each safe set point, keyed by (iteration, time step) index
+		self.warm_start_cache = warm_start_cache
+		self.ws_cache = {}
+
+	def get_ss_solve_counts(self):
+		return self.n_ss_solves, self.n_ss_solves_avoided
+
 	def update_exploration_constraints(self, expl_constrs):
 		self.expl_constrs = expl_constrs
+
+	"""
+	Save the primary data of the controller (closed loop trajectories, cost-to-go, iteration counter and safe set indicies)
+	to a npz file, along with the first best prediction of the latest iteration which is the initial guess of the next one.
+	Derived data (safe sets), the other logged best predictions and the FTOCP are not saved
+	"""
+	def export_state(self, path):
+		if len(getattr(self, 'cl_offsets', [])) != len(self.x_cls):
+			self.pack_closed_loop_data()
+
+		# Safe set indicies as rows of (time step, iteration, first time step, last time step + 1)
+		ss_rows = [[t, j, ss['ts_range'][i][0], ss['ts_range'][i][-1]+1] for (t, ss) in enumerate(self.ss_idxs) for (i, j) in enumerate(ss['it_range'])]
+
+		# The first best prediction of the latest iteration is the initial guess of the next one. It is pending if the
+		# iteration has been solved but its trajectory has not been added yet
+		pred_pending = len(self.x_preds_best_it) > 0
+		if pred_pending:
+			x_pred_first, u_pred_first = self.x_preds_best_it[0], self.u_preds_best_it[0]
+		elif len(self.x_preds_best) > 0 and len(self.x_preds_best[-1]) > 0:
+			x_pred_first, u_pred_first = self.x_preds_best[-1][0], self.u_preds_best[-1][0]
+		else:
+			x_pred_first, u_pred_first = np.empty((self.n_x,0)), np.empty((self.n_u,0))
+
+		with open(path, 'wb') as f:
+			np.savez(f,
+				version=np.array(self.STATE_VERSION),
+				N=np.array(self.N),
+				it=np.array(self.it),
+				last_cost=np.array(self.last_cost),
+				traj_lens=np.array(self.traj_lens, dtype=int),
+				cl_offsets=np.array(self.cl_offsets, dtype=int),
+				x_cls=self.x_cls_packed,
+				u_cls=self.u_cls_packed,
+				Qfun=self.Qfun_packed,
+				ss_n_t=np.array(len(self.ss_idxs)),
+				ss_idxs=np.array(ss_rows, dtype=int).reshape((-1,4)),
+				pred_pending=np.array(pred_pending),
+				x_pred_first=x_pred_first,
+				u_pred_first=u_pred_first)
+
+	"""
+	Create a controller from a state saved with export_state, the safe sets are rebuilt the first time they are used
+	"""
+	@classmethod
+	def from_state(cls, path, ftocp, **kwargs):
+		with np.load(path) as data:
+			if int(data['version']) > cls.STATE_VERSION:
+				raise(ValueError('LMPC state version %i is newer than supported version %i' % (int(data['version']), cls.STATE_VERSION)))
+
+			lmpc = cls(ftocp, int(data['N']), **kwargs)
+			lmpc.it = int(data['it'])
+			lmpc.last_cost = float(data['last_cost'])
+			lmpc.traj_lens = data['traj_lens'].tolist()
+			lmpc.cl_offsets = data['cl_offsets'].tolist()
+			lmpc.x_cls_packed = data['x_cls']
+			lmpc.u_cls_packed = data['u_cls']
+			lmpc.Qfun_packed = data['Qfun']
+			ss_n_t = int(data['ss_n_t'])
+			ss_rows = data['ss_idxs']
+			pred_pending = bool(data['pred_pending'])
+			x_pred_first = data['x_pred_first']
+			u_pred_first = data['u_pred_first']
+
+		# Per iteration data are views of the packed data
+		for (o, l) in zip(lmpc.cl_offsets, lmpc.traj_lens):
+			lmpc.x_cls.append(lmpc.x_cls_packed[:,o:o+l])
+			lmpc.u_cls.append(lmpc.u_cls_packed[:,o:o+l])
+			lmpc.Qfun.append(lmpc.Qfun_packed[o:o+l])
+
+		lmpc.ss_idxs = [{'it_range' : [], 'ts_range' : []} for _ in range(ss_n_t)]
+		for (t, j, ts_start, ts_end) in ss_rows:
+			lmpc.ss_idxs[t]['it_range'].append(int(j))
+			lmpc.ss_idxs[t]['ts_range'].append(range(ts_start, ts_end))
+		lmpc.ss_stale = len(lmpc.ss_idxs) > 0
+
+		if x_pred_first.shape[1] > 0:
+			if pred_pending:
+				# Moved to x_preds_best when the trajectory of the iteration is added
+				lmpc.x_preds_best_it = [x_pred_first]
+				lmpc.u_preds_best_it = [u_pred_first]
+				lmpc.idxs_best_it = [None]
+			else:
+				lmpc.x_preds_best = [[x_pred_first]]
+				lmpc.u_preds_best = [[u_pred_first]]
+				lmpc.idxs_best = [[None]]
+
+		return lmpc
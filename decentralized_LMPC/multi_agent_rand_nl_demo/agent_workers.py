@@ -0,0 +1,101 @@
+"""
+Worker processes for solving the LMPC iterations of the agents in parallel. Agent i is pinned to worker i % n_workers,
+whose process holds the controller and the simulation model of the agent for the whole run. Each iteration only the
+trajectory which is added to the safe set, the safe set indicies and the exploration space hyperplanes of an agent are
+sent to its worker
+"""
+
+from __future__ import division
+
+import multiprocessing as mp
+import time
+
+# Controllers, simulation models and the iteration solve function of the agents assigned to this worker process
+_worker = {}
+
+def _init_worker(lmpc, model_agents, solve_fn):
+	_worker['lmpc'] = lmpc
+	_worker['model_agents'] = model_agents
+	_worker['solve_fn'] = solve_fn
+
+def _solve_agent(job):
+	i = job['agent_idx']
+	lmpc = _worker['lmpc'][i]
+	lmpc.addTrajectory(job['x_cl'], job['u_cl'], job['x_f'])
+	lmpc.update_safe_sets(job['ss_idxs'])
+	lmpc.update_exploration_constraints(job['expl_constrs'])
+
+	agent_start = time.time()
+	try:
+		x_cl, u_cl, x_ol, u_ol, solve_t = _worker['solve_fn'](lmpc, job['x_0'], job['x_f'], _worker['model_agents'][i], tol=job['tol'])
+	except SystemExit:
+		raise(RuntimeError('LMPC solve failed for agent %i' % (i+1)))
+	agent_end = time.time()
+
+	return x_cl, u_cl, x_ol, u_ol, solve_t, agent_end-agent_start, lmpc.get_ss_solve_counts()
+
+def _export_agent_state(i, path):
+	_worker['lmpc'][i].export_state(path)
+
+def _close_worker():
+	for l in _worker['lmpc'].values():
+		l.executor.close()
+
+class Resident_LMPC(object):
+	# Stands in for the controller of an agent which lives in a worker process, e.g. when saving the controller states
+	def __init__(self, agent_workers, i):
+		self.agent_workers = agent_workers
+		self.i = i
+		self.ss_solve_counts = (0, 0)
+
+	def export_state(self, path):
+		self.agent_workers.get_pool(self.i).apply(_export_agent_state, (self.i, path))
+
+	def get_ss_solve_counts(self):
+		return self.ss_solve_counts
+
+class Agent_Workers(object):
+	def __init__(self, n_workers, lmpc, model_agents, solve_fn):
+		self.n_a = len(lmpc)
+		self.n_workers = min(n_workers, self.n_a)
+
+		# One single process pool per worker so that the agents assigned to it are always solved in the same process
+		self.pools = []
+		for w in range(self.n_workers):
+			agent_idxs = range(w, self.n_a, self.n_workers)
+			self.pools.append(mp.Pool(1, initializer=_init_worker,
+				initargs=({i : lmpc[i] for i in agent_idxs}, {i : model_agents[i] for i in agent_idxs}, solve_fn)))
+
+		self.lmpc = [Resident_LMPC(self, i) for i in range(self.n_a)]
+
+	def get_pool(self, i):
+		return self.pools[i % self.n_workers]
+
+	def get_lmpc(self):
+		return self.lmpc
+
+	"""
+	Solve one iteration for all agents. x_cls, u_cls are the closed loop trajectories of the previous iteration which are
+	added to the safe sets, ss_idxs and expl_constrs the safe set indicies and exploration spaces of all agents. Results
+	are returned in agent order
+	"""
+	def solve_iteration(self, x_0, x_f, x_cls, u_cls, ss_idxs, expl_constrs, tol):
+		async_results = []
+		for i in range(self.n_a):
+			job = {'agent_idx' : i, 'x_0' : x_0[i], 'x_f' : x_f[i], 'x_cl' : x_cls[i], 'u_cl' : u_cls[i],
+				'ss_idxs' : ss_idxs[i], 'expl_constrs' : expl_constrs[i], 'tol' : tol}
+			async_results.append(self.get_pool(i).apply_async(_solve_agent, (job,)))
+
+		results = []
+		for (i, r) in enumerate(async_results):
+			x_cl, u_cl, x_ol, u_ol, solve_t, agent_elapsed, ss_solve_counts = r.get()
+			self.lmpc[i].ss_solve_counts = ss_solve_counts
+			results.append((x_cl, u_cl, x_ol, u_ol, solve_t, agent_elapsed))
+
+		return results
+
+	def close(self):
+		for p in self.pools:
+			p.apply(_close_worker)
+			p.close()
+			p.join()
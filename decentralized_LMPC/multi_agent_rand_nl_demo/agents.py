@@ -53,8 +53,8 @@ class DT_Kin_Bike_Agent(DT_Kin_Bike_Model):
 	def __init__(self, l_r, l_f, w, dt, col_buf=None,
 		a_lim=[-3.0, 3.0], df_lim=[-0.4, 0.4], x_lim=[-10.0, 10.0],
 		y_lim=[-10.0, 10.0], psi_lim=None, v_lim=[-5.0, 5.0],
-		da_lim=[-7.0, 7.0], ddf_lim=[-0.7, 0.7]):
-		super(DT_Kin_Bike_Agent, self).__init__(l_r, l_f, dt)
+		da_lim=[-7.0, 7.0], ddf_lim=[-0.7, 0.7], backend='numpy', codegen_dir=None, integrator='euler', n_steps=1):
+		super(DT_Kin_Bike_Agent, self).__init__(l_r, l_f, dt, backend=backend, codegen_dir=codegen_dir, integrator=integrator, n_steps=n_steps)
 
 		self.w = w
 		self.l = l_r + l_f
@@ -120,10 +120,16 @@ class DT_Kin_Bike_Agent(DT_Kin_Bike_Model):
 			self.b = None
 
 	def get_jacobians(self, x, u, eps):
-	   # A, B, c = self.get_numerical_jacs(x, u, eps)
-	   A, B, c = self.get_jacs(x, u)
+		# A, B, c = self.get_numerical_jacs(x, u, eps)
+		if getattr(self, 'integrator', 'euler') != 'euler':
+			A, B, c = [J[0] for J in self.get_jacs_batch(x.reshape((-1,1)), u.reshape((-1,1)))]
+		else:
+			A, B, c = self.get_jacs(x, u)
+
+		return A, B, c
 
-	   return A, B, c
+	def get_jacobians_batch(self, x, u):
+		return self.get_jacs_batch(x, u)
 
 	def update_state_input(self, x, u):
 		self.state_his.append(x)
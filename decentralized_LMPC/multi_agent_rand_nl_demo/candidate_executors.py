@@ -0,0 +1,127 @@
+"""
+Executor backends for the safe set candidate sweep in NL_LMPC.solve. Each executor takes the FTOCP object of an agent and a
+list of keyword argument dicts (one per safe set candidate) and returns the results of solve_candidate in the same order
+as the input list, so that the candidate selected by argmin is independent of the backend
+"""
+
+from __future__ import division
+
+import multiprocessing as mp
+import multiprocessing.pool
+import threading, copy
+
+def solve_candidate(ftocp, ts, x_t, x_ss, N, last_u, x_guess=None, u_guess=None, expl_constraints=None, lam_g_guess=None, return_duals=False, verbose=False):
+	# The first time step of an iteration does not have a previously applied input to constrain the input rate against
+	if ts == 0:
+		return ftocp.solve_opti0(ts, x_t, x_ss, N,
+			x_guess=x_guess,
+			u_guess=u_guess,
+			expl_constraints=expl_constraints,
+			lam_g_guess=lam_g_guess,
+			return_duals=return_duals,
+			verbose=verbose)
+	else:
+		return ftocp.solve_opti(ts, x_t, x_ss, N, last_u,
+			x_guess=x_guess,
+			u_guess=u_guess,
+			expl_constraints=expl_constraints,
+			lam_g_guess=lam_g_guess,
+			return_duals=return_duals,
+			verbose=verbose)
+
+class Serial_Executor(object):
+	def __init__(self):
+		self.n_workers = 1
+
+	def solve(self, ftocp, jobs):
+		return [solve_candidate(ftocp, **j) for j in jobs]
+
+	def close(self):
+		pass
+
+class Thread_Executor(object):
+	"""
+	Solves candidates in a thread pool. Opti objects are stateful, so each thread solves with its own copy of the FTOCP
+	object (and therefore its own cache of parametric solvers), which is created the first time the thread sees that FTOCP.
+	Solves overlap because CasADi releases the GIL while IPOPT runs (see tests/test_candidate_executors.py)
+	"""
+	def __init__(self, n_workers=None):
+		self.n_workers = n_workers if n_workers is not None else mp.cpu_count()
+		self.pool = None
+		self.local = None
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['pool'] = None
+		state['local'] = None
+		return state
+
+	def _get_thread_ftocp(self, ftocp):
+		if not hasattr(self.local, 'ftocps'):
+			self.local.ftocps = {}
+		if id(ftocp) not in self.local.ftocps:
+			self.local.ftocps[id(ftocp)] = copy.copy(ftocp)
+		return self.local.ftocps[id(ftocp)]
+
+	def solve(self, ftocp, jobs):
+		if self.pool is None:
+			self.pool = mp.pool.ThreadPool(self.n_workers)
+			self.local = threading.local()
+		return self.pool.map(lambda j: solve_candidate(self._get_thread_ftocp(ftocp), **j), jobs)
+
+	def close(self):
+		if self.pool is not None:
+			self.pool.close()
+			self.pool.join()
+			self.pool = None
+
+# FTOCP object of a process pool worker, set once by the pool initializer so that its solvers stay warm across time steps
+_worker_ftocp = None
+
+def _init_worker(ftocp):
+	global _worker_ftocp
+	_worker_ftocp = ftocp
+
+def _worker_solve(job):
+	return solve_candidate(_worker_ftocp, **job)
+
+class Process_Executor(object):
+	"""
+	Solves candidates in a process pool. The FTOCP object is shipped to each worker once when the pool is started and the
+	workers keep their parametric solvers between calls. A pool is bound to a single FTOCP object, i.e. to a single agent
+	"""
+	def __init__(self, n_workers=None):
+		self.n_workers = n_workers if n_workers is not None else mp.cpu_count()
+		self.pool = None
+		self.ftocp_id = None
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['pool'] = None
+		state['ftocp_id'] = None
+		return state
+
+	def solve(self, ftocp, jobs):
+		if self.pool is not None and self.ftocp_id != id(ftocp):
+			self.close()
+		if self.pool is None:
+			self.pool = mp.Pool(self.n_workers, initializer=_init_worker, initargs=(ftocp,))
+			self.ftocp_id = id(ftocp)
+		return self.pool.map(_worker_solve, jobs)
+
+	def close(self):
+		if self.pool is not None:
+			self.pool.close()
+			self.pool.join()
+			self.pool = None
+			self.ftocp_id = None
+
+def get_executor(name='serial', n_workers=None):
+	if name == 'serial':
+		return Serial_Executor()
+	elif name == 'thread':
+		return Thread_Executor(n_workers)
+	elif name == 'process':
+		return Process_Executor(n_workers)
+	else:
+		raise(ValueError('Executor %s not recognized' % name))
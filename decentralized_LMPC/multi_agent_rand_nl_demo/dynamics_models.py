@@ -1,4 +1,8 @@
 import numpy as np
+import casadi as ca
+import os, subprocess
+
+from utils.kin_bike_dynamics import INTEGRATORS, get_kin_bike_step_function
 
 class CT_Kin_Bike_Model(object):
 
@@ -49,7 +53,13 @@ class CT_Kin_Bike_Model(object):
 
 class DT_Kin_Bike_Model(object):
 
-    def __init__(self, l_r, l_f, dt):
+    def __init__(self, l_r, l_f, dt, backend='numpy', codegen_dir=None, integrator='euler', n_steps=1):
+        if backend not in ['numpy', 'casadi', 'codegen']:
+            raise(ValueError('Dynamics backend %s not recognized' % backend))
+        if integrator not in INTEGRATORS:
+            raise(ValueError('Integrator %s not recognized' % integrator))
+        if backend == 'codegen' and integrator == 'cvodes':
+            raise(ValueError('The cvodes integrator can not be code generated'))
 
         self.l_r = l_r
         self.l_f = l_f
@@ -58,7 +68,35 @@ class DT_Kin_Bike_Model(object):
         self.n_x = 4
         self.n_u = 2
 
+        # Backend of the batched dynamics and Jacobians
+        #   - numpy: vectorized NumPy versions of sim and get_jacs
+        #   - casadi: CasADi Functions of the discrete dynamics and their exact Jacobians, mapped over the batch
+        #   - codegen: the CasADi Functions compiled to a shared library in codegen_dir
+        self.backend = backend
+        self.codegen_dir = codegen_dir if codegen_dir is not None else os.getcwd()
+        self.ca_funcs = None
+        self.ca_maps = {}
+
+        # Discretization of the dynamics used by sim, the batched functions and the FTOCP dynamics constraints
+        self.integrator = integrator
+        self.n_steps = n_steps
+
+    def __getstate__(self):
+        # CasADi Functions are rebuilt on first use after unpickling
+        state = self.__dict__.copy()
+        state['ca_funcs'] = None
+        state['ca_maps'] = {}
+        return state
+
+    def get_step_function(self):
+        return get_kin_bike_step_function(self.l_r, self.l_f, self.dt,
+            integrator=getattr(self, 'integrator', 'euler'),
+            n_steps=getattr(self, 'n_steps', 1))
+
     def sim(self, x_k, u_k):
+        if getattr(self, 'integrator', 'euler') != 'euler':
+            return self.sim_batch(np.reshape(x_k, (-1,1)), np.reshape(u_k, (-1,1)))[:,0]
+
         beta = np.arctan2(self.l_r*np.tan(u_k[0]), self.l_f + self.l_r)
         x_kp1 = np.zeros(4)
         x_kp1[0] = x_k[0] + self.dt*x_k[3]*np.cos(x_k[2] + beta)
@@ -90,11 +128,11 @@ class DT_Kin_Bike_Model(object):
         A_c[0,3] = np.cos(x[2]+beta)
         A_c[1,2] = x[3]*np.cos(x[2]+beta)
         A_c[1,3] = np.sin(x[2]+beta)
-        A_c[2,3] = np.sin(beta)/self.l_r
+        A_c[2,3] = np.sin(beta)
 
         B_c[0,0] = -x[3]*np.sin(x[2]+beta)*dbeta_ddf(u[0])
         B_c[1,0] = x[3]*np.cos(x[2]+beta)*dbeta_ddf(u[0])
-        B_c[2,0] = x[3]*np.cos(beta)*dbeta_ddf(u[0])/self.l_r
+        B_c[2,0] = x[3]*np.cos(beta)*dbeta_ddf(u[0])
         B_c[3,1] = 1
 
         c_c = self.sim_ct(x, u)
@@ -105,6 +143,138 @@ class DT_Kin_Bike_Model(object):
 
         return A_d, B_d, c_d
 
+    """
+    Batched evaluation over M (x, u) pairs. x is n_x x M and u is n_u x M, i.e. a trajectory with time along the second
+    axis. sim_batch returns the successor states as an n_x x M array, get_jacs_batch returns A (M x n_x x n_x),
+    B (M x n_x x n_u) and c (M x n_x) with the same convention as get_jacs. The numpy backend evaluates the Euler and RK4
+    steps and the Euler Jacobians, everything else is evaluated with the CasADi Functions
+    """
+    def sim_batch(self, x, u):
+        integrator = getattr(self, 'integrator', 'euler')
+        if getattr(self, 'backend', 'numpy') == 'numpy' and integrator in ['euler', 'rk4']:
+            if integrator == 'euler':
+                return x + self.dt*self._sim_ct_batch(x, u)
+
+            h = self.dt/self.n_steps
+            x_kp1 = x
+            for _ in range(self.n_steps):
+                k_1 = self._sim_ct_batch(x_kp1, u)
+                k_2 = self._sim_ct_batch(x_kp1 + h/2*k_1, u)
+                k_3 = self._sim_ct_batch(x_kp1 + h/2*k_2, u)
+                k_4 = self._sim_ct_batch(x_kp1 + h*k_3, u)
+                x_kp1 = x_kp1 + h/6*(k_1 + 2*k_2 + 2*k_3 + k_4)
+            return x_kp1
+
+        return np.array(self._get_casadi_map('f', x.shape[1])(x, u))
+
+    def get_jacs_batch(self, x, u):
+        M = x.shape[1]
+
+        if getattr(self, 'backend', 'numpy') == 'numpy' and getattr(self, 'integrator', 'euler') == 'euler':
+            beta = np.arctan2(self.l_r*np.tan(u[0]), self.l_f + self.l_r)
+            dbeta_ddf = self.l_r/(np.cos(u[0])**2*(self.l_f+self.l_r)*(1+(self.l_r*np.tan(u[0])/(self.l_f+self.l_r))**2))
+
+            A_c = np.zeros((M, self.n_x, self.n_x))
+            B_c = np.zeros((M, self.n_x, self.n_u))
+
+            A_c[:,0,2] = -x[3]*np.sin(x[2]+beta)
+            A_c[:,0,3] = np.cos(x[2]+beta)
+            A_c[:,1,2] = x[3]*np.cos(x[2]+beta)
+            A_c[:,1,3] = np.sin(x[2]+beta)
+            A_c[:,2,3] = np.sin(beta)
+
+            B_c[:,0,0] = -x[3]*np.sin(x[2]+beta)*dbeta_ddf
+            B_c[:,1,0] = x[3]*np.cos(x[2]+beta)*dbeta_ddf
+            B_c[:,2,0] = x[3]*np.cos(beta)*dbeta_ddf
+            B_c[:,3,1] = 1
+
+            c_c = self._sim_ct_batch(x, u).T
+
+            return self.dt*A_c, self.dt*B_c, self.dt*c_c
+
+        A, B, c = self._get_casadi_map('jacs', M)(x, u)
+        A = np.array(A).reshape((self.n_x, M, self.n_x)).transpose((1,0,2))
+        B = np.array(B).reshape((self.n_x, M, self.n_u)).transpose((1,0,2))
+
+        return A, B, np.array(c).T
+
+    """
+    Simulate a batch of input sequences. x_0 is B x n_x and U is B x n_u x T (or n_x and n_u x T for a single rollout),
+    returns the states B x n_x x T+1. The batch is stepped together, so the cost is T vectorized steps independent of B.
+    If control_dt is given, each input is held for control_dt/dt steps of the model and only the states at the control
+    time steps are returned
+    """
+    def rollout(self, x_0, U, control_dt=None):
+        single = (np.ndim(x_0) == 1)
+        x_0 = np.atleast_2d(x_0)
+        U = U.reshape((1,) + U.shape) if single else U
+
+        n_sub = 1
+        if control_dt is not None:
+            n_sub = int(round(control_dt/self.dt))
+            if n_sub < 1 or not np.isclose(n_sub*self.dt, control_dt):
+                raise(ValueError('Control time step %g is not a multiple of the model time step %g' % (control_dt, self.dt)))
+
+        X = np.empty((x_0.shape[0], self.n_x, U.shape[2]+1))
+        X[:,:,0] = x_0
+        x = x_0.T
+        for t in range(U.shape[2]):
+            u = U[:,:,t].T
+            for _ in range(n_sub):
+                x = self.sim_batch(x, u)
+            X[:,:,t+1] = x.T
+
+        return X[0] if single else X
+
+    def _sim_ct_batch(self, x, u):
+        beta = np.arctan2(self.l_r*np.tan(u[0]), self.l_f + self.l_r)
+        return np.vstack((x[3]*np.cos(x[2] + beta), x[3]*np.sin(x[2] + beta), x[3]*np.sin(beta), u[1]))
+
+    def get_casadi_functions(self):
+        if getattr(self, 'ca_funcs', None) is None:
+            f = self.get_step_function()
+            sym = ca.MX.sym if getattr(self, 'integrator', 'euler') == 'cvodes' else ca.SX.sym
+            x = sym('x', self.n_x)
+            u = sym('u', self.n_u)
+            x_kp1 = f(x, u)
+
+            # Jacobians of the discrete dynamics, A is offset by the identity and c = x_kp1 - x as in get_jacs
+            jacs = ca.Function('kin_bike_jacs', [x, u], [ca.jacobian(x_kp1, x) - ca.DM.eye(self.n_x), ca.jacobian(x_kp1, u), x_kp1 - x],
+                ['x', 'u'], ['A', 'B', 'c'])
+
+            if self.backend == 'codegen':
+                f, jacs = self._compile_casadi_functions([f, jacs])
+
+            self.ca_funcs = {'f' : f, 'jacs' : jacs}
+            self.ca_maps = {}
+
+        return self.ca_funcs
+
+    def _get_casadi_map(self, name, M):
+        funcs = self.get_casadi_functions()
+        if (name, M) not in self.ca_maps:
+            self.ca_maps[(name, M)] = funcs[name].map(M)
+        return self.ca_maps[(name, M)]
+
+    def _compile_casadi_functions(self, funcs):
+        # The library is shared by all models with the same parameters and only compiled if it does not exist yet
+        name = ('kin_bike_%g_%g_%g_%s_%i' % (self.l_r, self.l_f, self.dt, self.integrator, self.n_steps)).replace('.', 'p').replace('-', 'm')
+        lib_path = '/'.join((self.codegen_dir, name + '.so'))
+
+        if not os.path.exists(lib_path):
+            if not os.path.exists(self.codegen_dir):
+                os.makedirs(self.codegen_dir)
+            cg = ca.CodeGenerator(name + '.c')
+            for f in funcs:
+                cg.add(f)
+            c_path = cg.generate(self.codegen_dir + '/')
+            # Compile to a temporary file so that concurrent processes never load a partially written library
+            tmp_path = '%s.%i.tmp' % (lib_path, os.getpid())
+            subprocess.check_call(['gcc', '-fPIC', '-shared', '-O3', c_path, '-o', tmp_path])
+            os.rename(tmp_path, lib_path)
+
+        return [ca.external(f.name(), lib_path) for f in funcs]
+
     def get_numerical_jacs(self, x, u, eps):
         A_c = np.zeros((self.n_x, self.n_x))
         B_c = np.zeros((self.n_x, self.n_u))
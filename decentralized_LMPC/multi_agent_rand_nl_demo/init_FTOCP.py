@@ -137,15 +137,14 @@ class init_FTOCP(object):
         self.opti.subject_to(self.opti.bounded(ddf_lim[0]*self.dt, self.u[0,0]-self.last_u[0], ddf_lim[1]*self.dt))
         self.opti.subject_to(self.opti.bounded(da_lim[0]*self.dt, self.u[1,0]-self.last_u[1], da_lim[1]*self.dt))
 
+        # Discrete dynamics with the integrator of the agent
+        f_dt = self.agent.get_step_function()
+
         stage_cost = 0
         for i in range(self.N):
             stage_cost += ca.bilin(self.Q, self.x[:,i+1]-self.x_f, self.x[:,i+1]-self.x_f) + ca.bilin(self.R, self.u[:,i], self.u[:,i])
 
-            beta = ca.atan2(self.l_r*ca.tan(self.u[0,i]), self.l_f+self.l_r)
-            self.opti.subject_to(self.x[0,i+1] == self.x[0,i] + self.dt*self.x[3,i]*ca.cos(self.x[2,i] + beta))
-            self.opti.subject_to(self.x[1,i+1] == self.x[1,i] + self.dt*self.x[3,i]*ca.sin(self.x[2,i] + beta))
-            self.opti.subject_to(self.x[2,i+1] == self.x[2,i] + self.dt*self.x[3,i]*ca.sin(beta))
-            self.opti.subject_to(self.x[3,i+1] == self.x[3,i] + self.dt*self.u[1,i])
+            self.opti.subject_to(self.x[:,i+1] == f_dt(self.x[:,i], self.u[:,i]))
 
             if self.F is not None:
                 self.opti.subject_to(ca.mtimes(self.F, self.x[:,i+1]) <= self.b)
@@ -200,15 +199,14 @@ class init_FTOCP(object):
         self.opti0.subject_to(self.x0[2,0] == self.x_s0[2])
         self.opti0.subject_to(self.x0[3,0] == self.x_s0[3])
 
+        # Discrete dynamics with the integrator of the agent
+        f_dt = self.agent.get_step_function()
+
         stage_cost = 0
         for i in range(self.N):
             stage_cost += ca.bilin(self.Q, self.x0[:,i+1]-self.x_f0, self.x0[:,i+1]-self.x_f0) + ca.bilin(self.R, self.u0[:,i], self.u0[:,i])
 
-            beta = ca.atan2(self.l_r*ca.tan(self.u0[0,i]), self.l_f+self.l_r)
-            self.opti0.subject_to(self.x0[0,i+1] == self.x0[0,i] + self.dt*self.x0[3,i]*ca.cos(self.x0[2,i] + beta))
-            self.opti0.subject_to(self.x0[1,i+1] == self.x0[1,i] + self.dt*self.x0[3,i]*ca.sin(self.x0[2,i] + beta))
-            self.opti0.subject_to(self.x0[2,i+1] == self.x0[2,i] + self.dt*self.x0[3,i]*ca.sin(beta))
-            self.opti0.subject_to(self.x0[3,i+1] == self.x0[3,i] + self.dt*self.u0[1,i])
+            self.opti0.subject_to(self.x0[:,i+1] == f_dt(self.x0[:,i], self.u0[:,i]))
 
             if self.F is not None:
                 self.opti0.subject_to(ca.mtimes(self.F, self.x0[:,i+1]) <= self.b)
@@ -3,16 +3,17 @@ from __future__ import division
 import numpy as np
 import numpy.linalg as la
 import multiprocessing as mp
+import os, sys, time, copy, pickle, itertools, pdb, argparse
 
 import matplotlib
-matplotlib.use('TkAgg')
+# Headless runs select their backend with MPLBACKEND
+if os.environ.get('MPLBACKEND') is None:
+	matplotlib.use('TkAgg')
 from matplotlib import rc
 rc('text', usetex=True)
 
 import matplotlib.pyplot as plt
 
-import os, sys, time, copy, pickle, itertools, pdb, argparse
-
 os.environ['TZ'] = 'America/Los_Angeles'
 time.tzset()
 FILE_DIR =  os.path.dirname('/'.join(str.split(os.path.realpath(__file__),'/')))
@@ -23,11 +24,15 @@ from LTV_FTOCP import LTV_FTOCP
 from init_FTOCP import init_FTOCP
 from NL_FTOCP import NL_FTOCP
 from NL_LMPC import NL_LMPC
+from candidate_executors import get_executor
+from agent_workers import Agent_Workers
 from agents import DT_Kin_Bike_Agent
 
 from utils.plot_bike_utils import plot_bike_agent_trajs
 from utils.lmpc_visualizer import lmpc_visualizer
-from utils.safe_set_utils import get_safe_set, get_safe_set_2, inspect_safe_set
+from utils.safe_set_utils import get_safe_set, get_safe_set_2, inspect_safe_set, Safe_Set_Cache
+from utils.run_store import Run_Store
+from utils.viz_stream import Viz_Event_Stream
 import utils.utils
 
 def solve_init_traj(ftocp, x_0, model_agent, agt_idx, agt_trajs, visualizer=None, tol=-7, timeout=100):
@@ -190,8 +195,34 @@ def main():
 	parser = argparse.ArgumentParser()
 	parser.add_argument('--init_traj', action='store_true', help='Use trajectory from file', default=False)
 	parser.add_argument('--from_checkpoint', type=str, help='Directory of checkpoint to start from', default=None)
+	parser.add_argument('--executor', type=str, choices=['serial', 'thread', 'process'], help='Backend for solving the safe set candidate FTOCPs', default='serial')
+	parser.add_argument('--n_workers', type=int, help='Number of workers of the thread and process executor of each agent (default: number of cores divided by the number of agents)', default=None)
+	parser.add_argument('--ss_search', type=str, choices=['exhaustive', 'best_first'], help='Order and pruning of the safe set candidate solves', default='exhaustive')
+	parser.add_argument('--warm_start_cache', action='store_true', help='Warm start each safe set candidate from its own shifted solution', default=False)
+	parser.add_argument('--terminal_set', type=str, choices=['enumerate', 'hull'], help='Enumerate safe set points or use their convex hull as terminal set', default='enumerate')
+	parser.add_argument('--separator', type=str, choices=['svm', 'hull'], help='Pairwise safe set separation with a soft margin SVM on all points or the exact hard margin separator of the convex hulls', default='svm')
+	parser.add_argument('--ss_n_j', type=int, help='Number of past iterations the safe sets span', default=1)
+	parser.add_argument('--incremental_ss', action='store_true', help='Reuse the hulls of the safe set windows of past iterations across LMPC iterations, requires --separator hull and only has an effect with --ss_n_j larger than one', default=False)
+	parser.add_argument('--agent_workers', type=int, help='Number of worker processes for solving the agents of an iteration in parallel', default=None)
+	parser.add_argument('--viz', type=str, choices=['sync', 'async', 'none'], help='Render in the control loop, in a separate rendering process or not at all', default='sync')
+	parser.add_argument('--frame_writer', type=str, choices=['savefig', 'png', 'ffmpeg'], help='Save visualizer frames with savefig or in a background writer as png files or videos', default='savefig')
+	parser.add_argument('--frame_policy', type=str, choices=['block', 'drop_newest', 'drop_oldest'], help='What the background frame writer does with new frames when its queue is full', default='block')
+	parser.add_argument('--frame_queue', type=int, help='Maximum number of frames queued in the background frame writer', default=16)
+	parser.add_argument('--dynamics_backend', type=str, choices=['numpy', 'casadi', 'codegen'], help='Backend for batched evaluation of the dynamics and their Jacobians', default='numpy')
+	parser.add_argument('--integrator', type=str, choices=['euler', 'rk4', 'cvodes'], help='Discretization of the dynamics for simulation and the FTOCPs', default='euler')
+	parser.add_argument('--n_int_steps', type=int, help='Number of RK4 steps per time step', default=1)
+	parser.add_argument('--blit', action='store_true', help='Only redraw the artists of the visualizers which change at each time step', default=False)
 	args = parser.parse_args()
 
+	# Pool workers are daemonic and cannot start the process pools of the candidate executor
+	if args.agent_workers is not None and args.executor == 'process':
+		parser.error('--agent_workers cannot be used with the process executor')
+	# The visualizers are not available in the agent workers
+	if args.agent_workers is not None and args.viz != 'none':
+		parser.error('--agent_workers can only be used with --viz none')
+	if args.incremental_ss and args.separator != 'hull':
+		parser.error('--incremental_ss can only be used with --separator hull')
+
 	out_dir = '/'.join((BASE_DIR, 'out'))
 	if not os.path.exists(out_dir):
 		os.makedirs(out_dir)
@@ -227,8 +258,8 @@ def main():
 	col_buf = [0.2 for _ in range(n_a)]
 
 	# Initialize dynamics and control agents (allows for dynamics to be simulated with higher resolution than control rate)
-	model_agents = [DT_Kin_Bike_Agent(l_r, l_f, w, model_dt, col_buf=col_buf[i], v_lim=[-2.0, 2.0]) for i in range(n_a)]
-	lmpc_control_agents = [DT_Kin_Bike_Agent(l_r, l_f, w, control_dt, col_buf=col_buf[i], v_lim=[-0.05, 10.0]) for i in range(n_a)]
+	model_agents = [DT_Kin_Bike_Agent(l_r, l_f, w, model_dt, col_buf=col_buf[i], v_lim=[-2.0, 2.0], integrator=args.integrator, n_steps=args.n_int_steps) for i in range(n_a)]
+	lmpc_control_agents = [DT_Kin_Bike_Agent(l_r, l_f, w, control_dt, col_buf=col_buf[i], v_lim=[-0.05, 10.0], backend=args.dynamics_backend, integrator=args.integrator, n_steps=args.n_int_steps) for i in range(n_a)]
 
 	if args.from_checkpoint is None:
 		if not args.init_traj:
@@ -284,7 +315,7 @@ def main():
 			start = time.time()
 			agt_idx = 0
 			while agt_idx < n_a:
-				mpc_agent = DT_Kin_Bike_Agent(l_r, l_f, w, control_dt, col_buf=col_buf[agt_idx], v_lim=[-2.0, 2.0], a_lim=[-1.0, 1.0], df_lim=[-0.35, 0.35], da_lim=[-3.0, 3.0], ddf_lim=[-0.5, 0.5])
+				mpc_agent = DT_Kin_Bike_Agent(l_r, l_f, w, control_dt, col_buf=col_buf[agt_idx], v_lim=[-2.0, 2.0], a_lim=[-1.0, 1.0], df_lim=[-0.35, 0.35], da_lim=[-3.0, 3.0], ddf_lim=[-0.5, 0.5], backend=args.dynamics_backend, integrator=args.integrator, n_steps=args.n_int_steps)
 				# ocp = LTV_FTOCP(Q, P, R, Rd, N, mpc_agent, x_refs=[x_f[agt_idx]])
 				ocp = init_FTOCP(Q, P, R, Rd, N, mpc_agent, x_refs=[x_f[agt_idx]])
 				vis = lmpc_visualizer(pos_dims=[0,1], n_state_dims=n_x, n_act_dims=n_u, agent_id=agt_idx, n_agents=n_a, plot_lims=plot_lims)
@@ -352,7 +383,9 @@ def main():
 		for i in range(n_a):
 			x_f[i] = xcl_feas[i][:,-1]
 
-	pdb.set_trace()
+	# Headless runs do not stop for inspection
+	if args.viz == 'sync':
+		pdb.set_trace()
 
 	# ====================================================================================
 
@@ -360,10 +393,29 @@ def main():
 	# Run LMPC
 	# ====================================================================================
 
+	# Every agent has its own executor and the process pools stay alive for the whole run, so the cores are split between
+	# the agents
+	n_workers = args.n_workers if args.n_workers is not None else max(1, mp.cpu_count()//n_a)
+
+	run_store = None
 	if args.from_checkpoint is not None:
-		lmpc = pickle.load(open(checkpoint_dir + '/lmpc.pkl', 'rb'))
-		xcls = pickle.load(open(checkpoint_dir + '/x_cls.pkl', 'rb'))
-		ucls = pickle.load(open(checkpoint_dir + '/u_cls.pkl', 'rb'))
+		if Run_Store.exists(checkpoint_dir):
+			# Resume the run in its own directory, closed loop trajectories of earlier iterations are memory mapped
+			run_store = Run_Store(checkpoint_dir)
+			lmpc_state_paths = run_store.get_lmpc_state_paths()
+			if len(lmpc_state_paths) == 0:
+				raise(ValueError('Run store %s has no LMPC states to resume from' % checkpoint_dir))
+			lmpc = [NL_LMPC.from_state(p, NL_FTOCP(lmpc_control_agents[i], warm_start_duals=args.warm_start_cache)) for (i, p) in enumerate(lmpc_state_paths)]
+			xcls, ucls = run_store.load_closed_loops()
+		else:
+			lmpc = pickle.load(open(checkpoint_dir + '/lmpc.pkl', 'rb'))
+			xcls = pickle.load(open(checkpoint_dir + '/x_cls.pkl', 'rb'))
+			ucls = pickle.load(open(checkpoint_dir + '/u_cls.pkl', 'rb'))
+		for l in lmpc:
+			l.set_executor(get_executor(args.executor, n_workers))
+			l.set_ss_search(args.ss_search)
+			l.set_terminal_set(args.terminal_set)
+			l.set_warm_start_cache(args.warm_start_cache)
 
 		# Set goal state to be last state of initial trajectories
 		x_f = [xcls[0][i][:,-1] for i in range(n_a)]
@@ -372,23 +424,54 @@ def main():
 		# Initialize LMPC objects for each agent
 		N_LMPC = [30 for _ in range(n_a)] # horizon lengths
 		# N_LMPC = [15, 15, 15] # horizon lengths
-		lmpc_ftocp = [NL_FTOCP(lmpc_control_agents[i]) for i in range(n_a)]# ftocp solve by LMPC
-		lmpc = [NL_LMPC(f, N_LMPC[i]) for f in lmpc_ftocp]# Initialize the LMPC
+		lmpc_ftocp = [NL_FTOCP(lmpc_control_agents[i], warm_start_duals=args.warm_start_cache) for i in range(n_a)]# ftocp solve by LMPC
+		lmpc = [NL_LMPC(f, N_LMPC[i], executor=get_executor(args.executor, n_workers), ss_search=args.ss_search, terminal_set=args.terminal_set, warm_start_cache=args.warm_start_cache) for f in lmpc_ftocp]# Initialize the LMPC
 
 		xcls = [copy.copy(xcl_feas)]
 		ucls = [copy.copy(ucl_feas)]
 
 	ss_n_t = 80
-	ss_n_j = 1
+	ss_n_j = args.ss_n_j
+	ss_cache = Safe_Set_Cache() if args.incremental_ss else None
 
 	totalIterations = 20 # Number of iterations to perform
-	start_time = time.strftime("%Y-%m-%d_%H-%M-%S")
-	exp_dir = '/'.join((out_dir, start_time))
-	os.makedirs(exp_dir)
+	if run_store is None:
+		start_time = time.strftime("%Y-%m-%d_%H-%M-%S")
+		exp_dir = '/'.join((out_dir, start_time))
+		os.makedirs(exp_dir)
+		run_store = Run_Store(exp_dir)
+		# Iteration k of the store is xcls[k], runs resumed from a pickled checkpoint store all of their iterations again
+		for (x_cl, u_cl) in zip(xcls, ucls):
+			run_store.append_iteration(x_cl, u_cl)
+	else:
+		exp_dir = checkpoint_dir
+	start_it = len(xcls)-1
 
 	# Initialize visualizer for each agent
-	lmpc_vis = [lmpc_visualizer(pos_dims=[0,1], n_state_dims=n_x, n_act_dims=n_u, agent_id=i, n_agents=n_a, plot_lims=plot_lims) for i in range(n_a)]
-	# lmpc_vis = None
+	# With --viz async the visualizers run in a rendering process and are fed through an event stream, with --viz none
+	# nothing is rendered during the run and the run store can be rendered afterwards (e.g. with gen_video)
+	viz_stream = None
+	frame_writer = None
+	if args.frame_writer != 'savefig':
+		frame_writer = {'mode' : args.frame_writer, 'max_queue' : args.frame_queue, 'policy' : args.frame_policy}
+	vis_kwargs = [{'pos_dims' : [0,1], 'n_state_dims' : n_x, 'n_act_dims' : n_u, 'agent_id' : i, 'n_agents' : n_a, 'plot_lims' : plot_lims, 'frame_writer' : frame_writer, 'blit' : args.blit} for i in range(n_a)]
+	if args.viz == 'sync':
+		lmpc_vis = [lmpc_visualizer(**kw) for kw in vis_kwargs]
+	elif args.viz == 'async':
+		viz_stream = Viz_Event_Stream(vis_kwargs)
+		lmpc_vis = [viz_stream.get_visualizer(i) for i in range(n_a)]
+	else:
+		lmpc_vis = [None for _ in range(n_a)]
+	plot_agent_trajs = viz_stream.plot_bike_agent_trajs if viz_stream is not None else plot_bike_agent_trajs
+
+	# Agents are decoupled once the exploration spaces are computed, their iterations can be solved in parallel. The
+	# controllers are resident in the agent workers from here on, lmpc holds stand-ins for saving their states
+	agent_pool = None
+	if args.agent_workers is not None:
+		agent_pool = Agent_Workers(args.agent_workers, lmpc, model_agents, solve_lmpc)
+		for l in lmpc:
+			l.executor.close()
+		lmpc = agent_pool.get_lmpc()
 
 	it_times = []
 	agent_times = []
@@ -397,29 +480,33 @@ def main():
 
 	# run simulation
 	# iteration loop
-	for it in range(totalIterations):
+	for it in range(start_it, start_it+totalIterations):
 		print('======================== Iteration %i ========================' % (it+1))
-		it_dir = '/'.join((exp_dir, 'it_%i' % (it+1)))
-		os.makedirs(it_dir)
+		# The data of this iteration is stored as iteration it+1 of the run store, a run which was interrupted during this
+		# iteration leaves the directory behind
+		it_dir = run_store.get_iteration_dir(it+1)
 
-		plot_bike_agent_trajs(xcls[-1], ucls[-1], model_agents, model_dt, trail=False, plot_lims=plot_lims, save_dir=exp_dir, save_video=True, it=it)
+		if args.viz != 'none':
+			plot_agent_trajs(xcls[-1], ucls[-1], model_agents, model_dt, trail=False, plot_lims=plot_lims, save_dir=exp_dir, save_video=True, it=it)
 
 		# pdb.set_trace()
 		it_start = time.time()
 
 		# Compute safe sets and exploration spaces along previous trajectory
-		ss_idxs, expl_constrs = get_safe_set_2(xcls, lmpc_control_agents, ss_n_t, ss_n_j)
+		ss_idxs, expl_constrs = get_safe_set_2(xcls, lmpc_control_agents, ss_n_t, ss_n_j, cache=ss_cache, separator=args.separator)
 
 		# inspect_safe_set(xcls, ucls, ss_idxs, expl_constrs, plot_lims)
 
-		for i in range(n_a):
-			print('Adding trajectories and updating safe sets for agent %i' % (i+1))
-			lmpc[i].addTrajectory(xcls[-1][i], ucls[-1][i], x_f[i]) # Add feasible trajectory to the safe set
-			lmpc[i].update_safe_sets(ss_idxs[i])
-			lmpc[i].update_exploration_constraints(expl_constrs[i])
+		# The agent workers update the safe sets of their controllers themselves
+		if agent_pool is None:
+			for i in range(n_a):
+				print('Adding trajectories and updating safe sets for agent %i' % (i+1))
+				lmpc[i].addTrajectory(xcls[-1][i], ucls[-1][i], x_f[i]) # Add feasible trajectory to the safe set
+				lmpc[i].update_safe_sets(ss_idxs[i])
+				lmpc[i].update_exploration_constraints(expl_constrs[i])
 
-		if lmpc_vis is not None:
-			for lv in lmpc_vis:
+		for lv in lmpc_vis:
+			if lv is not None:
 				lv.update_prev_trajs(state_traj=xcls, act_traj=ucls)
 
 		x_cl_it = []
@@ -427,6 +514,11 @@ def main():
 		x_ol_it = []
 		u_ol_it = []
 
+		# Solve all agents in the agent pool, results are returned in agent order
+		if agent_pool is not None:
+			print('Solving trajectories for all agents with %i workers' % agent_pool.n_workers)
+			agent_results = agent_pool.solve_iteration(x_0, x_f, xcls[-1], ucls[-1], ss_idxs, expl_constrs, tol)
+
 		# agent loop
 		agent_time = []
 		agent_solve_time = []
@@ -435,11 +527,16 @@ def main():
 			print('Solving trajectory for agent %i' % (i+1))
 			agent_start = time.time()
 			agent_dir = '/'.join((it_dir, 'agent_%i' % (i+1)))
-			os.makedirs(agent_dir)
-			if lmpc_vis[i] is not None:
-				lmpc_vis[i].set_save_dir(agent_dir)
+			os.makedirs(agent_dir, exist_ok=True)
 
-			x_cl, u_cl, x_ol, u_ol, solve_t = solve_lmpc(lmpc[i], x_0[i], x_f[i], model_agents[i], visualizer=lmpc_vis[i], pause=pause_each_solve, tol=tol)
+			if agent_pool is None:
+				if lmpc_vis[i] is not None:
+					lmpc_vis[i].set_save_dir(agent_dir)
+				x_cl, u_cl, x_ol, u_ol, solve_t = solve_lmpc(lmpc[i], x_0[i], x_f[i], model_agents[i], visualizer=lmpc_vis[i], pause=pause_each_solve, tol=tol)
+				agent_end = time.time()
+			else:
+				x_cl, u_cl, x_ol, u_ol, solve_t, agent_elapsed = agent_results[i]
+				agent_end = agent_start + agent_elapsed
 			u_cl= np.append(u_cl, np.zeros((n_u,1)), axis=1)
 
 			x_cl_it.append(x_cl)
@@ -447,10 +544,11 @@ def main():
 			x_ol_it.append(x_ol)
 			u_ol_it.append(u_ol)
 
-			agent_end = time.time()
 			agent_time.append(agent_end - agent_start)
 			agent_solve_time.append(solve_t)
 			print('Time elapsed: %g, trajectory length: %i' % (agent_end-agent_start, x_cl.shape[1]))
+			n_ss_solves, n_ss_solves_avoided = lmpc[i].get_ss_solve_counts()
+			print('Safe set candidate solves: %i, avoided: %i' % (n_ss_solves, n_ss_solves_avoided))
 
 		xcls.append(x_cl_it)
 		ucls.append(u_cl_it)
@@ -461,23 +559,31 @@ def main():
 		agent_solve_times.append(agent_solve_time)
 		print('Time elapsed for iteration %i: %g s' % (it+1, it_end - it_start))
 
-		# Save iteration data
-		pickle.dump(lmpc, open('/'.join((it_dir, 'lmpc.pkl')), 'wb'))
+		# Save iteration data, only the data of this iteration is written
+		run_store.append_iteration(x_cl_it, u_cl_it, x_ol=x_ol_it, u_ol=u_ol_it, it_time=it_times[-1], agent_times=agent_time, solve_times=agent_solve_time)
+		run_store.save_lmpc_states(lmpc)
 		pickle.dump(ss_idxs, open('/'.join((it_dir, 'ss.pkl')), 'wb'))
 		pickle.dump(expl_constrs, open('/'.join((it_dir, 'exp_constr.pkl')), 'wb'))
-		pickle.dump(xcls, open('/'.join((it_dir, 'x_cls.pkl')), 'wb'))
-		pickle.dump(ucls, open('/'.join((it_dir, 'u_cls.pkl')), 'wb'))
-		pickle.dump(x_ol_it, open('/'.join((it_dir, 'x_ol.pkl')), 'wb'))
-		pickle.dump(u_ol_it, open('/'.join((it_dir, 'u_ol.pkl')), 'wb'))
-		pickle.dump(it_times, open('/'.join((it_dir, 'it_times.pkl')), 'wb'))
-		pickle.dump(agent_times, open('/'.join((it_dir, 'agent_times.pkl')), 'wb'))
-		pickle.dump(agent_solve_times, open('/'.join((it_dir, 'agent_solve_times.pkl')), 'wb'))
+
+	# Shut down the worker pools of the executors and the agent workers
+	if agent_pool is not None:
+		agent_pool.close()
+	else:
+		for l in lmpc:
+			l.executor.close()
 
 	# Plot last trajectory
-	plot_bike_agent_trajs(xcls[-1], ucls[-1], model_agents, model_dt, trail=True, plot_lims=plot_lims, save_dir=exp_dir, save_video=True, it=it)
+	if args.viz != 'none':
+		plot_agent_trajs(xcls[-1], ucls[-1], model_agents, model_dt, trail=True, plot_lims=plot_lims, save_dir=exp_dir, save_video=True, it=it)
+	if viz_stream is not None:
+		viz_stream.close()
+	elif args.viz == 'sync':
+		for lv in lmpc_vis:
+			lv.close_frame_writer()
 	#=====================================================================================
 
-	plt.show()
+	if args.viz == 'sync':
+		plt.show()
 
 if __name__== "__main__":
   main()
@@ -0,0 +1,6 @@
+import os, sys
+
+# The demo modules import each other by module name and the shared utilities as the utils package
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, '/'.join((BASE_DIR, 'decentralized_LMPC', 'multi_agent_rand_nl_demo')))
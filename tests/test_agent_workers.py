@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from agent_workers import Agent_Workers
+
+class Fake_Executor(object):
+	def close(self):
+		pass
+
+class Fake_LMPC(object):
+	# Records the data it is updated with, the process it is solved in and the number of solves
+	def __init__(self):
+		self.executor = Fake_Executor()
+		self.n_trajs = 0
+		self.ss_idxs = None
+		self.expl_constrs = None
+		self.n_solves = 0
+
+	def addTrajectory(self, x, u, x_f):
+		self.n_trajs += 1
+
+	def update_safe_sets(self, ss_idxs):
+		self.ss_idxs = ss_idxs
+
+	def update_exploration_constraints(self, expl_constrs):
+		self.expl_constrs = expl_constrs
+
+	def get_ss_solve_counts(self):
+		return self.n_solves, 0
+
+	def export_state(self, path):
+		np.savez(path, n_trajs=self.n_trajs, n_solves=self.n_solves, ss_idxs=self.ss_idxs, expl_constrs=self.expl_constrs)
+
+def fake_solve_lmpc(lmpc, x_0, x_f, model_agent, tol=-7):
+	lmpc.n_solves += 1
+	x_cl = np.array([[x_0, x_f, model_agent, os.getpid()]], dtype=float)
+	return x_cl, x_cl, [], [], [0.0]
+
+def test_controllers_stay_resident():
+	n_a = 3
+	agent_workers = Agent_Workers(2, [Fake_LMPC() for _ in range(n_a)], [10.0*i for i in range(n_a)], fake_solve_lmpc)
+	try:
+		pids = []
+		for it in range(2):
+			results = agent_workers.solve_iteration([float(i) for i in range(n_a)], [-float(i) for i in range(n_a)],
+				[None]*n_a, [None]*n_a, [it*10+i for i in range(n_a)], [it*100+i for i in range(n_a)], -7)
+			for (i, r) in enumerate(results):
+				assert np.allclose(r[0][0,:3], [i, -i, 10.0*i])
+			pids.append([int(r[0][0,3]) for r in results])
+
+		# Agents are always solved in the same worker, agents 0 and 2 share one
+		assert pids[0] == pids[1]
+		assert pids[0][0] == pids[0][2] and pids[0][0] != pids[0][1]
+		assert [l.get_ss_solve_counts() for l in agent_workers.get_lmpc()] == [(2, 0)]*n_a
+	finally:
+		agent_workers.close()
+
+def test_export_state_from_worker(tmp_path):
+	agent_workers = Agent_Workers(2, [Fake_LMPC(), Fake_LMPC()], [0.0, 0.0], fake_solve_lmpc)
+	try:
+		agent_workers.solve_iteration([0.0, 0.0], [0.0, 0.0], [None, None], [None, None], [5, 6], [7, 8], -7)
+		path = str(tmp_path / 'state_1.npz')
+		agent_workers.get_lmpc()[1].export_state(path)
+	finally:
+		agent_workers.close()
+
+	with np.load(path) as data:
+		assert int(data['n_trajs']) == 1
+		assert int(data['n_solves']) == 1
+		assert int(data['ss_idxs']) == 6
+		assert int(data['expl_constrs']) == 8
@@ -0,0 +1,77 @@
+import threading, time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('casadi')
+
+from agents import DT_Kin_Bike_Agent
+from NL_FTOCP import NL_FTOCP
+from candidate_executors import get_executor, solve_candidate
+
+N = 5
+
+def get_ftocp():
+	agent = DT_Kin_Bike_Agent(0.5, 0.5, 0.5, 0.1, col_buf=0.25)
+	ftocp = NL_FTOCP(agent)
+	ftocp.solver_opts['linear_solver'] = 'mumps'
+	return ftocp
+
+def get_jobs(n_jobs):
+	# Safe set candidates at increasing distance, each solution ends at its own candidate
+	x_0 = np.array([0.0, 0.0, 0.0, 0.5])
+	return [{'ts' : 0, 'x_t' : x_0, 'x_ss' : np.array([0.2+0.01*k, 0.0, 0.0, 0.45]), 'N' : N, 'last_u' : None} for k in range(n_jobs)]
+
+@pytest.mark.parametrize('name', ['thread', 'process'])
+def test_results_are_in_job_order(name):
+	ftocp = get_ftocp()
+	jobs = get_jobs(6)
+	x_ss = np.array([j['x_ss'] for j in jobs])
+	x_serial = np.array([x[:,-1] for (x, _, _) in get_executor('serial').solve(ftocp, jobs)])
+	assert np.allclose(x_serial, x_ss, atol=1e-5)
+
+	executor = get_executor(name, 2)
+	try:
+		for _ in range(2):
+			results = executor.solve(ftocp, jobs)
+			assert np.allclose(np.array([x[:,-1] for (x, _, _) in results]), x_ss, atol=1e-5)
+	finally:
+		executor.close()
+
+def test_solves_release_the_gil():
+	# The thread executor only overlaps solves if IPOPT runs without the GIL. A pure Python thread keeps running while
+	# another thread is inside a solve only if the GIL is released, otherwise it stalls until the solve returns
+	ftocp = get_ftocp()
+	job = get_jobs(1)[0]
+	solve_candidate(ftocp, **job)
+
+	count = [0]
+	stop = threading.Event()
+	def spin():
+		while not stop.is_set():
+			count[0] += 1
+
+	def get_spin_rate(duration):
+		count[0] = 0
+		stop.clear()
+		spinner = threading.Thread(target=spin)
+		spinner.start()
+		time.sleep(duration)
+		stop.set()
+		spinner.join()
+		return count[0]/duration
+
+	spin_rate = get_spin_rate(0.2)
+
+	count[0] = 0
+	stop.clear()
+	spinner = threading.Thread(target=spin)
+	spinner.start()
+	start = time.time()
+	for _ in range(10):
+		solve_candidate(ftocp, **job)
+	elapsed = time.time() - start
+	stop.set()
+	spinner.join()
+
+	assert count[0] > 0.2*spin_rate*elapsed
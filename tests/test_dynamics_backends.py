@@ -0,0 +1,42 @@
+import shutil
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('casadi')
+
+from dynamics_models import DT_Kin_Bike_Model
+
+def get_batch(M=20, seed=0):
+	rng = np.random.RandomState(seed)
+	x = np.vstack((rng.uniform(-5, 5, M), rng.uniform(-5, 5, M), rng.uniform(-np.pi, np.pi, M), rng.uniform(-2, 5, M)))
+	u = np.vstack((rng.uniform(-0.4, 0.4, M), rng.uniform(-3, 3, M)))
+	return x, u
+
+def get_backends(tmp_path):
+	backends = ['numpy', 'casadi']
+	if shutil.which('gcc') is not None:
+		backends.append('codegen')
+	return [DT_Kin_Bike_Model(0.5, 0.5, 0.1, backend=b, codegen_dir=str(tmp_path)) for b in backends]
+
+def test_backends_agree(tmp_path):
+	x, u = get_batch()
+	models = get_backends(tmp_path)
+	x_kp1_ref = models[0].sim_batch(x, u)
+	A_ref, B_ref, c_ref = models[0].get_jacs_batch(x, u)
+	for m in models[1:]:
+		A, B, c = m.get_jacs_batch(x, u)
+		assert np.allclose(m.sim_batch(x, u), x_kp1_ref, atol=1e-10)
+		assert np.allclose(A, A_ref, atol=1e-10)
+		assert np.allclose(B, B_ref, atol=1e-10)
+		assert np.allclose(c, c_ref, atol=1e-10)
+
+def test_batch_matches_single_jacobians():
+	x, u = get_batch(M=5)
+	model = DT_Kin_Bike_Model(0.5, 0.5, 0.1)
+	A, B, c = model.get_jacs_batch(x, u)
+	for k in range(x.shape[1]):
+		A_k, B_k, c_k = model.get_jacs(x[:,k], u[:,k])
+		assert np.allclose(A[k], A_k)
+		assert np.allclose(B[k], B_k)
+		assert np.allclose(c[k], c_k)
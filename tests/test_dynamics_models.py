@@ -0,0 +1,59 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('casadi')
+
+from dynamics_models import DT_Kin_Bike_Model
+
+def get_sim_jacs(model, x, u, eps=1e-6):
+	# Central differences of the discrete step, offset by the identity as in get_jacs
+	A = np.zeros((model.n_x, model.n_x))
+	B = np.zeros((model.n_x, model.n_u))
+	for i in range(model.n_x):
+		e = np.zeros(model.n_x)
+		e[i] = eps
+		A[:,i] = (model.sim(x + e, u) - model.sim(x - e, u))/(2*eps)
+	for i in range(model.n_u):
+		e = np.zeros(model.n_u)
+		e[i] = eps
+		B[:,i] = (model.sim(x, u + e) - model.sim(x, u - e))/(2*eps)
+	return A - np.eye(model.n_x), B, model.sim(x, u) - x
+
+@pytest.mark.parametrize('l_r', [0.3, 0.5, 1.2])
+def test_jacs_match_finite_differences(l_r):
+	rng = np.random.RandomState(0)
+	model = DT_Kin_Bike_Model(l_r, 0.5, 0.1)
+	for _ in range(10):
+		x = np.array([rng.uniform(-5, 5), rng.uniform(-5, 5), rng.uniform(-np.pi, np.pi), rng.uniform(-2, 5)])
+		u = np.array([rng.uniform(-0.4, 0.4), rng.uniform(-3, 3)])
+		A, B, c = model.get_jacs(x, u)
+		A_fd, B_fd, c_fd = get_sim_jacs(model, x, u)
+
+		assert np.allclose(A, A_fd, atol=1e-7)
+		assert np.allclose(B, B_fd, atol=1e-7)
+		assert np.allclose(c, c_fd)
+
+		A_b, B_b, c_b = model.get_jacs_batch(x.reshape((-1,1)), u.reshape((-1,1)))
+		assert np.allclose(A_b[0], A_fd, atol=1e-7)
+		assert np.allclose(B_b[0], B_fd, atol=1e-7)
+		assert np.allclose(c_b[0], c_fd)
+
+@pytest.mark.parametrize('integrator', ['euler', 'rk4'])
+def test_rollout_matches_sim(integrator):
+	rng = np.random.RandomState(1)
+	model = DT_Kin_Bike_Model(0.5, 0.5, 0.05, integrator=integrator)
+	x_0 = rng.uniform(-1, 1, (3, 4))
+	U = rng.uniform(-0.3, 0.3, (3, 2, 6))
+
+	# Each input is held for two model time steps
+	X = model.rollout(x_0, U, control_dt=0.1)
+	assert X.shape == (3, 4, 7)
+	for b in range(3):
+		x = x_0[b]
+		for t in range(6):
+			x = model.sim(model.sim(x, U[b,:,t]), U[b,:,t])
+			assert np.allclose(X[b,:,t+1], x)
+
+	assert np.allclose(model.rollout(x_0[0], U[0]), model.rollout(x_0[:1], U[:1])[0])
+	with pytest.raises(ValueError):
+		model.rollout(x_0, U, control_dt=0.12)
@@ -0,0 +1,47 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+matplotlib = pytest.importorskip('matplotlib')
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from utils.frame_writer import Frame_Writer
+
+def get_figure():
+	fig = plt.figure(figsize=(1, 1), dpi=20)
+	fig.canvas.draw()
+	return fig
+
+def test_writes_frames(tmp_path):
+	fig = get_figure()
+	writer = Frame_Writer(mode='png')
+	for i in range(3):
+		writer.write(fig, path=str(tmp_path / ('frame_%i.png' % i)))
+	writer.close()
+	plt.close(fig)
+
+	assert writer.n_written == 3
+	assert all((tmp_path / ('frame_%i.png' % i)).exists() for i in range(3))
+
+def test_close_raises_writer_error(tmp_path):
+	fig = get_figure()
+	writer = Frame_Writer(mode='png')
+	writer.write(fig, path=str(tmp_path / 'missing' / 'frame_0.png'))
+	writer.thread.join(10)
+	plt.close(fig)
+
+	assert not writer.thread.is_alive()
+	with pytest.raises(FileNotFoundError):
+		writer.close()
+
+def test_blocked_write_raises_writer_error(tmp_path):
+	# With a full queue the next write waits for the writer thread, which fails on the first frame instead of making space
+	fig = get_figure()
+	writer = Frame_Writer(mode='png', max_queue=1)
+	with pytest.raises(FileNotFoundError):
+		for i in range(10):
+			writer.write(fig, path=str(tmp_path / 'missing' / ('frame_%i.png' % i)))
+	plt.close(fig)
+
+	with pytest.raises(FileNotFoundError):
+		writer.close()
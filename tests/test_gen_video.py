@@ -0,0 +1,98 @@
+import os, shutil
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('matplotlib')
+
+from utils import gen_video
+from utils.run_store import Run_Store
+
+class Recording_Writer(object):
+	# Keeps copies of the frames of each video instead of piping them to ffmpeg
+	videos = {}
+
+	def __init__(self, mode='ffmpeg', max_queue=16, policy='block', fps=10):
+		self.path = None
+
+	def open_video(self, path):
+		self.path = path
+		self.videos[path] = []
+
+	def write(self, fig, path=None):
+		self.videos[self.path].append(np.array(fig.canvas.buffer_rgba()))
+
+	def close(self):
+		pass
+
+def get_run(tmp_path):
+	# Two agents driving in circles, the second one arrives earlier
+	run_dir = str(tmp_path / 'run')
+	x_cl = []
+	u_cl = []
+	for (a, T) in enumerate([9, 6]):
+		t = np.arange(T)
+		x_cl.append(np.vstack((2*np.cos(0.3*t) - a, 2*np.sin(0.3*t), 0.3*t + np.pi/2, np.ones(T))))
+		u_cl.append(np.vstack((0.1*np.ones(T-1), np.zeros(T-1))))
+	Run_Store(run_dir).append_iteration(x_cl, u_cl)
+	return run_dir
+
+def get_opts(run_dir):
+	return {'exp_dir' : run_dir, 'data_it' : 0, 'l_f' : 0.5, 'l_r' : 0.5, 'w' : 0.5, 'r' : 0.759, 'dt' : 0.1,
+		'x_lim' : [-6, 6], 'y_lim' : [-6, 6], 'fig_w' : 2, 'fig_h' : 2, 'dpi' : 30, 'fps' : 10, 'frame_queue' : 4, 'usetex' : False}
+
+def test_segment_jobs_cover_all_frames():
+	jobs, segments = gen_video.get_segment_jobs([0, 3], {0 : 9, 3 : 2}, 6, '/out', None)
+
+	for (i, T) in [(0, 9), (3, 2)]:
+		it_jobs = [j for j in jobs if j['it'] == i]
+		assert [j['path'] for j in it_jobs] == segments[i]
+		assert it_jobs[0]['t_start'] == 0 and it_jobs[-1]['t_end'] == T
+		assert all(j['t_end'] == k['t_start'] for (j, k) in zip(it_jobs[:-1], it_jobs[1:]))
+		assert all(j['t_end'] > j['t_start'] for j in it_jobs)
+	# Three segments per iteration for six workers, the short iteration only has two frames to split
+	assert len(segments[0]) == 3 and len(segments[3]) == 2
+
+def test_segments_match_serial_render(tmp_path, monkeypatch):
+	monkeypatch.setattr(gen_video, 'Frame_Writer', Recording_Writer)
+	opts = get_opts(get_run(tmp_path))
+
+	serial_jobs, _ = gen_video.get_segment_jobs([0], {0 : 9}, 1, str(tmp_path / 'serial'), opts)
+	seg_jobs, segments = gen_video.get_segment_jobs([0], {0 : 9}, 3, str(tmp_path / 'segs'), opts)
+	assert len(serial_jobs) == 1 and len(seg_jobs) == 3
+
+	serial = Recording_Writer.videos[gen_video.render_segment(serial_jobs[0])]
+	segmented = []
+	for job in seg_jobs:
+		segmented += Recording_Writer.videos[gen_video.render_segment(job)]
+
+	assert len(serial) == 9
+	assert len(segmented) == len(serial)
+	for (f_seg, f_serial) in zip(segmented, serial):
+		assert np.array_equal(f_seg, f_serial)
+	# Consecutive frames differ, i.e. the artists are updated
+	assert not np.array_equal(serial[0], serial[1])
+
+def test_join_single_segment(tmp_path):
+	seg = tmp_path / 'it_0_seg_0.mp4'
+	seg.write_bytes(b'video')
+	gen_video.join_segments([str(seg)], str(tmp_path / 'it_0.mp4'))
+
+	assert not seg.exists()
+	assert (tmp_path / 'it_0.mp4').read_bytes() == b'video'
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None or shutil.which('ffprobe') is None, reason='ffmpeg not installed')
+def test_join_rendered_segments(tmp_path):
+	import subprocess
+	opts = get_opts(get_run(tmp_path))
+	jobs, segments = gen_video.get_segment_jobs([0], {0 : 9}, 3, str(tmp_path), opts)
+	for job in jobs:
+		gen_video.render_segment(job)
+	vid_name = str(tmp_path / 'it_0.mp4')
+	gen_video.join_segments(segments[0], vid_name)
+
+	assert all(not os.path.exists(p) for p in segments[0])
+	assert sorted(os.listdir(str(tmp_path))) == ['it_0.mp4', 'run']
+	n_frames = subprocess.check_output(['ffprobe', '-v', 'error', '-count_frames', '-select_streams', 'v:0',
+		'-show_entries', 'stream=nb_read_frames', '-of', 'csv=p=0', vid_name])
+	assert int(n_frames) == 9
@@ -0,0 +1,47 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+cp = pytest.importorskip('cvxpy')
+pytest.importorskip('sklearn')
+
+from utils.safe_set_utils import get_hyperplane_offsets, separate_safe_sets
+
+def get_point_sets(rng, n=40):
+	pos_0 = rng.uniform(-1, 1, (2, n)) - np.array([[2.0], [0.0]])
+	pos_1 = rng.uniform(-1, 1, (2, n)) + np.array([[2.0], [0.0]])
+	return pos_0, pos_1
+
+def test_offsets_are_tight():
+	rng = np.random.RandomState(0)
+	for _ in range(10):
+		pos_0, pos_1 = get_point_sets(rng)
+		w = np.array([1.0, rng.uniform(-0.2, 0.2)])
+		b = rng.uniform(-0.1, 0.1)
+		a_0, a_1 = get_hyperplane_offsets(w, b, pos_0, pos_1)
+
+		# All points satisfy the shifted halfspaces and one point of each set lies on its boundary
+		assert np.all(w.dot(pos_0) + b <= -a_0 + 1e-12)
+		assert np.all(w.dot(pos_1) + b >= a_1 - 1e-12)
+		assert np.isclose(np.amax(w.dot(pos_0) + b), -a_0)
+		assert np.isclose(np.amin(w.dot(pos_1) + b), a_1)
+
+def test_exploration_spaces_contain_safe_sets():
+	rng = np.random.RandomState(1)
+	pos_0, pos_1 = get_point_sets(rng)
+	sep = separate_safe_sets(pos_0, pos_1, 0.5, 0.25, 0.25, hyperplane=(np.array([1.0, 0.0]), 0.0))
+
+	assert not sep['collision']
+	assert np.all(sep['w'].dot(pos_0) + sep['b'] + sep['a_0'] <= 0)
+	assert np.all(-sep['w'].dot(pos_1) - sep['b'] + sep['a_1'] <= 0)
+	# The exploration spaces are at least the collision distance apart
+	assert (sep['a_0'] + sep['a_1'])/np.linalg.norm(sep['w']) >= 0.5 - 1e-9
+
+@pytest.mark.skipif('MOSEK' not in cp.installed_solvers(), reason='The LP offsets are solved with MOSEK')
+def test_offsets_match_lps():
+	rng = np.random.RandomState(2)
+	pos_0, pos_1 = get_point_sets(rng)
+	get_hyperplane_offsets(np.array([1.0, 0.1]), 0.05, pos_0, pos_1, method='verify')
+
+def test_unknown_bound_method():
+	with pytest.raises(ValueError):
+		get_hyperplane_offsets(np.ones(2), 0.0, np.zeros((2, 1)), np.ones((2, 1)), method='lp')
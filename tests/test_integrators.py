@@ -0,0 +1,77 @@
+import importlib.util
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('casadi')
+
+from conftest import BASE_DIR
+from utils.kin_bike_dynamics import get_kin_bike_step_function
+from dynamics_models import DT_Kin_Bike_Model
+from agents import DT_Kin_Bike_Agent
+from NL_FTOCP import NL_FTOCP
+
+def get_batch(M=10, seed=0):
+	rng = np.random.RandomState(seed)
+	x = np.vstack((rng.uniform(-5, 5, M), rng.uniform(-5, 5, M), rng.uniform(-np.pi, np.pi, M), rng.uniform(0, 3, M)))
+	u = np.vstack((rng.uniform(-0.4, 0.4, M), rng.uniform(-2, 2, M)))
+	return x, u
+
+def test_step_functions_are_cached():
+	f = get_kin_bike_step_function(0.5, 0.5, 0.2, integrator='rk4', n_steps=2)
+	assert get_kin_bike_step_function(0.5, 0.5, 0.2, integrator='rk4', n_steps=2) is f
+	assert get_kin_bike_step_function(0.5, 0.5, 0.2, integrator='rk4', n_steps=1) is not f
+
+	# Models with the same parameters share the step function
+	assert DT_Kin_Bike_Model(0.5, 0.5, 0.2, integrator='rk4', n_steps=2).get_step_function() is f
+	with pytest.raises(ValueError):
+		DT_Kin_Bike_Model(0.5, 0.5, 0.2, integrator='midpoint')
+
+def test_numpy_rk4_matches_step_function():
+	x, u = get_batch()
+	model = DT_Kin_Bike_Model(0.5, 0.5, 0.2, integrator='rk4', n_steps=2)
+	x_kp1 = model.sim_batch(x, u)
+	f = model.get_step_function()
+	for k in range(x.shape[1]):
+		assert np.allclose(x_kp1[:,k], np.array(f(x[:,k], u[:,k])).ravel(), atol=1e-12)
+		assert np.allclose(model.sim(x[:,k], u[:,k]), x_kp1[:,k])
+
+	casadi_model = DT_Kin_Bike_Model(0.5, 0.5, 0.2, backend='casadi', integrator='rk4', n_steps=2)
+	assert np.allclose(casadi_model.sim_batch(x, u), x_kp1, atol=1e-12)
+
+def test_rk4_is_accurate_at_coarse_steps():
+	# CVODES integrates the input held over dt to tight tolerances and serves as the reference
+	x, u = get_batch()
+	x_ref = DT_Kin_Bike_Model(0.5, 0.5, 0.2, integrator='cvodes').sim_batch(x, u)
+	err_euler = np.amax(np.abs(DT_Kin_Bike_Model(0.5, 0.5, 0.2).sim_batch(x, u) - x_ref))
+	err_rk4 = np.amax(np.abs(DT_Kin_Bike_Model(0.5, 0.5, 0.2, integrator='rk4').sim_batch(x, u) - x_ref))
+
+	assert err_rk4 < 1e-4
+	assert err_rk4 < 1e-2*err_euler
+
+def test_ftocp_uses_the_agent_integrator():
+	agent = DT_Kin_Bike_Agent(0.5, 0.5, 0.5, 0.2, col_buf=0.25, integrator='rk4', n_steps=2)
+	ftocp = NL_FTOCP(agent)
+	ftocp.solver_opts['linear_solver'] = 'mumps'
+	x_0 = np.array([0.0, 0.0, 0.0, 0.5])
+	# Reachable terminal state from a gentle turn while braking
+	x_ss = agent.rollout(x_0, np.tile(np.array([[0.1], [-0.2]]), (1, 5)))[:,-1]
+	x_pred, u_pred, cost = ftocp.solve_opti0(0, x_0, x_ss, 5)
+
+	assert cost is not None
+	# The predicted trajectory is feasible for the simulator with the same discretization
+	for k in range(u_pred.shape[1]):
+		assert np.allclose(x_pred[:,k+1], agent.sim(x_pred[:,k], u_pred[:,k]), atol=1e-6)
+
+def test_centralized_model_steps_agents_independently():
+	path = '/'.join((BASE_DIR, 'decentralized_LMPC', '3_agent_nl_centralized_demo', 'dynamics_models.py'))
+	spec = importlib.util.spec_from_file_location('centralized_dynamics_models', path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+
+	x, u = get_batch(M=3)
+	model = module.Centralized_DT_Kin_Bike_Model(0.5, 0.5, 0.2, 3, integrator='rk4', n_steps=2)
+	x_kp1 = model.sim(x.T.ravel(), u.T.ravel())
+	single = DT_Kin_Bike_Model(0.5, 0.5, 0.2, integrator='rk4', n_steps=2)
+	for i in range(3):
+		assert np.allclose(x_kp1[4*i:4*(i+1)], single.sim(x[:,i], u[:,i]))
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+# The plotting modules only select the interactive backend if none is set
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('matplotlib')
+
+from utils.lmpc_visualizer import lmpc_visualizer
+
+T = 8
+N = 3
+
+def get_visualizer(blit, shade_res=200):
+	vis = lmpc_visualizer(pos_dims=[0,1], n_state_dims=4, n_act_dims=2, agent_id=0, n_agents=2, plot_lims=[[-1, 1], [-1, 1]], blit=blit, shade_res=shade_res)
+	x_cls = [np.vstack((np.linspace(-0.5, 0.5, T), 0.3*a*np.ones(T), np.zeros((2, T)))) for a in range(2)]
+	u_cls = [0.1*np.ones((2, T-1)) for _ in range(2)]
+	vis.update_prev_trajs([x_cls], [u_cls])
+	return vis, x_cls[0], u_cls[0]
+
+def get_expl_con():
+	# Two halfspaces per time step, y <= 0.5 and x <= 0.9
+	return [(np.array([[0.0, 1.0], [1.0, 0.0]]), np.array([-0.5, -0.9])) for _ in range(T)]
+
+def plot_step(vis, x_cl, u_cl, t, expl_con=None, shade=False):
+	vis.plot_traj(x_cl[:,:t+1], u_cl[:,:t], x_cl[:,t:t+N+1], u_cl[:,t:t+N], t, expl_con=expl_con, shade=shade)
+	return np.array(vis.fig.canvas.buffer_rgba())
+
+def test_blitted_frames_match_full_redraws():
+	vis, x_cl, u_cl = get_visualizer(True)
+	n_draws = [0]
+	vis.fig.canvas.mpl_connect('draw_event', lambda e: n_draws.__setitem__(0, n_draws[0]+1))
+	frames = [plot_step(vis, x_cl, u_cl, t) for t in range(4)]
+	# Only the first frame and frames where the time series axes grow redraw the figure
+	assert n_draws[0] < len(frames)
+
+	ref, _, _ = get_visualizer(True)
+	for t in range(4):
+		ref.background = None
+		assert np.array_equal(plot_step(ref, x_cl, u_cl, t), frames[t])
+
+	vis.close_figure()
+	ref.close_figure()
+
+def test_exploration_boundaries_are_one_collection():
+	vis, x_cl, u_cl = get_visualizer(False)
+	plot_step(vis, x_cl, u_cl, 2, expl_con=get_expl_con())
+
+	# One segment per halfspace and prediction step, spanning the plot limits
+	segments = vis.expl_bound_xy.get_segments()
+	assert len(segments) == 2*(N+1)
+	assert all(np.allclose(s[:,0], [-1, 1]) for s in segments)
+	assert np.allclose(segments[0][:,1], 0.5)
+	vis.close_figure()
+
+def test_shading_matches_pointwise_check():
+	res = 15
+	vis, x_cl, u_cl = get_visualizer(False, shade_res=res)
+	# Shrinking boxes |x|, |y| <= r so that the earlier prediction steps are drawn over the later ones
+	expl_con = []
+	for k in range(T):
+		r = 0.9 - 0.1*k
+		expl_con.append((np.array([[1.0, 0.0], [-1.0, 0.0], [0.0, 1.0], [0.0, -1.0]]), -r*np.ones(4)))
+	t = 2
+	plot_step(vis, x_cl, u_cl, t, expl_con=expl_con, shade=True)
+	shade = np.asarray(vis.shade_img.get_array())
+
+	import matplotlib.pyplot as plt
+	c_pred = [plt.get_cmap('jet')(i*(1./N)) for i in range(N+1)]
+	grid = np.linspace(-1, 1, res)
+	expected = np.zeros((res, res, 4))
+	for (r, y) in enumerate(grid):
+		for (c, x) in enumerate(grid):
+			for i in range(t, t+N+1):
+				H, g = expl_con[i]
+				if np.all(H.dot(np.array([x, y])) + g <= 0):
+					expected[r,c] = c_pred[i-t][:3] + (0.3,)
+					break
+	assert np.any(expected[:,:,3] > 0)
+	assert np.allclose(shade, expected)
+
+	# Shading is hidden again when the next step is plotted without it
+	plot_step(vis, x_cl, u_cl, t+1, expl_con=expl_con)
+	assert not vis.shade_img.get_visible()
+	vis.close_figure()
+
+def test_saved_blitted_frames(tmp_path):
+	vis, x_cl, u_cl = get_visualizer(True)
+	vis.set_save_dir(str(tmp_path))
+	frame = plot_step(vis, x_cl, u_cl, 0)
+	vis.close_figure()
+
+	import matplotlib.image
+	saved = matplotlib.image.imread(str(tmp_path / 'agent_1_it_1_time_0.png'))
+	assert np.array_equal((255*saved).round().astype(np.uint8), frame)
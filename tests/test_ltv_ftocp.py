@@ -0,0 +1,64 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+cp = pytest.importorskip('cvxpy')
+pytest.importorskip('casadi')
+if 'OSQP' not in cp.installed_solvers():
+	pytest.skip('OSQP not installed', allow_module_level=True)
+
+from agents import DT_Kin_Bike_Agent
+from LTV_FTOCP import LTV_FTOCP
+
+N = 5
+
+def get_ftocp(**kwargs):
+	agent = DT_Kin_Bike_Agent(0.5, 0.5, 0.5, 0.1, col_buf=0.25)
+	return LTV_FTOCP(np.eye(4), np.eye(4), 0.1*np.eye(2), 0.1*np.eye(2), N, agent,
+		x_refs=[np.array([1.0, 0.2, 0.0, 0.0])], solver='OSQP', **kwargs)
+
+def run(ftocp, n_steps):
+	# Closed loop with the first input of each solution applied to the agent model
+	x_t = np.array([0.0, 0.0, 0.0, 0.5])
+	sols = []
+	for t in range(n_steps):
+		x_pred, u_pred = ftocp.solve(x_t, t*ftocp.dt)
+		sols.append((x_t, x_pred, u_pred))
+		x_t = ftocp.agent.sim(x_t, u_pred[:,0])
+	return sols
+
+def test_predictions_are_kept_in_buffers(tmp_path):
+	ftocp = get_ftocp(pred_capacity=2, pred_spill_prefix=str(tmp_path / 'ltv'))
+	sols = run(ftocp, 4)
+
+	assert len(ftocp.x_preds) == 2
+	assert np.array_equal(ftocp.x_preds.last(), sols[-1][1])
+	assert np.array_equal(ftocp.u_preds[-2], sols[-2][2])
+	# The zero initial guess and the first two solutions were pushed out to the spill files
+	x_spilled = ftocp.x_preds.load_spilled()
+	assert x_spilled.shape == (3, 4, N+1)
+	assert np.array_equal(x_spilled[0], np.zeros((4, N+1)))
+	assert np.array_equal(x_spilled[1:], np.stack([s[1] for s in sols[:2]]))
+	assert np.array_equal(ftocp.u_preds.load_spilled()[2], sols[1][2])
+
+def test_problem_is_built_once_and_matches_fresh_builds():
+	ftocp = get_ftocp()
+	sols = run(ftocp, 3)
+	problem = ftocp.problem['problem']
+	assert problem.is_dpp()
+
+	prev_u = np.zeros((2, N))
+	prev_x = np.zeros((4, N+1))
+	for (x_t, x_pred, u_pred) in sols:
+		# A new FTOCP linearized about the same previous solution
+		fresh = get_ftocp()
+		fresh.x_preds.append(prev_x)
+		fresh.u_preds.append(prev_u)
+		x_fresh, u_fresh = fresh.solve(x_t, 0)
+		assert np.allclose(x_pred, x_fresh, atol=1e-3)
+		assert np.allclose(u_pred, u_fresh, atol=1e-3)
+		prev_x, prev_u = x_pred, u_pred
+
+	# Further solves update the parameters of the same problem
+	run(ftocp, 1)
+	assert ftocp.problem['problem'] is problem
+	assert len(ftocp.cost) == 4
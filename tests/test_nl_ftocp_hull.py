@@ -0,0 +1,44 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('casadi')
+
+from agents import DT_Kin_Bike_Agent
+from NL_FTOCP import NL_FTOCP
+
+def get_ftocp(hull_capacity=4):
+	agent = DT_Kin_Bike_Agent(0.5, 0.5, 0.5, 0.1, col_buf=0.25)
+	ftocp = NL_FTOCP(agent, hull_capacity=hull_capacity)
+	ftocp.solver_opts['linear_solver'] = 'mumps'
+	return ftocp
+
+def test_hull_solvers_are_keyed_by_capacity():
+	ftocp = get_ftocp()
+
+	solver = ftocp.get_opti_solver(5, n_ss=2)
+	assert ftocp.get_opti_solver(5, n_ss=3) is solver
+	assert ftocp.get_opti_solver(5, n_ss=4) is solver
+	assert solver['n_ss'] == 4
+
+	# Growing the capacity replaces the hull solvers instead of adding one per safe set size
+	for n_ss in range(5, 9):
+		ftocp.get_opti_solver(5, n_ss=n_ss)
+	assert ftocp.hull_capacity == 8
+	assert list(ftocp.opti_solvers.keys()) == [(5, 0, 8, False)]
+
+def test_padded_points_are_not_selected():
+	ftocp = get_ftocp()
+	N = 5
+	x_0 = np.array([0.0, 0.0, 0.0, 0.5])
+
+	# Two points reachable by coasting and by braking, the padding points are at the origin with zero cost-to-go and
+	# must stay unused
+	SS = np.array([[0.25, 0.0, 0.0, 0.5], [0.24, 0.0, 0.0, 0.45]]).T
+	Qfun = np.array([3.0, 2.0])
+	x_pred, u_pred, cost, lamb = ftocp.solve_opti_hull(0, x_0, SS, Qfun, N)
+
+	assert cost is not None
+	assert lamb.shape == (2,)
+	assert np.isclose(np.sum(lamb), 1, atol=1e-6)
+	assert np.allclose(x_pred[:,-1], SS.dot(lamb), atol=1e-5)
+	assert np.isclose(cost, N + Qfun.dot(lamb), atol=1e-5)
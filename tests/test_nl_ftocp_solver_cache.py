@@ -0,0 +1,63 @@
+import importlib.util, os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('casadi')
+
+from conftest import BASE_DIR
+from agents import DT_Kin_Bike_Agent
+import NL_FTOCP as rand_nl_ftocp
+
+def load_demo_ftocp(demo):
+	# The demos each have their own NL_FTOCP module, which only depends on CasADi and NumPy
+	path = '/'.join((BASE_DIR, 'decentralized_LMPC', demo, 'NL_FTOCP.py'))
+	spec = importlib.util.spec_from_file_location('NL_FTOCP_%s' % demo, path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module.NL_FTOCP
+
+def get_ftocp(demo):
+	agent = DT_Kin_Bike_Agent(0.5, 0.5, 0.5, 0.1, col_buf=0.25)
+	ftocp_class = rand_nl_ftocp.NL_FTOCP if demo is None else load_demo_ftocp(demo)
+	ftocp = ftocp_class(agent)
+	ftocp.solver_opts['linear_solver'] = 'mumps'
+	return ftocp
+
+N = 5
+x_0 = np.array([0.0, 0.0, 0.0, 0.5])
+x_ss = np.array([0.24, 0.0, 0.0, 0.45])
+last_u = np.zeros(2)
+
+def get_expl_constraints(n_h):
+	# Halfspaces x <= 2 at every other time step, the others are padded
+	return [(np.tile([[1.0, 0.0]], (n_h, 1)), -2.0*np.ones(n_h)) if i % 2 == 0 else (np.zeros((0, 2)), np.zeros(0)) for i in range(N)]
+
+@pytest.mark.parametrize('demo', [None, '3_agent_nl_demo', 'multi_agent_nl_demo'])
+def test_solvers_are_reused(demo):
+	ftocp = get_ftocp(demo)
+	x_pred, _, cost = ftocp.solve_opti(1, x_0, x_ss, N, last_u)
+	solver = ftocp.get_opti_solver(N)
+	ftocp.solve_opti(1, x_0, x_ss + 0.001, N, last_u)
+	assert ftocp.get_opti_solver(N) is solver
+	assert np.allclose(x_pred[:,-1], x_ss, atol=1e-5)
+
+	# A solver is built per number of halfspaces, time steps with fewer halfspaces are padded with inactive constraints
+	x_pred_h, _, cost_h = ftocp.solve_opti(1, x_0, x_ss, N, last_u, expl_constraints=get_expl_constraints(2))
+	assert ftocp.get_opti_solver(N, n_h=2) is not solver
+	assert np.isclose(cost_h, cost, atol=1e-6)
+	assert np.allclose(x_pred_h, x_pred, atol=1e-4)
+
+@pytest.mark.parametrize('demo', [None, '3_agent_nl_demo', 'multi_agent_nl_demo'])
+def test_failed_solve_does_not_raise_or_leak(demo):
+	ftocp = get_ftocp(demo)
+	x_pred, u_pred, cost = ftocp.solve_opti(1, x_0, x_ss, N, last_u)
+
+	# The initial speed is outside of the state bounds
+	x_bad, _, cost_bad = ftocp.solve_opti(1, np.array([0.0, 0.0, 0.0, 20.0]), x_ss, N, last_u)
+	assert x_bad is None and cost_bad is None
+
+	x_again, u_again, cost_again = ftocp.solve_opti(1, x_0, x_ss, N, last_u)
+	assert np.isclose(cost_again, cost, atol=1e-8)
+	assert np.allclose(x_again, x_pred, atol=1e-6)
+	assert np.allclose(u_again, u_pred, atol=1e-6)
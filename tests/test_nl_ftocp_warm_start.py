@@ -0,0 +1,35 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('casadi')
+
+from agents import DT_Kin_Bike_Agent
+from NL_FTOCP import NL_FTOCP
+
+def get_ftocp():
+	agent = DT_Kin_Bike_Agent(0.5, 0.5, 0.5, 0.1, col_buf=0.25)
+	ftocp = NL_FTOCP(agent, warm_start_duals=True)
+	ftocp.solver_opts['linear_solver'] = 'mumps'
+	return ftocp
+
+def test_candidates_without_duals_are_solved_cold():
+	ftocp = get_ftocp()
+	N = 5
+	x_0 = np.array([0.0, 0.0, 0.0, 0.5])
+	x_ss = np.array([0.24, 0.0, 0.0, 0.45])
+
+	assert 'warm_start_init_point' not in ftocp.solver_opts
+	x_cold, u_cold, cost_cold, lam_g = ftocp.solve_opti0(0, x_0, x_ss, N, return_duals=True)
+	assert cost_cold is not None
+	assert list(ftocp.opti0_solvers.keys()) == [(N, 0, None, False)]
+
+	# With duals the warm solver is used and converges to the same solution
+	x_warm, u_warm, cost_warm = ftocp.solve_opti0(0, x_0, x_ss, N, x_guess=x_cold, u_guess=u_cold, lam_g_guess=lam_g)
+	assert ftocp.opti0_solvers[(N, 0, None, True)]['warm']
+	assert np.isclose(cost_warm, cost_cold, atol=1e-6)
+	assert np.allclose(x_warm, x_cold, atol=1e-5)
+
+	# A cold solve after the warm one does not see its duals
+	x_again, _, cost_again = ftocp.solve_opti0(0, x_0, x_ss, N)
+	assert np.isclose(cost_again, cost_cold, atol=1e-8)
+	assert np.allclose(x_again, x_cold, atol=1e-8)
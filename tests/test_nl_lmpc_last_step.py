@@ -0,0 +1,45 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cvxpy')
+pytest.importorskip('sklearn')
+
+from agents import DT_Kin_Bike_Agent
+from NL_LMPC import NL_LMPC
+
+class Fake_FTOCP(object):
+	# Only the agent model is used once the horizon has shrunk to one step
+	def __init__(self):
+		self.agent = DT_Kin_Bike_Agent(0.5, 0.5, 0.5, 0.1)
+		self.n_x = 4
+		self.n_u = 2
+		self.warm_start_duals = False
+
+	def solve_opti(self, *args, **kwargs):
+		raise(AssertionError('No FTOCP is solved for the last step'))
+
+def test_last_step_rolls_out_previous_inputs():
+	T = 10
+	x_cl = np.vstack((np.linspace(0, 1, T), np.zeros((3, T))))
+	u_cl = np.zeros((2, T))
+	x_f = x_cl[:,-1]
+
+	lmpc = NL_LMPC(Fake_FTOCP(), 3)
+	lmpc.addTrajectory(x_cl, u_cl, x_f)
+	lmpc.update_safe_sets([{'it_range' : [0], 'ts_range' : [range(T//2, T)]} for _ in range(T)])
+
+	# Previous prediction with two steps, braking to a stop at the goal in the second one
+	x_t = x_f + np.array([-0.1, 0.0, 0.0, 1.0])
+	u_prev = np.array([[0.0, 0.0], [0.0, -10.0]])
+	lmpc.x_preds_best_it.append(np.zeros((4, 3)))
+	lmpc.u_preds_best_it.append(u_prev)
+	lmpc.idxs_best_it.append(None)
+	lmpc.ftocp_N = 1
+	lmpc.ftocp_N_last = 2
+
+	x_pred, u_pred, cost, _, _ = lmpc.solve(T-2, x_t, x_f, -6, verbose=False)
+
+	assert np.allclose(x_pred, lmpc.ftocp.agent.rollout(x_t, u_prev[:,1:]))
+	assert np.allclose(x_pred[:,-1], x_f)
+	assert np.allclose(u_pred, u_prev[:,1:])
+	assert cost == 1
@@ -0,0 +1,60 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cvxpy')
+pytest.importorskip('sklearn')
+
+from NL_LMPC import NL_LMPC
+
+class Fake_FTOCP(object):
+	def __init__(self):
+		self.n_x = 4
+		self.n_u = 2
+		self.warm_start_duals = False
+
+def get_lmpc(rng, lens):
+	lmpc = NL_LMPC(Fake_FTOCP(), 3)
+	for T in lens:
+		x = rng.randn(4, T)
+		lmpc.addTrajectory(x, rng.randn(2, T), x[:,-1])
+	return lmpc
+
+def get_ss_idxs(lens, n_t, n_its, n_ts):
+	ss_idxs = []
+	for t in range(n_t):
+		it_range = range(len(lens)-n_its, len(lens))
+		ts_range = [range(min(t, lens[j]-1), min(t+n_ts, lens[j])) for j in it_range]
+		ss_idxs.append({'it_range' : it_range, 'ts_range' : ts_range})
+	return ss_idxs
+
+def test_safe_sets_match_per_iteration_assembly():
+	rng = np.random.RandomState(0)
+	lens = [12, 9, 15]
+	lmpc = get_lmpc(rng, lens)
+	ss_idxs = get_ss_idxs(lens, 16, 2, 5)
+	lmpc.update_safe_sets(ss_idxs)
+
+	assert len(lmpc.SS_t) == len(ss_idxs)-1
+	for t in range(len(ss_idxs)-1):
+		it_range = ss_idxs[t]['it_range']
+		ts_range = ss_idxs[t]['ts_range']
+		SS = np.hstack([lmpc.x_cls[j][:,ts_range[i]] for (i, j) in enumerate(it_range)])
+		uSS = np.hstack([lmpc.u_cls[j][:,ts_range[i]] for (i, j) in enumerate(it_range)])
+		Qfun = np.concatenate([np.array(lmpc.Qfun[j])[list(ts_range[i])] for (i, j) in enumerate(it_range)])
+		idxs = [(j, k) for (i, j) in enumerate(it_range) for k in ts_range[i]]
+
+		assert np.array_equal(lmpc.SS_t[t], SS)
+		assert np.array_equal(lmpc.uSS_t[t], uSS)
+		assert np.array_equal(lmpc.Qfun_t[t], Qfun)
+		assert lmpc.idxs_t[t] == idxs
+
+def test_packed_data_is_appended_incrementally():
+	rng = np.random.RandomState(1)
+	lmpc = get_lmpc(rng, [7, 11, 5])
+	x_cls_packed = lmpc.x_cls_packed.copy()
+	Qfun_packed = lmpc.Qfun_packed.copy()
+
+	lmpc.pack_closed_loop_data()
+	assert lmpc.cl_offsets == [0, 7, 18]
+	assert np.array_equal(lmpc.x_cls_packed, x_cls_packed)
+	assert np.array_equal(lmpc.Qfun_packed, Qfun_packed)
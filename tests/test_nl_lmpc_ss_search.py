@@ -0,0 +1,57 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cvxpy')
+pytest.importorskip('sklearn')
+
+from NL_LMPC import NL_LMPC
+from candidate_executors import Serial_Executor
+
+class Fake_FTOCP(object):
+	# The cost of reaching a safe set point grows with its distance along the first axis, it is never below the horizon
+	# length, which is the lower bound used by the best-first search
+	def __init__(self):
+		self.n_x = 4
+		self.n_u = 2
+		self.warm_start_duals = False
+		self.n_solves = 0
+
+	def solve_opti0(self, ts, x_t, x_ss, N, x_guess=None, u_guess=None, **kwargs):
+		self.n_solves += 1
+		x_pred = np.linspace(x_t, x_ss, N+1).T
+		return x_pred, np.zeros((self.n_u, N)), N + 10*abs(x_ss[0] - 0.5)
+
+class Batch_Executor(Serial_Executor):
+	def __init__(self, n_workers):
+		self.n_workers = n_workers
+
+def get_lmpc(ss_search, n_workers=1):
+	T = 20
+	x = np.vstack((np.linspace(0, 1, T), np.zeros((3, T))))
+	u = np.zeros((2, T))
+	lmpc = NL_LMPC(Fake_FTOCP(), 3, executor=Batch_Executor(n_workers), ss_search=ss_search)
+	lmpc.addTrajectory(x, u, x[:,-1])
+	lmpc.update_safe_sets([{'it_range' : [0], 'ts_range' : [range(0, T)]} for _ in range(T)])
+	return lmpc, x
+
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_best_first_finds_the_exhaustive_optimum(n_workers):
+	lmpc_ex, x = get_lmpc('exhaustive')
+	x_pred_ex, _, cost_ex, _, _ = lmpc_ex.solve(0, x[:,0], x[:,-1], -3, verbose=False)
+
+	lmpc_bf, _ = get_lmpc('best_first', n_workers)
+	x_pred_bf, _, cost_bf, _, _ = lmpc_bf.solve(0, x[:,0], x[:,-1], -3, verbose=False)
+
+	assert cost_bf == cost_ex
+	assert np.allclose(x_pred_bf, x_pred_ex)
+	assert lmpc_bf.idxs_best_it[-1] == lmpc_ex.idxs_best_it[-1]
+
+	# The search stops once the lower bound of the remaining candidates exceeds the incumbent
+	n_cands = lmpc_ex.ftocp.n_solves
+	assert lmpc_bf.ftocp.n_solves < n_cands
+	assert lmpc_bf.n_ss_solves == lmpc_bf.ftocp.n_solves
+	assert lmpc_bf.n_ss_solves + lmpc_bf.n_ss_solves_avoided == n_cands
+
+def test_unknown_search_mode():
+	with pytest.raises(ValueError):
+		get_lmpc('depth_first')
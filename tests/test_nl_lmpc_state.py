@@ -0,0 +1,73 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cvxpy')
+pytest.importorskip('sklearn')
+
+from NL_LMPC import NL_LMPC
+
+class Fake_FTOCP(object):
+	# Returns the initial guess as the solution and records the guesses it was given
+	def __init__(self, n_x=4, n_u=2):
+		self.n_x = n_x
+		self.n_u = n_u
+		self.warm_start_duals = False
+		self.x_guesses = []
+
+	def solve_opti0(self, ts, x_t, x_ss, N, x_guess=None, u_guess=None, **kwargs):
+		self.x_guesses.append(x_guess)
+		return x_guess[:,:N+1], u_guess[:,:N], float(N)
+
+	def solve_opti(self, ts, x_t, x_ss, N, last_u, x_guess=None, u_guess=None, **kwargs):
+		self.x_guesses.append(x_guess)
+		return x_guess[:,:N+1], u_guess[:,:N], float(N)
+
+def get_trajectory(T, scale=1.0):
+	x = np.vstack((scale*np.linspace(0, 1, T), np.zeros((3, T))))
+	u = np.zeros((2, T))
+	return x, u
+
+def get_ss_idxs(T, n_t):
+	return [{'it_range' : [0], 'ts_range' : [range(T//2, T)]} for _ in range(n_t)]
+
+def test_resume_uses_exported_prediction(tmp_path):
+	T = 10
+	x_0, u_0 = get_trajectory(T)
+	x_f = x_0[:,-1]
+
+	lmpc = NL_LMPC(Fake_FTOCP(), 3)
+	lmpc.addTrajectory(x_0, u_0, x_f)
+	lmpc.update_safe_sets(get_ss_idxs(T, T))
+	x_pred, _, _, _, _ = lmpc.solve(0, x_0[:,0], x_f, -3, verbose=False)
+
+	path = str(tmp_path / 'lmpc_state.npz')
+	lmpc.export_state(path)
+	restored = NL_LMPC.from_state(path, Fake_FTOCP())
+
+	x_1, u_1 = get_trajectory(T, scale=0.9)
+	restored.addTrajectory(x_1, u_1, x_f)
+	restored.update_safe_sets(get_ss_idxs(T, T))
+	restored.solve(0, x_1[:,0], x_f, -3, verbose=False)
+
+	# The first solve of the resumed iteration is seeded with the first prediction of the exported iteration
+	assert np.allclose(restored.ftocp.x_guesses[0], x_pred)
+
+def test_resume_without_predictions_falls_back_to_closed_loop(tmp_path):
+	T = 10
+	x_0, u_0 = get_trajectory(T)
+	x_f = x_0[:,-1]
+
+	lmpc = NL_LMPC(Fake_FTOCP(), 3)
+	lmpc.addTrajectory(x_0, u_0, x_f)
+	lmpc.update_safe_sets(get_ss_idxs(T, T))
+
+	path = str(tmp_path / 'lmpc_state.npz')
+	lmpc.export_state(path)
+	restored = NL_LMPC.from_state(path, Fake_FTOCP())
+
+	x_1, u_1 = get_trajectory(T, scale=0.9)
+	restored.addTrajectory(x_1, u_1, x_f)
+	restored.update_safe_sets(get_ss_idxs(T, T))
+	restored.solve(0, x_1[:,0], x_f, -3, verbose=False)
+
+	assert np.allclose(restored.ftocp.x_guesses[0], x_1[:,:4])
@@ -0,0 +1,46 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from utils.prediction_buffer import Prediction_Buffer
+
+def test_ring_keeps_latest_predictions():
+	buf = Prediction_Buffer((2, 3), capacity=3)
+	assert len(buf) == 0
+	with pytest.raises(IndexError):
+		buf.last()
+
+	preds = [k*np.ones((2, 3)) for k in range(5)]
+	for p in preds:
+		buf.append(p)
+
+	assert len(buf) == 3
+	assert np.array_equal(buf.last(), preds[-1])
+	assert np.array_equal(buf[-3], preds[2])
+	assert np.array_equal(buf.get_retained(), np.stack(preds[2:]))
+	with pytest.raises(IndexError):
+		buf[-4]
+	with pytest.raises(IndexError):
+		buf[0]
+	# Nothing is spilled without a spill file
+	assert buf.load_spilled().shape == (0, 2, 3)
+
+	with pytest.raises(ValueError):
+		Prediction_Buffer((2, 3), capacity=0)
+
+def test_spilled_predictions(tmp_path):
+	spill_path = str(tmp_path / 'preds.bin')
+	rng = np.random.RandomState(0)
+	preds = [rng.randn(4, 6) for _ in range(7)]
+	buf = Prediction_Buffer((4, 6), capacity=2, spill_path=spill_path, init=preds[0])
+	for p in preds[1:]:
+		buf.append(p)
+
+	assert buf.n_spilled == 5
+	assert np.array_equal(buf.load_spilled(), np.stack(preds[:5]))
+	assert np.array_equal(buf.get_retained(), np.stack(preds[5:]))
+
+	# A new buffer on the same path starts an empty spill file
+	buf = Prediction_Buffer((4, 6), capacity=2, spill_path=spill_path)
+	buf.append(preds[0])
+	assert buf.load_spilled().shape == (0, 4, 6)
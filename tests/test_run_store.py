@@ -0,0 +1,108 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from utils.run_store import Prediction_Archive, Run_Store
+
+def get_preds(rng, n_ts, n_x=4):
+	# Predictions with a horizon which shrinks towards the end of the iteration
+	return [rng.randn(n_x, max(2, 6-t)) for t in range(n_ts)]
+
+def test_archive_round_trip(tmp_path):
+	rng = np.random.RandomState(0)
+	preds = [get_preds(rng, 8), get_preds(rng, 5)]
+	prefix = str(tmp_path / 'x_ol')
+	Prediction_Archive.write(prefix, preds)
+	archive = Prediction_Archive(prefix)
+
+	assert len(archive) == 2
+	for (a, agent_preds) in enumerate(preds):
+		assert len(archive[a]) == len(agent_preds)
+		for (t, p) in enumerate(agent_preds):
+			assert np.array_equal(archive[a][t], p)
+		assert np.array_equal(archive[a][-1], agent_preds[-1])
+		assert all(np.array_equal(p, q) for (p, q) in zip(archive[a][1:3], agent_preds[1:3]))
+
+def test_agents_without_predictions(tmp_path):
+	prefix = str(tmp_path / 'x_ol')
+	Prediction_Archive.write(prefix, [[], []])
+	archive = Prediction_Archive(prefix)
+	assert len(archive) == 2
+	assert len(archive[0]) == 0 and len(archive[1]) == 0
+
+	# Trailing agents without predictions
+	Prediction_Archive.write(prefix, [[np.ones((4, 3))], [], []])
+	archive = Prediction_Archive(prefix)
+	assert len(archive) == 3
+	assert len(archive[0]) == 1
+	assert len(archive[2]) == 0
+	assert archive[2][:] == []
+
+def test_run_store_round_trip(tmp_path):
+	rng = np.random.RandomState(1)
+	store = Run_Store(str(tmp_path / 'run'))
+	x_cl = [rng.randn(4, 10), rng.randn(4, 12)]
+	u_cl = [rng.randn(2, 9), rng.randn(2, 11)]
+	store.append_iteration(x_cl, u_cl)
+	x_ol = [get_preds(rng, 9), get_preds(rng, 11)]
+	u_ol = [get_preds(rng, 9, 2), get_preds(rng, 11, 2)]
+	store.append_iteration(x_cl, u_cl, x_ol=x_ol, u_ol=u_ol, it_time=1.5, agent_times=[0.5, 1.0], solve_times=[np.ones(9), np.ones(11)])
+
+	# Reopening reads the manifest, iteration 0 has no open loop data
+	store = Run_Store(str(tmp_path / 'run'))
+	assert store.get_num_iterations() == 2
+	assert store.load_open_loop(0) == (None, None)
+	x_cls, _ = store.load_closed_loops()
+	assert all(np.array_equal(x_cls[1][a], x_cl[a]) for a in range(2))
+	x_ol_l, u_ol_l = store.load_open_loop(1)
+	assert np.array_equal(x_ol_l[1][4], x_ol[1][4])
+	assert np.array_equal(u_ol_l[0][-1], u_ol[0][-1])
+	it_time, agent_times, solve_times = store.load_timing(1)
+	assert it_time == 1.5 and agent_times == [0.5, 1.0]
+	assert np.array_equal(solve_times[1], np.ones(11))
+
+	with pytest.raises(ValueError):
+		store.append_iteration(x_cl + x_cl[:1], u_cl + u_cl[:1])
+
+class Fake_LMPC(object):
+	def __init__(self, i):
+		self.i = i
+
+	def export_state(self, path):
+		with open(path, 'wb') as f:
+			np.savez(f, i=self.i)
+
+def test_iterations_are_append_only(tmp_path):
+	run_dir = str(tmp_path / 'run')
+	store = Run_Store(run_dir)
+	x_cl = [np.zeros((4, 5)), np.ones((4, 6))]
+	u_cl = [np.zeros((2, 4)), np.ones((2, 5))]
+	assert store.append_iteration(x_cl, u_cl) == 0
+
+	# Files of stored iterations are not rewritten by later iterations
+	it_0 = tmp_path / 'run' / 'it_0'
+	mtimes = {f.name : f.stat().st_mtime_ns for f in it_0.iterdir()}
+	assert store.append_iteration(x_cl, u_cl) == 1
+	assert {f.name : f.stat().st_mtime_ns for f in it_0.iterdir()} == mtimes
+
+	# The directory of the next iteration can be used before the iteration is stored
+	assert store.get_iteration_dir(2) == '/'.join((run_dir, 'it_2'))
+	assert (tmp_path / 'run' / 'it_2').is_dir()
+	assert Run_Store(run_dir).get_num_iterations() == 2
+
+	store.save_lmpc_states([Fake_LMPC(0), Fake_LMPC(1)])
+	paths = Run_Store(run_dir).get_lmpc_state_paths()
+	assert [int(np.load(p)['i']) for p in paths] == [0, 1]
+	assert not any(f.name.endswith('.tmp') for f in (tmp_path / 'run').iterdir())
+
+def test_unsupported_version(tmp_path):
+	run_dir = str(tmp_path / 'run')
+	Run_Store(run_dir).append_iteration([np.zeros((4, 2))], [np.zeros((2, 1))])
+	with open('/'.join((run_dir, Run_Store.MANIFEST)), 'r') as f:
+		manifest = f.read()
+	with open('/'.join((run_dir, Run_Store.MANIFEST)), 'w') as f:
+		f.write(manifest.replace('"version": 2', '"version": 1'))
+
+	assert Run_Store.exists(run_dir)
+	with pytest.raises(ValueError):
+		Run_Store(run_dir)
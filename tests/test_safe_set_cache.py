@@ -0,0 +1,53 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('matplotlib')
+pytest.importorskip('cvxpy')
+
+from utils.safe_set_utils import get_safe_set_2, Safe_Set_Cache
+
+class Fake_Agent(object):
+	def get_collision_buff_r(self):
+		return 0.5
+
+def get_iteration(n_a, n_ts, rng):
+	# Agents drive along parallel lanes, the lanes are wide enough that the safe sets stay separated
+	x_cls = []
+	for a in range(n_a):
+		x_cl = np.zeros((4, n_ts + rng.randint(0, 5)))
+		x_cl[0] = np.linspace(0, 10, x_cl.shape[1]) + rng.uniform(-0.1, 0.1, x_cl.shape[1])
+		x_cl[1] = 3.0*a + rng.uniform(-0.5, 0.5, x_cl.shape[1])
+		x_cls.append(x_cl)
+	return x_cls
+
+def test_windows_are_reused_across_iterations():
+	rng = np.random.RandomState(0)
+	n_a = 3
+	agents = [Fake_Agent() for _ in range(n_a)]
+	x_cls = [get_iteration(n_a, 20, rng) for _ in range(2)]
+	cache = Safe_Set_Cache()
+
+	for it in range(2):
+		ss_idxs, expl = get_safe_set_2(x_cls, agents, 8, 2, separator='hull')
+		ss_idxs_c, expl_c = get_safe_set_2(x_cls, agents, 8, 2, cache=cache, separator='hull')
+
+		# The windows of the iteration which was the newest one in the previous call are reused, at least one per agent
+		# and time step of its trajectories
+		if it > 0:
+			assert cache.n_hits >= n_a*20
+		for a in range(n_a):
+			for t in range(len(ss_idxs[a])):
+				assert ss_idxs_c[a][t]['it_range'] == ss_idxs[a][t]['it_range']
+				assert ss_idxs_c[a][t]['ts_range'] == ss_idxs[a][t]['ts_range']
+				assert np.allclose(expl_c[a][t][0], expl[a][t][0], atol=1e-5)
+				assert np.allclose(expl_c[a][t][1], expl[a][t][1], atol=1e-5)
+
+		x_cls.append(get_iteration(n_a, 20, rng))
+
+	# Windows of iterations which are out of range are dropped
+	assert all(k[0] >= 1 for k in cache.windows.keys())
+
+def test_cache_requires_hull_separator():
+	rng = np.random.RandomState(0)
+	with pytest.raises(ValueError):
+		get_safe_set_2([get_iteration(2, 10, rng)], [Fake_Agent(), Fake_Agent()], 5, 1, cache=Safe_Set_Cache(), separator='svm')
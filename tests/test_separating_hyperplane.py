@@ -0,0 +1,46 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('sklearn')
+pytest.importorskip('cvxpy')
+
+from utils.safe_set_utils import get_separating_hyperplane
+
+def get_point_sets(n, gap, scale, rng):
+	# Two boxes of points at distance gap along the first axis, stretched along the second axis so that the bounding circle
+	# test does not apply and the hulls are separated with the SVM
+	pos_0 = rng.uniform(-1, 1, (2, n))
+	pos_0[0] -= 1 + gap/2
+	pos_1 = rng.uniform(-1, 1, (2, n))
+	pos_1[0] += 1 + gap/2
+	pos_0[1] *= scale
+	pos_1[1] *= scale
+	return pos_0, pos_1
+
+def test_separable_hulls_are_separated():
+	rng = np.random.RandomState(0)
+	for _ in range(20):
+		pos_0, pos_1 = get_point_sets(rng.randint(20, 200), 10**rng.uniform(-4, -1), rng.uniform(0.1, 10), rng)
+		w, b, collision = get_separating_hyperplane(pos_0, pos_1, 0.5, method='hull')
+
+		assert not collision
+		assert np.all(w.dot(pos_0) + b < 0)
+		assert np.all(w.dot(pos_1) + b > 0)
+
+def test_hull_margin_is_maximal():
+	# Two unit squares with a gap of 0.3 along the first axis, the maximum margin is the gap
+	square = np.array([[0.0, 1.0, 1.0, 0.0], [0.0, 0.0, 1.0, 1.0]])
+	pos_0 = np.hstack((square, np.array([[0.5], [0.5]])))
+	pos_1 = square + np.array([[1.3], [0.2]])
+	w, b, collision = get_separating_hyperplane(pos_0, pos_1, 0.5, method='hull')
+
+	assert not collision
+	assert np.isclose(2/np.linalg.norm(w), 0.3, rtol=1e-4)
+
+def test_overlapping_hulls_collide():
+	rng = np.random.RandomState(1)
+	pos_0, pos_1 = get_point_sets(50, -0.5, 1.0, rng)
+	w, _, collision = get_separating_hyperplane(pos_0, pos_1, 0.5, method='hull')
+
+	assert collision
+	assert np.all(w == 0)
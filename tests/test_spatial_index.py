@@ -0,0 +1,49 @@
+import itertools
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('matplotlib')
+pytest.importorskip('cvxpy')
+pytest.importorskip('sklearn')
+
+from utils import utils
+from utils.safe_set_utils import get_safe_set_2
+
+def test_overlapping_pairs_match_brute_force():
+	rng = np.random.RandomState(0)
+	for _ in range(20):
+		n = rng.randint(2, 15)
+		boxes = [utils.get_inflated_box(rng.uniform(-5, 5, (2, rng.randint(1, 4))), rng.uniform(0, 1)) for _ in range(n)]
+		pairs = set()
+		for (i, j) in itertools.combinations(range(n), 2):
+			if np.all(boxes[i][0] <= boxes[j][1]) and np.all(boxes[j][0] <= boxes[i][1]):
+				pairs.add((i, j))
+		assert utils.get_overlapping_pairs(boxes) == pairs
+
+	# Touching boxes overlap
+	assert utils.get_overlapping_pairs([(np.zeros(2), np.ones(2)), (np.ones(2), 2*np.ones(2))]) == {(0, 1)}
+
+class Fake_Agent(object):
+	def get_collision_buff_r(self):
+		return 0.25
+
+def test_pruned_pairs_give_the_same_safe_sets():
+	# Agents on a grid of lanes, only neighbouring lanes are close enough to be separated with the SVM
+	rng = np.random.RandomState(1)
+	n_a = 4
+	x_cls = []
+	for a in range(n_a):
+		x_cl = np.zeros((4, 15))
+		x_cl[0] = np.linspace(0, 5, 15) + 10.0*(a % 2)
+		x_cl[1] = 2.0*(a // 2) + rng.uniform(-0.2, 0.2, 15)
+		x_cls.append(x_cl)
+	agents = [Fake_Agent() for _ in range(n_a)]
+
+	ss_idxs, expl = get_safe_set_2([x_cls], agents, 6, 1, spatial_index=True)
+	ss_idxs_all, _ = get_safe_set_2([x_cls], agents, 6, 1, spatial_index=False)
+
+	for a in range(n_a):
+		assert [s['ts_range'] for s in ss_idxs[a]] == [s['ts_range'] for s in ss_idxs_all[a]]
+		# Every other agent contributes one halfspace
+		assert all(H.shape == (n_a-1, 2) for (H, _) in expl[a])
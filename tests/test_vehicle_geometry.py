@@ -0,0 +1,54 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from utils.vehicle_geometry import stack_trajs, get_vehicle_geometry
+
+def get_scalar_geometry(x_t, df, l_f, l_r, w, r, wheel_l, n_pts):
+	# Footprint of a single vehicle state, as computed per agent and frame by the plotting code
+	c, s = np.cos(x_t[2]), np.sin(x_t[2])
+	car = np.array([[x_t[0] + l_f*c + w*s/2, x_t[1] + l_f*s - w*c/2],
+		[x_t[0] + l_f*c - w*s/2, x_t[1] + l_f*s + w*c/2],
+		[x_t[0] - l_r*c - w*s/2, x_t[1] - l_r*s + w*c/2],
+		[x_t[0] - l_r*c + w*s/2, x_t[1] - l_r*s - w*c/2]])
+	wheel = np.array([[x_t[0] + l_f*c + wheel_l*np.cos(x_t[2]+df), x_t[1] + l_f*s + wheel_l*np.sin(x_t[2]+df)],
+		[x_t[0] + l_f*c - wheel_l*np.cos(x_t[2]+df), x_t[1] + l_f*s - wheel_l*np.sin(x_t[2]+df)]])
+	ang = np.linspace(0, 2*np.pi, n_pts)
+	circle = np.array([[x_t[0] + r*np.cos(a), x_t[1] + r*np.sin(a)] for a in ang])
+	return car, wheel, circle
+
+def test_stack_trajs_holds_last_state():
+	trajs = [np.arange(12).reshape((4,3)), np.arange(20).reshape((4,5))]
+	stacked, lens = stack_trajs(trajs)
+
+	assert stacked.shape == (2, 5, 4)
+	assert np.array_equal(lens, [3, 5])
+	assert np.array_equal(stacked[0,:3], trajs[0].T)
+	assert np.array_equal(stacked[0,3:], np.tile(trajs[0][:,-1], (2,1)))
+	assert np.array_equal(stacked[1], trajs[1].T)
+
+def test_geometry_matches_per_vehicle_loop():
+	rng = np.random.RandomState(0)
+	n_a, T = 3, 7
+	x = rng.uniform(-3, 3, (n_a, T, 4))
+	df = rng.uniform(-0.4, 0.4, (n_a, T))
+	l_f = np.array([0.5, 0.4, 0.6])
+	l_r = np.array([0.5, 0.3, 0.7])
+	w = 0.5
+	r = np.array([0.7, 0.6, 0.8])
+	geometry = get_vehicle_geometry(x, df, l_f, l_r, w, r=r, wheel_l=0.2, n_pts=50)
+
+	assert geometry['car'].shape == (n_a, T, 4, 2)
+	assert geometry['wheel'].shape == (n_a, T, 2, 2)
+	assert geometry['circle'].shape == (n_a, T, 50, 2)
+	for i in range(n_a):
+		for t in range(T):
+			car, wheel, circle = get_scalar_geometry(x[i,t], df[i,t], l_f[i], l_r[i], w, r[i], 0.2, 50)
+			assert np.allclose(geometry['car'][i,t], car)
+			assert np.allclose(geometry['wheel'][i,t], wheel)
+			assert np.allclose(geometry['circle'][i,t], circle)
+
+	# A single trajectory with scalar parameters and no collision circle
+	single = get_vehicle_geometry(x[1], df[1], l_f[1], l_r[1], w)
+	assert 'circle' not in single
+	assert np.allclose(single['car'], geometry['car'][1])
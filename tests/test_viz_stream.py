@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+# The plotting modules only select the interactive backend if none is set
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('matplotlib')
+
+from utils.viz_stream import Viz_Event_Stream, _Visualizer_Proxy
+
+class Fake_Stream(object):
+	def __init__(self):
+		self.events = []
+
+	def put(self, name, a=None, *args, **kwargs):
+		self.events.append((name, a, args, kwargs))
+
+def get_iteration_data(n_a, T):
+	x_cl = [np.vstack((np.linspace(-0.5, 0.5, T), 0.2*a*np.ones(T), np.zeros((2, T)))) for a in range(n_a)]
+	u_cl = [np.zeros((2, T-1)) for _ in range(n_a)]
+	expl_con = [(np.array([[0.0, 1.0]]), np.array([-0.9])) for _ in range(T)]
+	return x_cl, u_cl, expl_con
+
+def test_proxy_only_sends_new_data():
+	stream = Fake_Stream()
+	vis = _Visualizer_Proxy(stream, 1)
+	x_cl, u_cl, expl_con = get_iteration_data(2, 5)
+
+	vis.update_prev_trajs([x_cl], [u_cl])
+	vis.update_prev_trajs([x_cl, x_cl], [u_cl, u_cl])
+	assert [len(e[2][0]) for e in stream.events] == [1, 1]
+
+	stream.events = []
+	for t in range(3):
+		vis.plot_traj(x_cl[1][:,:t+1], u_cl[1][:,:t], x_cl[1][:,t:t+3], u_cl[1][:,t:t+2], t, expl_con=expl_con)
+	# The exploration constraints of an iteration are sent once
+	assert [e[0] for e in stream.events] == ['set_expl_con', 'plot_traj', 'plot_traj', 'plot_traj']
+	assert all(e[1] == 1 for e in stream.events)
+
+def test_frames_are_rendered_in_the_stream_process(tmp_path):
+	n_a = 2
+	T = 5
+	vis_kwargs = [{'pos_dims' : [0,1], 'n_state_dims' : 4, 'n_act_dims' : 2, 'agent_id' : a, 'n_agents' : n_a,
+		'plot_lims' : [[-1, 1], [-1, 1]]} for a in range(n_a)]
+	stream = Viz_Event_Stream(vis_kwargs)
+	x_cl, u_cl, expl_con = get_iteration_data(n_a, T)
+
+	vis = stream.get_visualizer(0)
+	vis.set_save_dir(str(tmp_path))
+	vis.update_prev_trajs([x_cl], [u_cl])
+	for t in range(3):
+		vis.plot_traj(x_cl[0][:,:t+1], u_cl[0][:,:t], x_cl[0][:,t:t+3], u_cl[0][:,t:t+2], t, expl_con=expl_con, shade=True)
+	stream.close()
+
+	assert stream.process.exitcode == 0
+	assert sorted(os.listdir(str(tmp_path))) == ['agent_1_it_1_time_%i.png' % t for t in range(3)]
@@ -0,0 +1,154 @@
+from __future__ import division
+
+import numpy as np
+import matplotlib.image
+import threading, collections, subprocess
+
+class Frame_Writer(object):
+	"""
+	Writes figure frames in a background thread so that PNG compression, video encoding and disk I/O overlap with the
+	work done between frames.
+
+	write grabs the RGBA buffer of the figure canvas after it has been drawn. The canvas reuses this buffer on the next
+	draw, so it is copied once into a pooled frame buffer, which is recycled after the frame is encoded. Frames are handed
+	to the writer thread through a queue holding at most max_queue items. When the queue is full, policy decides what
+	happens to a new frame:
+		- block: wait until the writer thread has caught up
+		- drop_newest: drop the new frame
+		- drop_oldest: drop the oldest queued frame
+	Modes:
+		- png: each frame is written to the path passed to write
+		- ffmpeg: frames are piped to an ffmpeg process encoding the video opened last with open_video
+	An exception in the writer thread stops it and is raised again by the next call to write, open_video or close
+	"""
+	def __init__(self, mode='png', max_queue=16, policy='block', fps=10):
+		if mode not in ['png', 'ffmpeg']:
+			raise(ValueError('Frame writer mode %s not recognized' % mode))
+		if policy not in ['block', 'drop_newest', 'drop_oldest']:
+			raise(ValueError('Frame writer policy %s not recognized' % policy))
+		self.mode = mode
+		self.max_queue = max_queue
+		self.policy = policy
+		self.fps = fps
+
+		self.items = collections.deque()
+		self.cond = threading.Condition()
+		self.free_bufs = collections.deque()
+
+		self.video_opened = False
+		self.proc = None
+		self.n_written = 0
+		self.n_dropped = 0
+		self.error = None
+
+		self.thread = threading.Thread(target=self._run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def open_video(self, path):
+		if self.mode != 'ffmpeg':
+			raise(ValueError('Videos can only be opened in ffmpeg mode'))
+		self.video_opened = True
+		self._put(('open', path, None), droppable=False)
+
+	def write(self, fig, path=None):
+		if self.mode == 'ffmpeg' and not self.video_opened:
+			raise(ValueError('No video opened for frame'))
+		if self.mode == 'png' and path is None:
+			raise(ValueError('Frames need a path in png mode'))
+
+		rgba = np.asarray(fig.canvas.buffer_rgba())
+		try:
+			buf = self.free_bufs.pop()
+			if buf.shape != rgba.shape:
+				buf = np.empty_like(rgba)
+		except IndexError:
+			buf = np.empty_like(rgba)
+		np.copyto(buf, rgba)
+
+		self._put(('frame', path, buf), droppable=True)
+
+	def close(self):
+		# Write all queued frames and finish the last video
+		if self.thread is not None:
+			try:
+				self._put(('stop', None, None), droppable=False)
+			finally:
+				self.thread.join()
+				self.thread = None
+		if self.error is not None:
+			raise(self.error)
+
+	def _put(self, item, droppable):
+		with self.cond:
+			self._check_thread()
+			while len(self.items) >= self.max_queue:
+				if droppable and self.policy == 'drop_newest':
+					self.n_dropped += 1
+					self.free_bufs.append(item[2])
+					return
+				if droppable and self.policy == 'drop_oldest':
+					# Only frames are dropped, opening a video or stopping the writer is never skipped
+					frame_idxs = [i for (i, it) in enumerate(self.items) if it[0] == 'frame']
+					if len(frame_idxs) > 0:
+						old = self.items[frame_idxs[0]]
+						del self.items[frame_idxs[0]]
+						self.n_dropped += 1
+						self.free_bufs.append(old[2])
+						continue
+				self.cond.wait()
+				self._check_thread()
+			self.items.append(item)
+			self.cond.notify_all()
+
+	def _check_thread(self):
+		# Called with the condition held, nothing can be queued once the writer thread has stopped
+		if self.error is not None:
+			raise(self.error)
+		if self.thread is None or not self.thread.is_alive():
+			raise(RuntimeError('Frame writer thread is not running'))
+
+	def _run(self):
+		try:
+			while True:
+				with self.cond:
+					while len(self.items) == 0:
+						self.cond.wait()
+					(kind, path, buf) = self.items.popleft()
+					self.cond.notify_all()
+
+				if kind == 'stop':
+					self._close_video()
+					break
+				elif kind == 'open':
+					self._close_video()
+					self.video_path = path
+				elif kind == 'frame':
+					if self.mode == 'png':
+						matplotlib.image.imsave(path, buf)
+					else:
+						if self.proc is None:
+							self._open_video(buf.shape[1], buf.shape[0])
+						self.proc.stdin.write(memoryview(buf))
+					self.n_written += 1
+					self.free_bufs.append(buf)
+		except Exception as e:
+			if self.proc is not None:
+				self.proc.kill()
+				self.proc = None
+			# Wake up callers waiting for space in the queue so that they see the error
+			with self.cond:
+				self.error = e
+				self.cond.notify_all()
+
+	def _open_video(self, width, height):
+		cmd = ['ffmpeg', '-y', '-loglevel', 'error',
+			'-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '%ix%i' % (width, height), '-r', str(self.fps), '-i', '-',
+			'-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', self.video_path]
+		self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+	def _close_video(self):
+		if self.proc is not None:
+			self.proc.stdin.close()
+			self.proc.wait()
+			self.proc = None
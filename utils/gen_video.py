@@ -1,150 +1,181 @@
 import numpy as np
-import copy, pickle, pdb, time, sys, os
+import copy, pickle, pdb, time, sys, os, argparse, subprocess
+import multiprocessing as mp
 
 import matplotlib
-matplotlib.use('TkAgg')
+matplotlib.use('Agg')
 from matplotlib import rc
-rc('text', usetex=True)
 
-import matplotlib.animation as manimation
 import matplotlib.pyplot as plt
 
-FFMpegWriter = manimation.writers['ffmpeg']
-writer = FFMpegWriter(fps=10)
-
-BASE_DIR = '/'.join(str.split(os.path.abspath('') , '/')[:-1])
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 sys.path.append(BASE_DIR)
 DATA_DIR = BASE_DIR + '/out'
 
-def main():
-    exp_dir = '/2020-03-15_16-39-46'
+from utils.run_store import Run_Store
+from utils.frame_writer import Frame_Writer
+from utils.vehicle_geometry import stack_trajs, get_vehicle_geometry
 
-    it = 20
-    n_a = 3
-    dt = 0.1
-    l_f = 0.5
-    l_r = 0.5
-    w = 0.5
-    r = 0.759
+AGENT_COLORS = np.array([[0, 0.4470, 0.7410], [0.8500, 0.3250, 0.0980], [0.6350, 0.0780, 0.1840]])
 
-    it_dir = DATA_DIR + exp_dir + ('/it_%i' % (it))
+def load_closed_loops(exp_dir, it):
+    # Closed loop trajectories of all iterations up to it, from the run store if the experiment has one
+    if Run_Store.exists(exp_dir):
+        run_store = Run_Store(exp_dir)
+        x_cls, u_cls = run_store.load_closed_loops()
+        return x_cls[:it+1], u_cls[:it+1]
 
+    it_dir = exp_dir + ('/it_%i' % (it))
     x_cls = pickle.load(open(it_dir + '/x_cls.pkl', 'rb'), encoding='latin1')
     u_cls = pickle.load(open(it_dir + '/u_cls.pkl', 'rb'), encoding='latin1')
-    x_ol = pickle.load(open(it_dir + '/x_ol.pkl', 'rb'), encoding='latin1')
-    u_ol = pickle.load(open(it_dir + '/u_ol.pkl', 'rb'), encoding='latin1')
-
-    n_cls = len(x_cls)
-
-    agent_colors = np.array([[0, 0.4470, 0.7410], [0.8500, 0.3250, 0.0980], [0.6350, 0.0780, 0.1840]])
-
-    x_lim = [-6, 6]
-    y_lim = [-6, 6]
-    pos_fig_w = 7
-    pos_fig_h = 7
-
-    dpi = 100
+    return x_cls, u_cls
+
+def get_agent_colors(n_a):
+    if n_a <= AGENT_COLORS.shape[0]:
+        return AGENT_COLORS[:n_a]
+    return np.array([plt.get_cmap('jet')(i*(1./(n_a-1)))[:3] for i in range(n_a)])
+
+def render_segment(job):
+    # Render the frames [t_start, t_end) of one iteration and pipe them to ffmpeg
+    opts = job['opts']
+    rc('text', usetex=opts['usetex'])
+
+    x_cls, u_cls = load_closed_loops(opts['exp_dir'], opts['data_it'])
+    # Vertices of all agents for all frames, agents that have arrived hold their last state
+    x, agent_lens = stack_trajs(x_cls[job['it']])
+    u, _ = stack_trajs(u_cls[job['it']])
+    n_a = x.shape[0]
+    agent_colors = get_agent_colors(n_a)
+    df = u[:,np.minimum(np.arange(x.shape[1]), u.shape[1]-1),0]
+    geometry = get_vehicle_geometry(x, df, opts['l_f'], opts['l_r'], opts['w'], r=opts['r'], n_pts=200)
+
+    pos_fig = plt.figure(figsize=(opts['fig_w'], opts['fig_h']), dpi=opts['dpi'])
+    pos_ax = pos_fig.gca()
+    pos_ax.set_xlabel('$x$ [m]', fontsize=15)
+    pos_ax.set_ylabel('$y$ [m]', fontsize=15)
+    pos_ax.set_xlim(opts['x_lim'])
+    pos_ax.set_ylim(opts['y_lim'])
+    pos_ax.set_xticks([-5, 0, 5])
+    pos_ax.set_yticks([-5, 0, 5])
+    plt.setp(pos_ax.get_xticklabels(), fontsize=15)
+    plt.setp(pos_ax.get_yticklabels(), fontsize=15)
+    pos_ax.set_aspect('equal')
+
+    # Artists are created once and updated for each frame
+    trails = []
+    cars = []
+    wheels = []
+    bounds = []
+    for j in range(n_a):
+        trails.append(pos_ax.scatter([], [], s=3, color=agent_colors[j].reshape((1,-1)), alpha=0.5, label=('Agent %i' % (j+1))))
+        cars.append(pos_ax.add_patch(matplotlib.patches.Polygon(np.zeros((4,2)), alpha=0.5, fc=agent_colors[j], ec=agent_colors[j], zorder=10)))
+        wheels.append(pos_ax.plot([], [], linewidth=2, color=agent_colors[j])[0])
+        bounds.append(pos_ax.plot([], [], color=agent_colors[j])[0])
+    title = pos_ax.set_title('', fontsize=20)
+
+    writer = Frame_Writer(mode='ffmpeg', max_queue=opts['frame_queue'], fps=opts['fps'])
+    writer.open_video(job['path'])
+    for t in range(job['t_start'], job['t_end']):
+        for j in range(n_a):
+            trails[j].set_offsets(x[j,:min(t, agent_lens[j]-1)+1,:2])
+            cars[j].set_xy(geometry['car'][j,t])
+            wheels[j].set_data(geometry['wheel'][j,t,:,0], geometry['wheel'][j,t,:,1])
+            bounds[j].set_data(geometry['circle'][j,t,:,0], geometry['circle'][j,t,:,1])
+        title.set_text('Time: %g s' % (t*opts['dt']))
 
-    plot_cls = range(n_cls)
-    # plot_cls = [0]
-
-    for i in plot_cls:
-        imgs = []
-        it_x_cl = x_cls[i]
-        it_u_cl = u_cls[i]
-
-        agent_lens = [cl.shape[1] for cl in it_x_cl]
-        max_len = np.amax(agent_lens)
-
-        pos_fig = plt.figure(figsize=(pos_fig_w, pos_fig_h), dpi=dpi)
-        pos_ax = pos_fig.gca()
-
-        pos_ax.plot([], [])
-        pos_ax.set_xlabel('$x$ [m]', fontsize=15)
-        pos_ax.set_xlabel('$y$ [m]', fontsize=15)
-        pos_ax.set_xlim(x_lim)
-        pos_ax.set_ylim(y_lim)
-        pos_ax.set_xticks([-5, 0, 5])
-        pos_ax.set_yticks([-5, 0, 5])
-        plt.setp(pos_ax.get_xticklabels(), fontsize=15)
-        plt.setp(pos_ax.get_yticklabels(), fontsize=15)
-        pos_ax.set_aspect('equal')
         pos_fig.canvas.draw()
+        writer.write(pos_fig)
+    writer.close()
+    plt.close(pos_fig)
+
+    return job['path']
+
+def get_segment_jobs(its, max_lens, n_workers, out_dir, opts):
+    # Split iterations into frame segments so that there is work for all workers even when rendering few iterations
+    n_segs = int(np.ceil(n_workers/len(its)))
+    jobs = []
+    segments = {}
+    for i in its:
+        bounds = np.unique(np.linspace(0, max_lens[i], n_segs+1).astype(int))
+        segments[i] = []
+        for (s, (t_start, t_end)) in enumerate(zip(bounds[:-1], bounds[1:])):
+            path = '/'.join((out_dir, 'it_%i_seg_%i.mp4' % (i, s)))
+            segments[i].append(path)
+            jobs.append({'it' : i, 't_start' : int(t_start), 't_end' : int(t_end), 'path' : path, 'opts' : opts})
+    return jobs, segments
+
+def join_segments(seg_paths, vid_name):
+    # Concatenate the segment videos of one iteration in order without re-encoding and remove them
+    if len(seg_paths) == 1:
+        os.rename(seg_paths[0], vid_name)
+        return
+    list_name = os.path.splitext(vid_name)[0] + '_segs.txt'
+    with open(list_name, 'w') as f:
+        for path in seg_paths:
+            f.write("file '%s'\n" % path)
+    subprocess.check_call(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_name, '-c', 'copy', vid_name])
+    for path in seg_paths + [list_name]:
+        os.remove(path)
 
-        vid_name = 'it_%i.mp4' % (i)
-
-        with writer.saving(pos_fig, vid_name, dpi):
-            for t in range(max_len):
-            # for t in range(50):
-                print('it %i, t %i' % (i,t))
-                pos_ax.clear()
-
-                for j in range(n_a):
-                    x = it_x_cl[j][0,:min(t+1,agent_lens[j])]
-                    y = it_x_cl[j][1,:min(t+1,agent_lens[j])]
-                    psi = it_x_cl[j][2,:min(t+1,agent_lens[j])]
-                    df = it_u_cl[j][0,:min(t+1,agent_lens[j])]
-
-                    # car_x = [x[-1] + l_f*np.cos(psi[-1]),
-                    #     x[-1] - l_r*np.cos(psi[-1])]
-                    # car_y = [y[-1] + l_f*np.sin(psi[-1]),
-                    #     y[-1] - l_r*np.sin(psi[-1])]
-
-                    # car_x = [x[-1] + l_f*np.cos(psi[-1]) + w*np.sin(psi[-1])/2,
-                    #     x[-1] + l_f*np.cos(psi[-1]) - w*np.sin(psi[-1])/2,
-                    #     x[-1] - l_r*np.cos(psi[-1]) - w*np.sin(psi[-1])/2,
-                    #     x[-1] - l_r*np.cos(psi[-1]) + w*np.sin(psi[-1])/2,
-                    #     x[-1] + l_f*np.cos(psi[-1]) + w*np.sin(psi[-1])/2]
-                    # car_y = [y[-1] + l_f*np.sin(psi[-1]) - w*np.cos(psi[-1])/2,
-                    #     y[-1] + l_f*np.sin(psi[-1]) + w*np.cos(psi[-1])/2,
-                    #     y[-1] - l_r*np.sin(psi[-1]) + w*np.cos(psi[-1])/2,
-                    #     y[-1] - l_r*np.sin(psi[-1]) - w*np.cos(psi[-1])/2,
-                    #     y[-1] + l_f*np.sin(psi[-1]) - w*np.cos(psi[-1])/2]
-
-                    car_x = np.array([x[-1] + l_f*np.cos(psi[-1]) + w*np.sin(psi[-1])/2,
-                        x[-1] + l_f*np.cos(psi[-1]) - w*np.sin(psi[-1])/2,
-                        x[-1] - l_r*np.cos(psi[-1]) - w*np.sin(psi[-1])/2,
-                        x[-1] - l_r*np.cos(psi[-1]) + w*np.sin(psi[-1])/2]).reshape((-1,1))
-                    car_y = np.array([y[-1] + l_f*np.sin(psi[-1]) - w*np.cos(psi[-1])/2,
-                        y[-1] + l_f*np.sin(psi[-1]) + w*np.cos(psi[-1])/2,
-                        y[-1] - l_r*np.sin(psi[-1]) + w*np.cos(psi[-1])/2,
-                        y[-1] - l_r*np.sin(psi[-1]) - w*np.cos(psi[-1])/2]).reshape((-1,1))
-                    car_xy = np.hstack((car_x, car_y))
-                    car_rec = matplotlib.patches.Polygon(car_xy, alpha=0.5, fc=agent_colors[j], ec=agent_colors[j], zorder=10)
-
-                    wheel_x = [x[-1] + l_f*np.cos(psi[-1]) + 0.15*np.cos(psi[-1]+df[-1]), x[-1] + l_f*np.cos(psi[-1]) - 0.15*np.cos(psi[-1]+df[-1])]
-                    wheel_y = [y[-1] + l_f*np.sin(psi[-1]) + 0.15*np.sin(psi[-1]+df[-1]), y[-1] + l_f*np.sin(psi[-1]) - 0.15*np.sin(psi[-1]+df[-1])]
-
-                    top_ang = np.linspace(0, np.pi, 100)
-                    bottom_ang = np.linspace(0, -np.pi, 100)
-                    bound_x = r*np.cos(top_ang) + x[-1]
-                    top_y = r*np.sin(top_ang) + y[-1]
-                    bottom_y = r*np.sin(bottom_ang) + y[-1]
-                    pos_ax.plot(bound_x, top_y, color=agent_colors[j])
-                    pos_ax.plot(bound_x, bottom_y, color=agent_colors[j])
-                    # pos_ax.fill_between(bound_x, top_y, bottom_y, color=agent_colors[j], alpha=0.5)
-
-                    pos_ax.scatter(x, y, s=3, color=agent_colors[j].reshape((1,-1)), alpha=0.5, label=('Agent %i' % (j+1)))
-
-                    # pos_ax.plot(car_x, car_y, color=agent_colors[j])
-                    pos_ax.add_patch(car_rec)
-                    pos_ax.plot(wheel_x, wheel_y, linewidth=2, color=agent_colors[j])
-
-                # pos_ax.set_title('Iteration: %i, Time: %g s' % (i, t*dt), fontsize=15)
-                pos_ax.set_title('Time: %g s' % (t*dt), fontsize=20)
-                pos_ax.set_xlabel('$x$ [m]', fontsize=15)
-                pos_ax.set_ylabel('$y$ [m]', fontsize=15)
-                pos_ax.set_xlim(x_lim)
-                pos_ax.set_ylim(y_lim)
-                pos_ax.set_aspect('equal')
-                pos_ax.set_xticks([-5, 0, 5])
-                pos_ax.set_yticks([-5, 0, 5])
-                plt.setp(pos_ax.get_xticklabels(), fontsize=15)
-                plt.setp(pos_ax.get_yticklabels(), fontsize=15)
-
-                pos_fig.canvas.draw()
-
-                writer.grab_frame()
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('exp_dir', type=str, help='Experiment directory, absolute or relative to the out directory')
+    parser.add_argument('--its', type=int, nargs='+', help='Iterations to render (default: all)', default=None)
+    parser.add_argument('--data_it', type=int, help='Checkpoint iteration to load pickled data from for runs without a run store (default: largest in --its)', default=None)
+    parser.add_argument('--out_dir', type=str, help='Output directory for the videos (default: <exp_dir>/videos)', default=None)
+    parser.add_argument('--l_f', type=float, help='Distance from center of mass to front axle', default=0.5)
+    parser.add_argument('--l_r', type=float, help='Distance from center of mass to rear axle', default=0.5)
+    parser.add_argument('--w', type=float, help='Car width', default=0.5)
+    parser.add_argument('--r', type=float, help='Radius of the collision buffer circles', default=0.759)
+    parser.add_argument('--dt', type=float, help='Time step of the closed loop trajectories', default=0.1)
+    parser.add_argument('--x_lim', type=float, nargs=2, default=[-6, 6])
+    parser.add_argument('--y_lim', type=float, nargs=2, default=[-6, 6])
+    parser.add_argument('--fig_size', type=float, nargs=2, help='Figure width and height in inches', default=[7, 7])
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--fps', type=int, default=10)
+    parser.add_argument('--frame_queue', type=int, help='Maximum number of frames queued for ffmpeg in each worker', default=16)
+    parser.add_argument('--workers', type=int, help='Number of rendering processes (default: number of cores)', default=None)
+    parser.add_argument('--no_usetex', action='store_true', help='Render text without LaTeX', default=False)
+    args = parser.parse_args()
+
+    exp_dir = args.exp_dir if os.path.isabs(args.exp_dir) else '/'.join((DATA_DIR, args.exp_dir))
+    out_dir = args.out_dir if args.out_dir is not None else '/'.join((exp_dir, 'videos'))
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    n_workers = args.workers if args.workers is not None else mp.cpu_count()
+
+    # Determine the iterations and their lengths
+    if Run_Store.exists(exp_dir):
+        n_its = Run_Store(exp_dir).get_num_iterations()
+        its = args.its if args.its is not None else list(range(n_its))
+        data_it = max(its)
+    else:
+        if args.its is None and args.data_it is None:
+            parser.error('--its or --data_it is required for runs without a run store')
+        data_it = args.data_it if args.data_it is not None else max(args.its)
+        its = args.its if args.its is not None else list(range(data_it+1))
+    x_cls, _ = load_closed_loops(exp_dir, data_it)
+    max_lens = {i : np.amax([cl.shape[1] for cl in x_cls[i]]) for i in its}
+
+    opts = {'exp_dir' : exp_dir, 'data_it' : data_it, 'l_f' : args.l_f, 'l_r' : args.l_r, 'w' : args.w, 'r' : args.r,
+        'dt' : args.dt, 'x_lim' : args.x_lim, 'y_lim' : args.y_lim, 'fig_w' : args.fig_size[0], 'fig_h' : args.fig_size[1],
+        'dpi' : args.dpi, 'fps' : args.fps, 'frame_queue' : args.frame_queue, 'usetex' : not args.no_usetex}
+
+    jobs, segments = get_segment_jobs(its, max_lens, n_workers, out_dir, opts)
+
+    print('Rendering %i iterations in %i segments with %i workers' % (len(its), len(jobs), n_workers))
+    start = time.time()
+    pool = mp.Pool(n_workers)
+    for path in pool.imap_unordered(render_segment, jobs):
+        print('Rendered %s' % path)
+    pool.close()
+    pool.join()
+
+    # Join the segments of each iteration
+    for i in its:
+        join_segments(segments[i], '/'.join((out_dir, 'it_%i.mp4' % (i))))
+
+    print('Time elapsed: %g s' % (time.time() - start))
 
 if __name__== "__main__":
     main()
@@ -0,0 +1,51 @@
+"""
+Discretizations of the kinematic bicycle model shared by the dynamics models of the demos
+"""
+
+import casadi as ca
+
+INTEGRATORS = ['euler', 'rk4', 'cvodes']
+
+# Step functions are built once for each set of parameters and shared by all models, simulators and FTOCPs which use them
+_step_functions = {}
+
+def get_kin_bike_step_function(l_r, l_f, dt, integrator='euler', n_steps=1):
+	"""
+	CasADi Function (x_k, u_k) -> x_kp1 of a single kinematic bicycle discretized with
+		- euler: a single forward Euler step
+		- rk4: n_steps classical Runge-Kutta steps of length dt/n_steps
+		- cvodes: the variable step CVODES integrator over dt, n_steps is ignored
+	The input is held constant over dt. The function can be called numerically or on Opti variables
+	"""
+	if integrator not in INTEGRATORS:
+		raise(ValueError('Integrator %s not recognized' % integrator))
+
+	key = (l_r, l_f, dt, integrator, n_steps)
+	if key not in _step_functions:
+		x = ca.SX.sym('x', 4)
+		u = ca.SX.sym('u', 2)
+		beta = ca.atan2(l_r*ca.tan(u[0]), l_f + l_r)
+		x_dot = ca.vertcat(x[3]*ca.cos(x[2] + beta), x[3]*ca.sin(x[2] + beta), x[3]*ca.sin(beta), u[1])
+
+		if integrator == 'euler':
+			f = ca.Function('kin_bike_step', [x, u], [x + dt*x_dot], ['x', 'u'], ['x_kp1'])
+		elif integrator == 'rk4':
+			f_ct = ca.Function('kin_bike_f_ct', [x, u], [x_dot])
+			h = dt/n_steps
+			x_kp1 = x
+			for _ in range(n_steps):
+				k_1 = f_ct(x_kp1, u)
+				k_2 = f_ct(x_kp1 + h/2*k_1, u)
+				k_3 = f_ct(x_kp1 + h/2*k_2, u)
+				k_4 = f_ct(x_kp1 + h*k_3, u)
+				x_kp1 = x_kp1 + h/6*(k_1 + 2*k_2 + 2*k_3 + k_4)
+			f = ca.Function('kin_bike_step', [x, u], [x_kp1], ['x', 'u'], ['x_kp1'])
+		else:
+			ode = ca.integrator('kin_bike_ode', 'cvodes', {'x' : x, 'p' : u, 'ode' : x_dot}, {'tf' : dt})
+			x_mx = ca.MX.sym('x', 4)
+			u_mx = ca.MX.sym('u', 2)
+			f = ca.Function('kin_bike_step', [x_mx, u_mx], [ode(x0=x_mx, p=u_mx)['xf']], ['x', 'u'], ['x_kp1'])
+
+		_step_functions[key] = f
+
+	return _step_functions[key]
@@ -2,15 +2,22 @@ import numpy as np
 import copy, pickle, pdb, time, sys, os
 
 import matplotlib
-matplotlib.use('TkAgg')
+# Headless runs select their backend with MPLBACKEND
+if os.environ.get('MPLBACKEND') is None:
+	matplotlib.use('TkAgg')
 from matplotlib import rc
 rc('text', usetex=False)
 
 import matplotlib.animation as animation
 import matplotlib.pyplot as plt
 
+import matplotlib.image
+from matplotlib.collections import LineCollection
+
+from utils.frame_writer import Frame_Writer
+
 class lmpc_visualizer(object):
-	def __init__(self, pos_dims, n_state_dims, n_act_dims, agent_id, n_agents, plot_lims=None, save_dir=None):
+	def __init__(self, pos_dims, n_state_dims, n_act_dims, agent_id, n_agents, plot_lims=None, save_dir=None, frame_writer=None, blit=False, shade_res=200):
 		if len(pos_dims) > 2:
 			raise(ValueError('Can only plot 2 position dimensions'))
 		self.agent_id = agent_id
@@ -20,8 +27,19 @@ class lmpc_visualizer(object):
 		self.save_dir = save_dir
 		self.plot_lims = plot_lims
 
+		# Options of a Frame_Writer which saves frames in the background, frames are saved with savefig if not given
+		self.frame_writer = Frame_Writer(**frame_writer) if frame_writer is not None else None
+
+		# With blitting, the artists which change at every time step are animated and drawn over a cached background of
+		# everything else (axes and previous trajectories), the background is only redrawn when it changes
+		self.blit = blit
+		self.background = None
+
+		# Exploration spaces are shaded on a grid of shade_res x shade_res points over the plot limits
+		self.shade_res = shade_res
+
 		self.n_a = n_agents
-		self.c = [matplotlib.cm.get_cmap('jet')(i*(1./(self.n_a-1))) for i in range(self.n_a)]
+		self.c = [plt.get_cmap('jet')(i*(1./(self.n_a-1))) for i in range(self.n_a)]
 
 		self.ax_labels = ['$a$', '$df$', '$v$', '$\phi$']
 
@@ -41,22 +59,29 @@ class lmpc_visualizer(object):
 		self.prev_pos = []
 		for i in range(self.n_a):
 			t, = self.pos_ax.plot(x_data, y_data, '.', markersize=2, c=self.c[i])
-			p, = self.pos_ax.plot(x_data, y_data, 'o', c=self.c[i])
+			p, = self.pos_ax.plot(x_data, y_data, 'o', c=self.c[i], animated=blit)
 			self.prev_trajs_xy.append(t)
 			self.prev_pos.append(p)
 
-		self.pred_xy = []
-		for i in range(70):
-			pr, = self.pos_ax.plot(x_data, y_data, 'o', markersize=2)
-			self.pred_xy.append(pr)
+		# Predicted positions, colored by prediction step
+		self.pred_xy = self.pos_ax.scatter(x_data, y_data, s=4, animated=blit)
 
-		self.expl_bound_xy = []
-		for i in range(self.n_a*30):
-			ex, = self.pos_ax.plot(x_data, y_data, linewidth=0.7)
-			self.expl_bound_xy.append(ex)
+		# Exploration space boundaries, one line segment across the plot for each halfspace
+		self.expl_bound_xy = LineCollection([], linewidths=0.7, animated=blit)
+		self.pos_ax.add_collection(self.expl_bound_xy)
 
-		self.traj_line, = self.pos_ax.plot(x_data, y_data, 'k.')
-		self.ss_line, = self.pos_ax.plot(x_data, y_data, 'ko', fillstyle='none', markersize=5)
+		# Shaded exploration spaces of the prediction steps, composited into a single image
+		self.shade_img = None
+		if self.plot_lims is not None:
+			p1 = np.linspace(self.plot_lims[0][0], self.plot_lims[0][1], self.shade_res)
+			p2 = np.linspace(self.plot_lims[1][0], self.plot_lims[1][1], self.shade_res)
+			P1, P2 = np.meshgrid(p1, p2)
+			self.shade_pts = np.vstack((P1.ravel(), P2.ravel()))
+			self.shade_img = self.pos_ax.imshow(np.zeros((self.shade_res, self.shade_res, 4)), origin='lower', interpolation='nearest',
+				extent=[self.plot_lims[0][0], self.plot_lims[0][1], self.plot_lims[1][0], self.plot_lims[1][1]], zorder=0, animated=blit)
+
+		self.traj_line, = self.pos_ax.plot(x_data, y_data, 'k.', animated=blit)
+		self.ss_line, = self.pos_ax.plot(x_data, y_data, 'ko', fillstyle='none', markersize=5, animated=blit)
 
 		if self.plot_lims is not None:
 			self.pos_ax.set_xlim(self.plot_lims[0])
@@ -74,9 +99,9 @@ class lmpc_visualizer(object):
 		for (i, a) in enumerate(self.ts_axs):
 			a.set_ylabel(self.ax_labels[i])
 			pt, = a.plot(x_data, y_data, 'b.-', markersize=2)
-			ct, = a.plot(x_data, y_data, 'k.-', markersize=2)
-			pr, = a.plot(x_data, y_data, 'g.-', markersize=2)
-			ss, = a.plot(x_data, y_data, 'ko', fillstyle='none', markersize=5)
+			ct, = a.plot(x_data, y_data, 'k.-', markersize=2, animated=blit)
+			pr, = a.plot(x_data, y_data, 'g.-', markersize=2, animated=blit)
+			ss, = a.plot(x_data, y_data, 'ko', fillstyle='none', markersize=5, animated=blit)
 			self.prev_traj_ts.append(pt)
 			self.curr_traj_ts.append(ct)
 			self.ss_ts.append(ss)
@@ -86,7 +111,12 @@ class lmpc_visualizer(object):
 			if i == 0:
 				a.set_xlabel('$t$')
 
-		self.fig.canvas.set_window_title('Agent %i' % (agent_id+1))
+		self.animated_artists = self.prev_pos + ([self.shade_img] if self.shade_img is not None else []) + [self.expl_bound_xy, self.ss_line, self.pred_xy, self.traj_line] + self.curr_traj_ts + self.pred_ts + self.ss_ts
+		if self.blit:
+			# Any full redraw (including ones caused by resizing the window) refreshes the cached background
+			self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+
+		self.fig.canvas.manager.set_window_title('Agent %i' % (agent_id+1))
 		self.fig.canvas.draw()
 
 		self.prev_pos_cls = None
@@ -97,6 +127,12 @@ class lmpc_visualizer(object):
 
 	def set_save_dir(self, save_dir):
 		self.save_dir = save_dir
+		# In ffmpeg mode, the frames of each save directory are encoded into a single video
+		if self.frame_writer is not None and self.frame_writer.mode == 'ffmpeg' and save_dir is not None:
+			v_name = 'it_%i.mp4' % self.it
+			if self.agent_id is not None:
+				v_name = '_'.join((('agent_%i' % (self.agent_id+1)), v_name))
+			self.frame_writer.open_video('/'.join((save_dir, v_name)))
 
 	def clear_plots(self):
 		self.pos_ax.clear()
@@ -116,8 +152,15 @@ class lmpc_visualizer(object):
 				a.set_xlabel('$t$')
 
 	def close_figure(self):
+		self.close_frame_writer()
 		plt.close(self.fig)
 
+	def close_frame_writer(self):
+		if self.frame_writer is not None:
+			self.frame_writer.close()
+			if self.frame_writer.n_dropped > 0:
+				print('Frame writer dropped %i of %i frames' % (self.frame_writer.n_dropped, self.frame_writer.n_dropped+self.frame_writer.n_written))
+
 	def update_prev_trajs(self, state_traj, act_traj=None):
 		# state_traj is a list of numpy arrays. Each numpy array is the closed-loop trajectory of an agent.
 		if state_traj is not None:
@@ -130,11 +173,47 @@ class lmpc_visualizer(object):
 
 		self.it += 1
 
+	def append_prev_trajs(self, state_trajs, act_trajs=None):
+		# Incremental version of update_prev_trajs, state_trajs and act_trajs only hold the iterations which were not passed in before
+		if self.prev_pos_cls is None:
+			self.prev_pos_cls = []
+		for s in state_trajs:
+			self.prev_pos_cls.append([s_a[self.pos_dims,:] for s_a in s])
+		if len(state_trajs) > 0:
+			self.prev_state_cl = state_trajs[-1]
+		if act_trajs is not None and len(act_trajs) > 0:
+			self.prev_act_cl = act_trajs[-1]
+
+		self.it += 1
+
+	def on_draw(self, event):
+		self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+	def update_ts_lims(self, a, x, y):
+		# Autoscaling the time series axes at every time step would invalidate the background, with blitting the limits
+		# are only expanded when the data leaves them. Limits of axes which are not autoscaled (x=None) are not changed
+		if not self.blit:
+			a.relim()
+			a.autoscale_view()
+			return False
+		lims = [(y, a.get_ylim, a.set_ylim)]
+		if x is not None:
+			lims.append((x, a.get_xlim, a.set_xlim))
+		changed = False
+		for (d, get_lim, set_lim) in lims:
+			if len(d) == 0:
+				continue
+			d_min = np.amin(d)
+			d_max = np.amax(d)
+			lim = get_lim()
+			if d_min < lim[0] or d_max > lim[1]:
+				margin = 0.1*max(d_max - d_min, 1e-3)
+				set_lim([min(lim[0], d_min - margin), max(lim[1], d_max + margin)])
+				changed = True
+		return changed
+
 	def plot_traj(self, state_cl, act_cl, state_preds, act_preds, t, SS=None, expl_con=None, shade=False):
-		if shade:
-			p1 = np.linspace(self.plot_lims[0][0], self.plot_lims[0][1], 15)
-			p2 = np.linspace(self.plot_lims[1][0], self.plot_lims[1][1], 15)
-			P1, P2 = np.meshgrid(p1, p2)
+		shade_rgba = np.zeros((self.shade_res, self.shade_res, 4)) if shade and self.shade_img is not None else None
 
 		pos_preds = state_preds[self.pos_dims, :]
 		pred_len = state_preds.shape[1]
@@ -143,47 +222,51 @@ class lmpc_visualizer(object):
 		pos_cl = state_cl[self.pos_dims, :]
 		cl_len = state_cl.shape[1]
 
-		c_pred = [matplotlib.cm.get_cmap('jet')(i*(1./(pred_len-1))) for i in range(pred_len)]
+		c_pred = [plt.get_cmap('jet')(i*(1./(pred_len-1))) for i in range(pred_len)]
+
+		# Set when artists which are part of the background change
+		redraw = False
 
 		# Plot all previous closed loop trajectory for comparison
 		if self.prev_pos_cls is not None:
 			for i in range(self.n_a):
 				if t == 0:
-					for s_it in self.prev_pos_cls:
-						self.prev_trajs_xy[i].set_data(s_it[i][0,:], s_it[i][1,:])
+					self.prev_trajs_xy[i].set_data(self.prev_pos_cls[-1][i][0,:], self.prev_pos_cls[-1][i][1,:])
+					redraw = True
 				plot_t = min(t, self.prev_pos_cls[-1][i].shape[1]-1)
-				self.prev_pos[i].set_data(self.prev_pos_cls[-1][i][0,plot_t], self.prev_pos_cls[-1][i][1,plot_t])
+				self.prev_pos[i].set_data(self.prev_pos_cls[-1][i][0,plot_t:plot_t+1], self.prev_pos_cls[-1][i][1,plot_t:plot_t+1])
 
 			agent_prev_cl = self.prev_pos_cls[-1][self.agent_id]
 
 			if expl_con is not None:
-				boundary_x = np.linspace(self.plot_lims[0][0], self.plot_lims[0][1], 50)
-				# for i in range(t, t+pred_len):
-				counter = 0
+				boundary_x = np.array(self.plot_lims[0])
+				segments = []
+				colors = []
 				for i in range(t+pred_len-1, t-1, -1): # Go backwards so that earlier stuff is plotted on top
 					plot_t = min(i, agent_prev_cl.shape[1]-1)
 					H = expl_con[plot_t][0]
 					g = expl_con[plot_t][1]
 					for j in range(H.shape[0]):
 						boundary_y = (-H[j,0]*boundary_x - g[j])/(H[j,1]+1e-10)
-						self.expl_bound_xy[counter].set_data(boundary_x, boundary_y)
-						self.expl_bound_xy[counter].set_color(c_pred[i-t])
-						counter += 1
-						# self.pos_ax.plot(boundary_x, boundary_y, '--', linewidth=0.7, c=c_pred[i-t])
-
-					if shade:
-						for j in range(P1.shape[0]):
-							for k in range(P2.shape[1]):
-								test_pt = np.array([P1[j,k], P2[j,k]])
-								if np.all(H.dot(test_pt) + g <= 0):
-									self.pos_ax.plot(test_pt[0], test_pt[1], '.', c=c_pred[i-t], markersize=1)
+						segments.append(np.vstack((boundary_x, boundary_y)).T)
+						colors.append(c_pred[i-t])
+
+					if shade_rgba is not None:
+						# Grid points which satisfy all halfspace constraints of this step, later steps are overwritten by earlier ones
+						in_expl = np.all(H.dot(self.shade_pts) + g.reshape((-1,1)) <= 0, axis=0).reshape((self.shade_res, self.shade_res))
+						shade_rgba[in_expl] = c_pred[i-t][:3] + (0.3,)
+				self.expl_bound_xy.set_segments(segments)
+				self.expl_bound_xy.set_color(colors)
+		if self.shade_img is not None:
+			self.shade_img.set_visible(shade_rgba is not None)
+			if shade_rgba is not None:
+				self.shade_img.set_data(shade_rgba)
 
 		# Plot the closed loop position trajectory up to this iteration and the optimal solution at this iteration
 		if SS is not None:
 			self.ss_line.set_data(SS[0,:], SS[1,:])
-		for i in range(pred_len):
-			self.pred_xy[i].set_data(pos_preds[0,i], pos_preds[1,i])
-			self.pred_xy[i].set_color(c_pred[i])
+		self.pred_xy.set_offsets(pos_preds.T)
+		self.pred_xy.set_color(c_pred)
 		self.traj_line.set_data(pos_cl[0,:], pos_cl[1,:])
 
 		# Plot the closed loop state trajectory up to this iteration and the optimal solution at this iteration
@@ -193,24 +276,42 @@ class lmpc_visualizer(object):
 				if self.prev_act_cl is not None:
 					l = self.prev_act_cl[self.agent_id].shape[1]
 					self.prev_traj_ts[i].set_data(range(l), self.prev_act_cl[self.agent_id][plot_idx,:])
+					if tuple(a.get_xlim()) != (0, l+1):
+						a.set_xlim([0, l+1])
+						redraw = True
 				self.pred_ts[i].set_data(range(t, t+pred_len-1), act_preds[plot_idx,:])
 				self.curr_traj_ts[i].set_data(range(cl_len-1), act_cl[plot_idx,:])
-				a.relim()
-				a.autoscale_view()
+				x = np.arange(0, max(t+pred_len-1, cl_len-1)) if self.prev_act_cl is None else None
+				redraw = self.update_ts_lims(a, x, np.append(act_preds[plot_idx,:], act_cl[plot_idx,:])) or redraw
 			else:
 				plot_idx = (self.n_state_dims-1)-(i-self.n_act_dims)
 				if self.prev_state_cl is not None:
 					l = self.prev_state_cl[self.agent_id].shape[1]
 					self.prev_traj_ts[i].set_data(range(l), self.prev_state_cl[self.agent_id][plot_idx,:])
-					a.set_xlim([0, l+1])
+					if tuple(a.get_xlim()) != (0, l+1):
+						a.set_xlim([0, l+1])
+						redraw = True
 				if SS is not None:
 					self.ss_ts[i].set_data(range(t, t+SS.shape[1]), SS[plot_idx,:])
 				self.pred_ts[i].set_data(range(t, t+pred_len), state_preds[plot_idx,:])
 				self.curr_traj_ts[i].set_data(range(cl_len-1), state_cl[plot_idx,:-1])
-				a.relim()
-				a.autoscale_view()
+				y = np.append(state_preds[plot_idx,:], state_cl[plot_idx,:-1])
+				if SS is not None:
+					y = np.append(y, SS[plot_idx,:])
+				x = np.arange(0, max(t+pred_len, cl_len-1)) if self.prev_state_cl is None else None
+				redraw = self.update_ts_lims(a, x, y) or redraw
 		try:
-			self.fig.canvas.draw()
+			if not self.blit:
+				self.fig.canvas.draw()
+			else:
+				if redraw or self.background is None:
+					self.fig.canvas.draw()
+				else:
+					self.fig.canvas.restore_region(self.background)
+				for artist in self.animated_artists:
+					self.fig.draw_artist(artist)
+				self.fig.canvas.blit(self.fig.bbox)
+				self.fig.canvas.flush_events()
 		except KeyboardInterrupt:
 			sys.exit()
 
@@ -219,14 +320,21 @@ class lmpc_visualizer(object):
 			f_name = 'it_%i_time_%i.png' % (self.it, t)
 			if self.agent_id is not None:
 				f_name = '_'.join((('agent_%i' % (self.agent_id+1)), f_name))
-			self.fig.savefig('/'.join((self.save_dir, f_name)))
+			if self.frame_writer is not None:
+				self.frame_writer.write(self.fig, '/'.join((self.save_dir, f_name)))
+			elif self.blit:
+				# savefig redraws the figure without the animated artists, save the blitted canvas instead
+				matplotlib.image.imsave('/'.join((self.save_dir, f_name)), np.asarray(self.fig.canvas.buffer_rgba()))
+			else:
+				self.fig.savefig('/'.join((self.save_dir, f_name)))
 
 	# A tool for inspecting the trajectory at an iteration, when this function is called, the program will enter into a while loop which waits for user input to inspect the trajectory
+	# x_preds and u_preds can be lists of predictions or the agent predictions of a run_store.Prediction_Archive, in which case only the predictions which are viewed are read from disk
 	def traj_inspector(self, xcl, ucl, x_preds, u_preds, start_t, expl_con=None):
 		t = start_t
 
 		# Get the max time of the trajectory
-		end_times = [xcl_shape[1]-1]
+		end_times = [xcl.shape[1]-1]
 		# if expl_con is not None and 'lin' in expl_con:
 		# 	end_times.append(len(lin_con[0])-1)
 		# if expl_con is not None and 'ell' in expl_con:
@@ -2,13 +2,17 @@ import numpy as np
 import copy, pickle, pdb, time, sys, os
 
 import matplotlib
-matplotlib.use('TkAgg')
+# Headless runs select their backend with MPLBACKEND
+if os.environ.get('MPLBACKEND') is None:
+	matplotlib.use('TkAgg')
 from matplotlib import rc
 rc('text', usetex=False)
 
 import matplotlib.animation as animation
 import matplotlib.pyplot as plt
 
+from utils.vehicle_geometry import stack_trajs, get_vehicle_geometry
+
 # Trajectory animation for kinematic bicycle agents
 def plot_bike_agent_trajs(x, u, agents, dt, trail=False, shade=False, plot_lims=None, save_dir=None, save_video=False, it=None):
 	dpi = 500
@@ -18,7 +22,18 @@ def plot_bike_agent_trajs(x, u, agents, dt, trail=False, shade=False, plot_lims=
 	traj_lens = [x[i].shape[1] for i in range(n_a)]
 	end_flags = [False for i in range(n_a)]
 
-	c = [matplotlib.cm.get_cmap('jet')(i*(1./(n_a-1))) for i in range(n_a)]
+	c = [plt.get_cmap('jet')(i*(1./(n_a-1))) for i in range(n_a)]
+
+	# Vertices of all agents for all frames, inputs are one step shorter than the states
+	x_s, _ = stack_trajs(x)
+	u_s, _ = stack_trajs([u[i][:,:traj_lens[i]-1] for i in range(n_a)])
+	df = u_s[:,np.minimum(np.arange(x_s.shape[1]), u_s.shape[1]-1),0]
+	geometry = get_vehicle_geometry(x_s, df,
+		[agents[i].l_f for i in range(n_a)],
+		[agents[i].l_r for i in range(n_a)],
+		[agents[i].w for i in range(n_a)],
+		r=r_a, wheel_l=0.2)
+	car_idxs = [0, 1, 2, 3, 0]
 
 	if save_video:
 		imgs = []
@@ -93,37 +108,17 @@ def plot_bike_agent_trajs(x, u, agents, dt, trail=False, shade=False, plot_lims=
 				df_lines[i].set_data(dt*np.arange(min(t+1, traj_lens[i]-2)), u[i][0,:min(t+1, traj_lens[i]-2)])
 				a_lines[i].set_data(dt*np.arange(min(t+1, traj_lens[i]-2)), u[i][1,:min(t+1, traj_lens[i]-2)])
 
-				x_t = x[i][:,min(t, traj_lens[i]-1)]
-				u_t = u[i][:,min(t, traj_lens[i]-2)]
-				l_f = agents[i].l_f
-				l_r = agents[i].l_r
-				w = agents[i].w
-
-				car_x = [x_t[0] + l_f*np.cos(x_t[2]) + w*np.sin(x_t[2])/2,
-					x_t[0] + l_f*np.cos(x_t[2]) - w*np.sin(x_t[2])/2,
-					x_t[0] - l_r*np.cos(x_t[2]) - w*np.sin(x_t[2])/2,
-					x_t[0] - l_r*np.cos(x_t[2]) + w*np.sin(x_t[2])/2,
-					x_t[0] + l_f*np.cos(x_t[2]) + w*np.sin(x_t[2])/2]
-				car_y = [x_t[1] + l_f*np.sin(x_t[2]) - w*np.cos(x_t[2])/2,
-					x_t[1] + l_f*np.sin(x_t[2]) + w*np.cos(x_t[2])/2,
-					x_t[1] - l_r*np.sin(x_t[2]) + w*np.cos(x_t[2])/2,
-					x_t[1] - l_r*np.sin(x_t[2]) - w*np.cos(x_t[2])/2,
-					x_t[1] + l_f*np.sin(x_t[2]) - w*np.cos(x_t[2])/2]
-
-				wheel_x = [x_t[0] + l_f*np.cos(x_t[2]) + 0.2*np.cos(x_t[2]+u_t[0]), x_t[0] + l_f*np.cos(x_t[2]) - 0.2*np.cos(x_t[2]+u_t[0])]
-				wheel_y = [x_t[1] + l_f*np.sin(x_t[2]) + 0.2*np.sin(x_t[2]+u_t[0]), x_t[1] + l_f*np.sin(x_t[2]) - 0.2*np.sin(x_t[2]+u_t[0])]
-
-				bound_x = x_t[0]+r_a[i]*np.cos(np.linspace(0,2*np.pi,100))
-				bound_y = x_t[1]+r_a[i]*np.sin(np.linspace(0,2*np.pi,100))
+				k = min(t, traj_lens[i]-1)
+				x_t = x[i][:,k]
 
 				if not trail:
-					xy_lines[i].set_data(x_t[0], x_t[1])
+					xy_lines[i].set_data([x_t[0]], [x_t[1]])
 				else:
 					xy_lines[i].set_data(x[i][0,:min(t+1, traj_lens[i]-1)], x[i][1,:min(t+1, traj_lens[i]-1)])
 
-				car_lines[i].set_data(car_x, car_y)
-				wheel_lines[i].set_data(wheel_x, wheel_y)
-				bound_lines[i].set_data(bound_x, bound_y)
+				car_lines[i].set_data(geometry['car'][i,k,car_idxs,0], geometry['car'][i,k,car_idxs,1])
+				wheel_lines[i].set_data(geometry['wheel'][i,k,:,0], geometry['wheel'][i,k,:,1])
+				bound_lines[i].set_data(geometry['circle'][i,k,:,0], geometry['circle'][i,k,:,1])
 
 				if t >= traj_lens[i]-1:
 					end_flags[i] = True
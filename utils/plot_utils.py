@@ -32,7 +32,7 @@ def plot_agent_trajs(x, expl_con=None, r_a=None, trail=False, shade=False, plot_
 	traj_lens = [x[i].shape[1] for i in range(n_a)]
 	end_flags = [False for i in range(n_a)]
 
-	c = [matplotlib.cm.get_cmap('jet')(i*(1./(n_a-1))) for i in range(n_a)]
+	c = [plt.get_cmap('jet')(i*(1./(n_a-1))) for i in range(n_a)]
 
 	if save_video:
 		imgs = []
@@ -155,7 +155,7 @@ class updateable_plot(object):
 		self.y_label = y_label
 
 		self.data = [np.empty((2,1)) for _ in range(n_seq)]
-		self.c = [matplotlib.cm.get_cmap('jet')(i*(1./(n_seq-1))) for i in range(n_seq)]
+		self.c = [plt.get_cmap('jet')(i*(1./(n_seq-1))) for i in range(n_seq)]
 
 	def clear(self):
 		self.ax.clear()
@@ -195,7 +195,7 @@ class updateable_ts(object):
 		self.y_label = y_label
 
 		# self.data = [np.empty((2,1)) for _ in range(n_seq)]
-		# self.c = [matplotlib.cm.get_cmap('jet')(i*(1./(n_seq-1))) for i in range(n_seq)]
+		# self.c = [plt.get_cmap('jet')(i*(1./(n_seq-1))) for i in range(n_seq)]
 
 	def clear(self):
 		for a in self.axs:
@@ -0,0 +1,57 @@
+from __future__ import division
+
+import numpy as np
+import os
+
+class Prediction_Buffer(object):
+	"""
+	Ring buffer of the last capacity predictions of a fixed shape, so that storing a prediction takes constant time and
+	memory however many are stored. buffer[-1] is the latest prediction, buffer[-k] the k-th latest one which is still
+	retained. If spill_path is given, predictions which are pushed out of the buffer are appended to that raw float64 file
+	and can be read back with load_spilled
+	"""
+	def __init__(self, shape, capacity=1, spill_path=None, init=None):
+		if capacity < 1:
+			raise(ValueError('Prediction buffer capacity must be at least 1'))
+		self.shape = tuple(shape)
+		self.capacity = capacity
+		self.spill_path = spill_path
+		self.buf = np.zeros((capacity,) + self.shape)
+		self.n_pushed = 0
+		self.n_spilled = 0
+
+		if self.spill_path is not None and os.path.exists(self.spill_path):
+			os.remove(self.spill_path)
+		if init is not None:
+			self.append(init)
+
+	def __len__(self):
+		return min(self.n_pushed, self.capacity)
+
+	def append(self, pred):
+		idx = self.n_pushed % self.capacity
+		if self.n_pushed >= self.capacity and self.spill_path is not None:
+			with open(self.spill_path, 'ab') as f:
+				self.buf[idx].astype(np.float64).tofile(f)
+			self.n_spilled += 1
+		self.buf[idx] = pred
+		self.n_pushed += 1
+
+	def __getitem__(self, k):
+		# Only negative indices are supported, counting back from the latest prediction
+		if k >= 0 or -k > len(self):
+			raise(IndexError('Prediction %i is not retained in the buffer' % k))
+		return self.buf[(self.n_pushed + k) % self.capacity]
+
+	def last(self):
+		return self[-1]
+
+	def get_retained(self):
+		# Retained predictions from oldest to latest
+		return np.stack([self[k] for k in range(-len(self), 0)])
+
+	def load_spilled(self, mmap_mode='r'):
+		# Predictions pushed out of the buffer from oldest to latest
+		if self.spill_path is None or self.n_spilled == 0:
+			return np.empty((0,) + self.shape)
+		return np.memmap(self.spill_path, dtype=np.float64, mode=mmap_mode, shape=(self.n_spilled,) + self.shape)
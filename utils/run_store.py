@@ -0,0 +1,209 @@
+from __future__ import division
+
+import numpy as np
+import os, json
+
+class Prediction_Archive(object):
+	"""
+	Open loop predictions of all agents over one iteration packed into a single flat float64 buffer (prefix.npy) with an
+	index (prefix_index.npz) whose rows are (agent, time step, offset, rows, columns) and the number of agents, which may
+	also have agents without predictions. Predictions have different sizes
+	since the horizon shrinks towards the end of an iteration. The buffer is memory mapped, archive[a][t] returns a view of
+	the prediction of agent a at time step t, so only the slices which are accessed are read from disk
+	"""
+	def __init__(self, prefix, mmap_mode='r'):
+		self.buffer = np.load(prefix + '.npy', mmap_mode=mmap_mode)
+		with np.load(prefix + '_index.npz') as data:
+			index = data['index']
+			n_a = int(data['n_a'])
+
+		self.agent_index = []
+		for a in range(n_a):
+			agent_index = index[index[:,0] == a]
+			self.agent_index.append(agent_index[np.argsort(agent_index[:,1], kind='mergesort')])
+
+	@staticmethod
+	def write(prefix, preds):
+		# preds is a list with one list of prediction arrays per agent
+		flat_preds = []
+		index = []
+		offset = 0
+		for (a, agent_preds) in enumerate(preds):
+			for (t, p) in enumerate(agent_preds):
+				p = np.asarray(p, dtype=np.float64)
+				p = p.reshape((p.shape[0],-1))
+				flat_preds.append(p.ravel())
+				index.append([a, t, offset, p.shape[0], p.shape[1]])
+				offset += p.size
+		index = np.array(index, dtype=np.int64).reshape((-1,5))
+
+		buf = np.lib.format.open_memmap(prefix + '.npy', mode='w+', dtype=np.float64, shape=(offset,))
+		for (p, i) in zip(flat_preds, index):
+			buf[i[2]:i[2]+p.size] = p
+		buf.flush()
+		del buf
+		np.savez(prefix + '_index.npz', index=index, n_a=len(preds))
+
+	def __len__(self):
+		return len(self.agent_index)
+
+	def __getitem__(self, a):
+		return _Agent_Predictions(self, a)
+
+	def get(self, a, t):
+		_, _, o, n_r, n_c = self.agent_index[a][t]
+		return self.buffer[o:o+n_r*n_c].reshape((n_r, n_c))
+
+class _Agent_Predictions(object):
+	# Sequence view of the predictions of one agent in a Prediction_Archive
+	def __init__(self, archive, a):
+		self.archive = archive
+		self.a = a
+
+	def __len__(self):
+		return self.archive.agent_index[self.a].shape[0]
+
+	def __getitem__(self, t):
+		if isinstance(t, slice):
+			return [self.archive.get(self.a, i) for i in range(*t.indices(len(self)))]
+		if t < 0:
+			t += len(self)
+		return self.archive.get(self.a, t)
+
+class Run_Store(object):
+	"""
+	Append-only storage of the data of a multi-agent LMPC run. Each stored iteration only writes its own closed loop, open
+	loop and timing arrays to a directory it_k and is then recorded in manifest.json. Arrays are loaded lazily (closed loop
+	trajectories and open loop prediction archives are memory mapped), so resuming a run or loading a single iteration does
+	not read the whole history.
+
+	Iteration k of the store corresponds to the k-th entry of the closed loop lists in main, i.e. iteration 0 holds the
+	initial feasible trajectories, which do not have open loop predictions or timing data
+	"""
+	MANIFEST = 'manifest.json'
+	VERSION = 2
+
+	def __init__(self, run_dir):
+		self.run_dir = run_dir
+		if not os.path.exists(self.run_dir):
+			os.makedirs(self.run_dir)
+
+		manifest_path = '/'.join((self.run_dir, self.MANIFEST))
+		if os.path.exists(manifest_path):
+			with open(manifest_path, 'r') as f:
+				self.manifest = json.load(f)
+			if self.manifest['version'] != self.VERSION:
+				raise(ValueError('Run store version %i is not supported, expected version %i' % (self.manifest['version'], self.VERSION)))
+		else:
+			self.manifest = {'version' : self.VERSION, 'n_a' : None, 'iterations' : []}
+
+	@classmethod
+	def exists(cls, run_dir):
+		return os.path.exists('/'.join((run_dir, cls.MANIFEST)))
+
+	def get_num_iterations(self):
+		return len(self.manifest['iterations'])
+
+	def _write_manifest(self):
+		# Write to a temporary file first so that an interrupted run never leaves a partially written manifest behind
+		manifest_path = '/'.join((self.run_dir, self.MANIFEST))
+		with open(manifest_path + '.tmp', 'w') as f:
+			json.dump(self.manifest, f, indent=1)
+		os.rename(manifest_path + '.tmp', manifest_path)
+
+	def _path(self, rel_path):
+		return '/'.join((self.run_dir, rel_path))
+
+	def _iteration_rel_dir(self, k):
+		return 'it_%i' % k
+
+	def get_iteration_dir(self, k):
+		# Directory of iteration k, also used by the run for per iteration data which is not in the store (e.g. plots)
+		it_dir = self._path(self._iteration_rel_dir(k))
+		os.makedirs(it_dir, exist_ok=True)
+		return it_dir
+
+	"""
+	Append the data of one iteration. x_cl, u_cl are lists of closed loop arrays, x_ol, u_ol lists of lists of open loop
+	predictions and solve_times lists of per time step solve times, with one entry per agent
+	"""
+	def append_iteration(self, x_cl, u_cl, x_ol=None, u_ol=None, it_time=None, agent_times=None, solve_times=None):
+		k = self.get_num_iterations()
+		n_a = len(x_cl)
+		if self.manifest['n_a'] is None:
+			self.manifest['n_a'] = n_a
+		elif self.manifest['n_a'] != n_a:
+			raise(ValueError('Iteration has %i agents, run store has %i' % (n_a, self.manifest['n_a'])))
+
+		it_rel_dir = self._iteration_rel_dir(k)
+		self.get_iteration_dir(k)
+
+		entry = {'dir' : it_rel_dir, 'x_cl' : [], 'u_cl' : [], 'x_ol' : None, 'u_ol' : None, 'solve_times' : None,
+			'it_time' : it_time, 'agent_times' : None if agent_times is None else [float(a_t) for a_t in agent_times]}
+
+		for a in range(n_a):
+			entry['x_cl'].append('/'.join((it_rel_dir, 'x_cl_%i.npy' % a)))
+			np.save(self._path(entry['x_cl'][-1]), np.asarray(x_cl[a]))
+			entry['u_cl'].append('/'.join((it_rel_dir, 'u_cl_%i.npy' % a)))
+			np.save(self._path(entry['u_cl'][-1]), np.asarray(u_cl[a]))
+
+		if x_ol is not None:
+			entry['x_ol'] = '/'.join((it_rel_dir, 'x_ol'))
+			Prediction_Archive.write(self._path(entry['x_ol']), x_ol)
+			entry['u_ol'] = '/'.join((it_rel_dir, 'u_ol'))
+			Prediction_Archive.write(self._path(entry['u_ol']), u_ol)
+
+		if solve_times is not None:
+			entry['solve_times'] = []
+			for a in range(n_a):
+				entry['solve_times'].append('/'.join((it_rel_dir, 'solve_times_%i.npy' % a)))
+				np.save(self._path(entry['solve_times'][-1]), np.asarray(solve_times[a]))
+
+		self.manifest['iterations'].append(entry)
+		self._write_manifest()
+
+		return k
+
+	def load_closed_loop(self, k, mmap_mode='r'):
+		entry = self.manifest['iterations'][k]
+		x_cl = [np.load(self._path(f), mmap_mode=mmap_mode) for f in entry['x_cl']]
+		u_cl = [np.load(self._path(f), mmap_mode=mmap_mode) for f in entry['u_cl']]
+		return x_cl, u_cl
+
+	def load_closed_loops(self, mmap_mode='r'):
+		x_cls = []
+		u_cls = []
+		for k in range(self.get_num_iterations()):
+			x_cl, u_cl = self.load_closed_loop(k, mmap_mode=mmap_mode)
+			x_cls.append(x_cl)
+			u_cls.append(u_cl)
+		return x_cls, u_cls
+
+	def load_open_loop(self, k, mmap_mode='r'):
+		entry = self.manifest['iterations'][k]
+		if entry['x_ol'] is None:
+			return None, None
+		return Prediction_Archive(self._path(entry['x_ol']), mmap_mode=mmap_mode), Prediction_Archive(self._path(entry['u_ol']), mmap_mode=mmap_mode)
+
+	def load_timing(self, k):
+		entry = self.manifest['iterations'][k]
+		solve_times = None
+		if entry['solve_times'] is not None:
+			solve_times = [np.load(self._path(f)) for f in entry['solve_times']]
+		return entry['it_time'], entry['agent_times'], solve_times
+
+	"""
+	The LMPC states are not append-only, only the latest state of each agent is kept. States are written with the
+	export_state method of the controllers
+	"""
+	def save_lmpc_states(self, lmpc):
+		state_files = []
+		for (i, l) in enumerate(lmpc):
+			state_files.append('lmpc_state_%i.npz' % i)
+			l.export_state(self._path(state_files[-1]) + '.tmp')
+			os.rename(self._path(state_files[-1]) + '.tmp', self._path(state_files[-1]))
+		self.manifest['lmpc_states'] = state_files
+		self._write_manifest()
+
+	def get_lmpc_state_paths(self):
+		return [self._path(f) for f in self.manifest.get('lmpc_states', [])]
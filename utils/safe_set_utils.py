@@ -9,14 +9,16 @@ import matplotlib.pyplot as plt
 from sklearn import svm
 import pdb, itertools, matplotlib
 
+from utils import utils
+
 import warnings
 warnings.filterwarnings("ignore")
 
-def get_safe_set(x_cls, agents, des_num_ts='all', des_num_iters='all'):
+def get_safe_set(x_cls, agents, des_num_ts='all', des_num_iters='all', bound_method='numpy'):
 	n_a = len(x_cls[0])
 	n_x = x_cls[0][0].shape[0]
 
-	c = [matplotlib.cm.get_cmap('jet')(i*(1./(n_a-1))) for i in range(n_a)]
+	c = [plt.get_cmap('jet')(i*(1./(n_a-1))) for i in range(n_a)]
 
 	# Enumerate pairs of agents
 	pairs = list(itertools.combinations(range(n_a), 2))
@@ -146,26 +148,8 @@ def get_safe_set(x_cls, agents, des_num_ts='all', des_num_iters='all'):
 				w_0 = 1.0 # w_0 = np.exp(35*ratio_remain_0-3)/(np.exp(35*ratio_remain_0-3)+1)
 				w_1 = 1.0 # w_1 = np.exp(35*ratio_remain_1-3)/(np.exp(35*ratio_remain_1-3)+1)
 
-				# Solve for tight hyperplane bounds for both collections of points
-				z = cp.Variable(1)
-				cost = z
-				constr = []
-				for i in range(safe_set_pos_0.shape[1]):
-					constr += [w.dot(safe_set_pos_0[:,i]) + b <= z]
-				problem = cp.Problem(cp.Minimize(cost), constr)
-				problem.solve(solver=cp.MOSEK, verbose=False)
-				# problem.solve(verbose=False)
-				a_0_max = -z.value[0]
-
-				z = cp.Variable(1)
-				cost = z
-				constr = []
-				for i in range(safe_set_pos_1.shape[1]):
-					constr += [-w.dot(safe_set_pos_1[:,i]) - b <= z]
-				problem = cp.Problem(cp.Minimize(cost), constr)
-				problem.solve(solver=cp.MOSEK, verbose=False)
-				# problem.solve(verbose=False)
-				a_1_max = -z.value[0]
+				# Tight hyperplane bounds for both collections of points
+				a_0_max, a_1_max = get_hyperplane_offsets(w, b, safe_set_pos_0, safe_set_pos_1, method=bound_method)
 
 				if a_0_max > a_0_min and a_1_max > a_1_min:
 					if w_0 <= w_1:
@@ -228,11 +212,249 @@ def get_safe_set(x_cls, agents, des_num_ts='all', des_num_iters='all'):
 	# pdb.set_trace()
 	return safe_sets_idxs, exploration_spaces
 
-def get_safe_set_2(x_cls, agents, des_num_ts='all', des_num_iters='all'):
+def get_hyperplane_offsets(w, b, safe_set_pos_0, safe_set_pos_1, method='numpy', tol=1e-6):
+	# Largest offsets a_0, a_1 such that w'x + b <= -a_0 for all points of the first set and w'x + b >= a_1 for all points of
+	# the second set. These are a max and a min over the points, method='cvxpy' finds them by solving the equivalent LPs
+	# and method='verify' does both and checks that they agree
+	if method == 'numpy':
+		a_0_max = -np.amax(w.dot(safe_set_pos_0) + b)
+		a_1_max = np.amin(w.dot(safe_set_pos_1) + b)
+	elif method == 'cvxpy':
+		z = cp.Variable(1)
+		problem = cp.Problem(cp.Minimize(z), [w.dot(safe_set_pos_0) + b <= z])
+		problem.solve(solver=cp.MOSEK, verbose=False)
+		a_0_max = -z.value[0]
+
+		z = cp.Variable(1)
+		problem = cp.Problem(cp.Minimize(z), [-w.dot(safe_set_pos_1) - b <= z])
+		problem.solve(solver=cp.MOSEK, verbose=False)
+		a_1_max = -z.value[0]
+	elif method == 'verify':
+		a_0_max, a_1_max = get_hyperplane_offsets(w, b, safe_set_pos_0, safe_set_pos_1, method='numpy')
+		a_0_lp, a_1_lp = get_hyperplane_offsets(w, b, safe_set_pos_0, safe_set_pos_1, method='cvxpy')
+		if np.abs(a_0_max - a_0_lp) > tol or np.abs(a_1_max - a_1_lp) > tol:
+			raise(ValueError('Hyperplane offsets do not match, numpy: (%g, %g), cvxpy: (%g, %g)' % (a_0_max, a_1_max, a_0_lp, a_1_lp)))
+	else:
+		raise(ValueError('Bound method %s not recognized' % method))
+
+	return a_0_max, a_1_max
+
+def get_safe_set_positions(x_cls, a, ss_idxs):
+	# Collect the position states of agent a corresponding to the iteration and time step indicies of a safe set
+	safe_set_pos = [x_cls[j][a][:2,ss_idxs['ts_range'][i]] for (i, j) in enumerate(ss_idxs['it_range'])]
+	return np.concatenate([np.empty((2,0))] + safe_set_pos, axis=1)
+
+def get_hull_points(safe_set_pos):
+	# Vertices of the convex hull of a collection of points, degenerate collections (fewer than 3 points or collinear points)
+	# are returned as they are
+	try:
+		hull = sp.spatial.ConvexHull(safe_set_pos.T)
+	except (RuntimeError, ValueError):
+		return np.unique(safe_set_pos, axis=1)
+	return safe_set_pos[:,hull.vertices]
+
+def get_hard_margin_hyperplane(X_0, X_1, tol=1e-9):
+	# Maximum margin hyperplane with w'x + b <= -1 for the columns of X_0 and w'x + b >= 1 for the columns of X_1, i.e. the
+	# exact hard margin SVM. It is solved in the equivalent form max t s.t. v'x + c <= -t, v'x + c >= t, \|v\| <= 1,
+	# which stays well scaled for small margins, and w = v/t, b = c/t. Returns None if the collections are not linearly
+	# separable (t = 0)
+	v = cp.Variable(X_0.shape[0])
+	c = cp.Variable()
+	t = cp.Variable()
+	problem = cp.Problem(cp.Maximize(t), [X_0.T @ v + c <= -t, X_1.T @ v + c >= t, cp.norm(v, 2) <= 1])
+	problem.solve()
+	if problem.status not in [cp.OPTIMAL, cp.OPTIMAL_INACCURATE]:
+		raise(ValueError('Hard margin separation failed with status %s' % problem.status))
+	if t.value <= tol:
+		return None
+
+	return v.value/t.value, float(c.value/t.value)
+
+def get_separating_hyperplane(safe_set_pos_0, safe_set_pos_1, d, method='svm', centers=None):
+	# Find a hyperplane w'x + b = 0 with w'x + b <= -1 for the first and w'x + b >= 1 for the second collection of points,
+	# the margin between the two collections is then at least 2/\|w\|
+	# method='svm': Soft margin SVM on all points
+	# method='hull': Collections whose bounding circles are further than d apart are separated by the hyperplane between the
+	# circles, all others by the exact hard margin SVM on the vertices of their convex hulls. Any separating hyperplane
+	# which separates the hull vertices separates the full collections and the maximum margin hyperplane only depends on
+	# the hulls. If the hulls are not separable, w is zero and a collision is reported. The bounding circles are centered
+	# at the means of the collections, which can be passed in as centers if the collections are given by their hull vertices
+	if method == 'hull':
+		c_0 = np.mean(safe_set_pos_0, axis=1) if centers is None else centers[0]
+		c_1 = np.mean(safe_set_pos_1, axis=1) if centers is None else centers[1]
+		r_0 = np.amax(la.norm(safe_set_pos_0 - c_0.reshape((-1,1)), 2, axis=0))
+		r_1 = np.amax(la.norm(safe_set_pos_1 - c_1.reshape((-1,1)), 2, axis=0))
+		c_dist = la.norm(c_1 - c_0, 2)
+		gap = c_dist - r_0 - r_1
+		if gap >= d and gap > 0:
+			n = (c_1 - c_0)/c_dist
+			w = 2*n/gap
+			b = -1 - w.dot(c_0 + r_0*n)
+			return w, b, False
+
+		X_0 = get_hull_points(safe_set_pos_0)
+		X_1 = get_hull_points(safe_set_pos_1)
+		hyperplane = get_hard_margin_hyperplane(X_0, X_1)
+		if hyperplane is None:
+			return np.zeros(X_0.shape[0]), 0.0, True
+		w, b = hyperplane
+
+		# Verify the separation of all hull vertices, an inaccurate solution which does not separate them is treated as a
+		# collision
+		collision = np.any(w.dot(X_0) + b >= 0) or np.any(w.dot(X_1) + b <= 0)
+
+		return w, b, collision
+	elif method != 'svm':
+		raise(ValueError('Separation method %s not recognized' % method))
+
+	# Stack position vectors into data matrix and assign labels collection 0: -1, collection 1: 1
+	X = np.append(safe_set_pos_0, safe_set_pos_1, axis=1).T
+	y = np.append(-np.ones(safe_set_pos_0.shape[1]), np.ones(safe_set_pos_1.shape[1]))
+
+	# Use SVM with linear kernel (w'x + b <= -a_0 for collection 0, w'x + b >= a_1 for collection 1)
+	clf = svm.SVC(kernel='linear', C=1000, max_iter=1000)
+	clf.fit(X, y)
+	w = np.squeeze(clf.coef_)
+	b = np.squeeze(clf.intercept_)
+
+	# Check for misclassification of support vectors. This indicates that the collections are not linearlly separable
+	collision = np.any(y[clf.support_]*clf.decision_function(X[clf.support_]) <= 0)
+
+	return w, b, collision
+
+def get_box_hyperplane(safe_set_pos_0, safe_set_pos_1):
+	# Axis aligned hyperplane in the widest gap between the bounding boxes of two collections of points which do not overlap,
+	# scaled such that w'x + b <= -1 for the first and w'x + b >= 1 for the second collection
+	gaps = np.append(np.amin(safe_set_pos_1, axis=1) - np.amax(safe_set_pos_0, axis=1),
+		np.amin(safe_set_pos_0, axis=1) - np.amax(safe_set_pos_1, axis=1))
+	k = np.argmax(gaps)
+	n_d = safe_set_pos_0.shape[0]
+	s = 1.0 if k < n_d else -1.0
+	gap = gaps[k]
+
+	w = np.zeros(n_d)
+	w[k % n_d] = 2*s/gap
+	edge_0 = np.amax(s*safe_set_pos_0[k % n_d])
+	b = -1 - 2*edge_0/gap
+
+	return w, b
+
+def separate_safe_sets(safe_set_pos_0, safe_set_pos_1, d, r_0, r_1, bound_method='numpy', separator='svm', hyperplane=None, centers=None):
+	# A separating hyperplane (w, b) which is already known can be passed in, otherwise it is found with the separator method
+	if hyperplane is None:
+		w, b, collision = get_separating_hyperplane(safe_set_pos_0, safe_set_pos_1, d, method=separator, centers=centers)
+	else:
+		w, b = hyperplane
+		collision = False
+
+	# Calculate classifier margin
+	margin = 2/la.norm(w, 2) if not collision else 0.0
+
+	sep = {'collision' : collision, 'margin' : margin, 'w' : w, 'b' : b, 'a_0' : None, 'a_1' : None}
+
+	# Exploration spaces are not needed if the safe sets are not separable or the distance between them is too small
+	if collision or margin < d:
+		return sep
+
+	# Distance between hyperplanes is (a_0+a_1)/\|w\|
+	a_0_min = d*la.norm(w, 2)/(1 + r_1/r_0)
+	a_1_min = d*la.norm(w, 2)/(1 + r_0/r_1)
+
+	w_0 = 1.0
+	w_1 = 1.0
+
+	# Tight hyperplane bounds for both collections of points
+	a_0_max, a_1_max = get_hyperplane_offsets(w, b, safe_set_pos_0, safe_set_pos_1, method=bound_method)
+
+	if a_0_max > a_0_min and a_1_max > a_1_min:
+		if w_0 <= w_1:
+			a_shift = (a_0_max - a_0_min)*(1-w_0/w_1)
+			a_0 = a_0_min + a_shift
+			a_1 = a_1_min - a_shift
+		else:
+			a_shift = (a_1_max - a_1_min)*(1-w_1/w_0)
+			a_0 = a_0_min - a_shift
+			a_1 = a_1_min + a_shift
+	else:
+		a_0 = a_0_max - 1e-5 # Deal with precision issues when a point in the safe set is on the exploration space boundary
+		a_1 = a_1_max - 1e-5
+
+	sep['a_0'] = a_0
+	sep['a_1'] = a_1
+
+	return sep
+
+class Safe_Set_Cache(object):
+	"""
+	Convex hull vertices, number of points and sum of the position states of the safe set windows (iteration, agent, time
+	step range) of get_safe_set_2. The trajectories of past iterations do not change, so these only depend on the window
+	and are reused across range reductions and across calls of get_safe_set_2 in later LMPC iterations. Windows are only
+	reused across LMPC iterations if the safe sets span more than one iteration (des_num_iters > 1).
+
+	The hull vertices are all the hull separator, the spatial index, the box hyperplanes and the hyperplane offsets need of
+	a safe set, the bounding circle center is the mean of the points which is computed from the sums. None of the cached
+	data depends on the collision distance, the separator or the bound method, so these are not part of the key
+	"""
+	def __init__(self):
+		self.windows = {}
+		self.traj_ends = {}
+
+		self.n_hits = 0
+		self.n_misses = 0
+
+	def update_trajectories(self, x_cls, it_start):
+		# Drop the windows of iterations before it_start, which are not used again, and of trajectories which have changed
+		for (j, a) in list(self.traj_ends.keys()):
+			if j < it_start or j >= len(x_cls) or not self._same_traj(x_cls[j][a], self.traj_ends[(j, a)]):
+				del self.traj_ends[(j, a)]
+				for key in [k for k in self.windows.keys() if k[:2] == (j, a)]:
+					del self.windows[key]
+
+		self.n_hits = 0
+		self.n_misses = 0
+
+	def _same_traj(self, agent_cl, traj_end):
+		n, pos_first, pos_last = traj_end
+		return agent_cl.shape[1] == n and np.array_equal(agent_cl[:2,0], pos_first) and np.array_equal(agent_cl[:2,-1], pos_last)
+
+	def get_window(self, x_cls, j, a, ts_range):
+		key = (j, a, ts_range.start, ts_range.stop)
+		window = self.windows.get(key)
+		if window is not None:
+			self.n_hits += 1
+			return window
+
+		self.n_misses += 1
+		agent_cl = x_cls[j][a]
+		safe_set_pos = agent_cl[:2,ts_range.start:ts_range.stop]
+		window = (get_hull_points(safe_set_pos), safe_set_pos.shape[1], np.sum(safe_set_pos, axis=1))
+		self.windows[key] = window
+		if (j, a) not in self.traj_ends:
+			self.traj_ends[(j, a)] = (agent_cl.shape[1], np.array(agent_cl[:2,0]), np.array(agent_cl[:2,-1]))
+
+		return window
+
+	def get_safe_set_hull(self, x_cls, a, ss_idxs):
+		# Hull vertices and mean of the position states of the safe set of agent a
+		windows = [self.get_window(x_cls, j, a, ss_idxs['ts_range'][i]) for (i, j) in enumerate(ss_idxs['it_range'])]
+		if len(windows) == 1:
+			hull = windows[0][0]
+		else:
+			hull = get_hull_points(np.concatenate([w[0] for w in windows], axis=1))
+		center = np.sum([w[2] for w in windows], axis=0)/np.sum([w[1] for w in windows])
+
+		return hull, center
+
+def get_safe_set_2(x_cls, agents, des_num_ts='all', des_num_iters='all', cache=None, bound_method='numpy', separator='svm', spatial_index=True):
+	# A Safe_Set_Cache which persists across LMPC iterations can be passed in to reuse the hulls of safe set windows, this
+	# requires the hull separator
+	if cache is not None and separator != 'hull':
+		raise(ValueError('The safe set cache requires the hull separator'))
+
 	n_a = len(x_cls[0])
 	n_x = x_cls[0][0].shape[0]
 
-	c = [matplotlib.cm.get_cmap('jet')(i*(1./(n_a-1))) for i in range(n_a)]
+	c = [plt.get_cmap('jet')(i*(1./(n_a-1))) for i in range(n_a)]
 
 	# Enumerate pairs of agents
 	pairs = list(itertools.combinations(range(n_a), 2))
@@ -271,6 +493,9 @@ def get_safe_set_2(x_cls, agents, des_num_ts='all', des_num_iters='all'):
 	orig_des_num_ts = des_num_ts
 	orig_des_num_iters = des_num_iters
 
+	if cache is not None:
+		cache.update_trajectories(x_cls, max(0, num_iters-des_num_iters))
+
 	ss_t = []
 	ss_n_its = []
 	ss_n_ts = []
@@ -302,49 +527,41 @@ def get_safe_set_2(x_cls, agents, des_num_ts='all', des_num_iters='all'):
 				ss_idxs = {'it_range' : it_range, 'ts_range' : ts_range}
 				safe_set_cand_t.append(ss_idxs) # Candidate safe sets at this time step
 
+			# Collision only defined for position states. With the cache, safe sets are represented by their hull vertices
+			if cache is None:
+				safe_set_pos_t = [get_safe_set_positions(x_cls, a, safe_set_cand_t[a]) for a in range(n_a)]
+				centers_t = [None for _ in range(n_a)]
+			else:
+				safe_set_hulls_t = [cache.get_safe_set_hull(x_cls, a, safe_set_cand_t[a]) for a in range(n_a)]
+				safe_set_pos_t = [h for (h, _) in safe_set_hulls_t]
+				centers_t = [c for (_, c) in safe_set_hulls_t]
+
+			# Only pairs of agents whose safe set bounding boxes inflated by their collision buffers overlap need to be checked
+			if spatial_index:
+				near_pairs = utils.get_overlapping_pairs([utils.get_inflated_box(safe_set_pos_t[a], r_a[a]) for a in range(n_a)])
+
 			# Check for potential overlap and minimum distance between agent safe sets
 			all_valid = True
 			for (p, d) in zip(pairs, min_dist):
-				collision = False
-				# Collision only defined for position states
-				safe_set_pos_0 = np.empty((2,0))
-				safe_set_pos_1 = np.empty((2,0))
-				for (i, j) in enumerate(safe_set_cand_t[p[0]]['it_range']):
-					safe_set_pos_0 = np.append(safe_set_pos_0, x_cls[j][p[0]][:2,safe_set_cand_t[p[0]]['ts_range'][i]], axis=1)
-					safe_set_pos_1 = np.append(safe_set_pos_1, x_cls[j][p[1]][:2,safe_set_cand_t[p[1]]['ts_range'][i]], axis=1)
+				safe_set_pos_0 = safe_set_pos_t[p[0]]
+				safe_set_pos_1 = safe_set_pos_t[p[1]]
 
-				# Stack safe set position vectors into data matrix and assign labels agent p[0]: -1, agent p[1]: 1
-				X = np.append(safe_set_pos_0, safe_set_pos_1, axis=1).T
-				y = np.append(-np.ones(safe_set_pos_0.shape[1]), np.ones(safe_set_pos_1.shape[1]))
-
-				# if t == 68:
-				# 	pdb.set_trace()
-
-				# Use SVM with linear kernel and no regularization (w'x + b <= -a_0 for agent p[0], w'x + b >= a_1 for agent p[1])
-				clf = svm.SVC(kernel='linear', C=1000, max_iter=1000)
-				clf.fit(X, y)
-				w = np.squeeze(clf.coef_)
-				b = np.squeeze(clf.intercept_)
-
-				# Calculate classifier margin
-				margin = 2/la.norm(w, 2)
+				if spatial_index and p not in near_pairs:
+					sep = separate_safe_sets(safe_set_pos_0, safe_set_pos_1, d, r_a[p[0]], r_a[p[1]], bound_method=bound_method, hyperplane=get_box_hyperplane(safe_set_pos_0, safe_set_pos_1))
+				else:
+					centers = None if cache is None else (centers_t[p[0]], centers_t[p[1]])
+					sep = separate_safe_sets(safe_set_pos_0, safe_set_pos_1, d, r_a[p[0]], r_a[p[1]], bound_method=bound_method, separator=separator, centers=centers)
 
-				# Check for misclassification of support vectors. This indicates that the safe sets are not linearlly separable
-				for i in clf.support_:
-					pred_label = clf.predict(X[i].reshape((1,-1)))
-					# pred_val = clf.decision_function(X[i].reshape((1,-1)))
-					if pred_label != y[i]:
-						collision = True
-						print('Potential for collision between agents %i and %i' % (p[0],p[1]))
-						break
+				if sep['collision']:
+					print('Potential for collision between agents %i and %i' % (p[0],p[1]))
 				# Check for distance between safe sets
-				if not collision and margin < d:
+				elif sep['margin'] < d:
 					print('Margin between safe sets for agents %i and %i is too small' % (p[0],p[1]))
 
 				# If collision is possible or margin is less than minimum required distance between safe sets, reduce safe set
 				# iteration and/or time range
 				# Currently, we reduce iteration range first. If iteration range cannot be reduced any further then we reduce time step range and reset iteration range
-				if collision or margin < d:
+				if sep['collision'] or sep['margin'] < d:
 					all_valid = False
 					it_start += 1
 					if it_start >= num_iters:
@@ -367,56 +584,11 @@ def get_safe_set_2(x_cls, agents, des_num_ts='all', des_num_iters='all'):
 					g_t = [[] for _ in range(n_a)]
 					break
 
-				# Distance between hyperplanes is (a_0+a_1)/\|w\|
-				a_0_min = d*la.norm(w, 2)/(1 + r_a[p[1]]/r_a[p[0]])
-				a_1_min = d*la.norm(w, 2)/(1 + r_a[p[0]]/r_a[p[1]])
-
-				# ratio_remain_0 = la.norm(x_cls[0][p[0]][:2,-1] - safe_set_pos_0[:,0], 2)/la.norm(x_cls[0][p[0]][:2,-1] - x_cls[0][p[0]][:2,0], 2)
-				# ratio_remain_1 = la.norm(x_cls[0][p[1]][:2,-1] - safe_set_pos_1[:,0], 2)/la.norm(x_cls[0][p[1]][:2,-1] - x_cls[0][p[1]][:2,0], 2)
-				w_0 = 1.0 # w_0 = np.exp(35*ratio_remain_0-3)/(np.exp(35*ratio_remain_0-3)+1)
-				w_1 = 1.0 # w_1 = np.exp(35*ratio_remain_1-3)/(np.exp(35*ratio_remain_1-3)+1)
-
-				# Solve for tight hyperplane bounds for both collections of points
-				z = cp.Variable(1)
-				cost = z
-				constr = []
-				for i in range(safe_set_pos_0.shape[1]):
-					constr += [w.dot(safe_set_pos_0[:,i]) + b <= z]
-				problem = cp.Problem(cp.Minimize(cost), constr)
-				problem.solve(solver=cp.MOSEK, verbose=False)
-				# problem.solve(verbose=False)
-				a_0_max = -z.value[0]
-
-				z = cp.Variable(1)
-				cost = z
-				constr = []
-				for i in range(safe_set_pos_1.shape[1]):
-					constr += [-w.dot(safe_set_pos_1[:,i]) - b <= z]
-				problem = cp.Problem(cp.Minimize(cost), constr)
-				problem.solve(solver=cp.MOSEK, verbose=False)
-				# problem.solve(verbose=False)
-				a_1_max = -z.value[0]
-
-				if a_0_max > a_0_min and a_1_max > a_1_min:
-					if w_0 <= w_1:
-						a_shift = (a_0_max - a_0_min)*(1-w_0/w_1)
-						a_0 = a_0_min + a_shift
-						a_1 = a_1_min - a_shift
-					else:
-						a_shift = (a_1_max - a_1_min)*(1-w_1/w_0)
-						a_0 = a_0_min - a_shift
-						a_1 = a_1_min + a_shift
-				else:
-					a_0 = a_0_max - 1e-5 # Deal with precision issues when a point in the safe set is on the exploration space boundary
-					a_1 = a_1_max - 1e-5
-
 				# Exploration spaces
-				H_t[p[0]].append(w)
-				g_t[p[0]].append(b+a_0)
-				H_t[p[1]].append(-w)
-				g_t[p[1]].append(-b+a_1)
-
-				# plot_svm_results(X, y, clf)
+				H_t[p[0]].append(sep['w'])
+				g_t[p[0]].append(sep['b']+sep['a_0'])
+				H_t[p[1]].append(-sep['w'])
+				g_t[p[1]].append(-sep['b']+sep['a_1'])
 
 			# all_valid flag is true if all pair-wise collision and margin checks were passed
 			if all_valid:
@@ -465,13 +637,14 @@ def get_safe_set_2(x_cls, agents, des_num_ts='all', des_num_iters='all'):
 			ss_idxs = {'it_range' : it_range, 'ts_range' : ts_range}
 			safe_sets_idxs[a][t] = ss_idxs
 
-			safe_set_pos = np.empty((2,0))
-			for (i, j) in enumerate(safe_sets_idxs[a][t]['it_range']):
-				safe_set_pos = np.append(safe_set_pos, x_cls[j][a][:2,safe_sets_idxs[a][t]['ts_range'][i]], axis=1)
+			safe_set_pos = get_safe_set_positions(x_cls, a, safe_sets_idxs[a][t])
 			in_exp_space = (exploration_spaces[a][t][0].dot(safe_set_pos) + exploration_spaces[a][t][1].reshape((-1,1)) <= 0)
 			if not np.all(in_exp_space):
 				raise(ValueError('Safe set not contained in exploration space at time %i' % t))
 
+	if cache is not None:
+		print('Safe set windows reused: %i, computed: %i' % (cache.n_hits, cache.n_misses))
+
 	# pdb.set_trace()
 	return safe_sets_idxs, exploration_spaces
 
@@ -515,7 +688,7 @@ def inspect_safe_set(x, u, safe_sets_idxs, exploration_spaces, plot_lims=None):
 	n_a = len(x[-1])
 	n_SS = len(safe_sets_idxs[0])
 
-	c = [matplotlib.cm.get_cmap('jet')(i*(1./(n_a-1))) for i in range(n_a)]
+	c = [plt.get_cmap('jet')(i*(1./(n_a-1))) for i in range(n_a)]
 
 	plt.ion()
 
@@ -222,15 +222,44 @@ def plot_svm_results(X, y, clf):
 			   linewidth=1, facecolors='none', edgecolors='k')
 	plt.show()
 
+def get_inflated_box(pos, r):
+	# Axis aligned bounding box of a collection of positions (columns of pos) inflated by the buffer radius r
+	return np.amin(pos, axis=1) - r, np.amax(pos, axis=1) + r
+
+def get_overlapping_pairs(boxes):
+	# Sweep and prune over the first axis, returns the pairs (i, j) with i < j whose boxes overlap in all axes. Boxes are
+	# tuples of lower and upper corners
+	n = len(boxes)
+	lo = np.array([bx[0] for bx in boxes]).reshape((n,-1))
+	hi = np.array([bx[1] for bx in boxes]).reshape((n,-1))
+
+	pairs = []
+	order = np.argsort(lo[:,0], kind='mergesort')
+	active = []
+	for i in order:
+		# Boxes whose extent along the first axis ends before the start of this box cannot overlap with any later box
+		active = [j for j in active if hi[j,0] >= lo[i,0]]
+		for j in active:
+			if np.all(lo[i] <= hi[j]) and np.all(lo[j] <= hi[i]):
+				pairs.append((min(i, j), max(i, j)))
+		active.append(i)
+
+	return set(pairs)
+
 def check_traj_collisions(traj, agt_idx, comp_trajs, agents):
 	coll_time = np.inf
+	r = agents[agt_idx].get_collision_buff_r()
+	traj_box = get_inflated_box(traj[:2], r)
 	for (i, ct) in enumerate(comp_trajs):
 		ct_len = ct.shape[1]
-		d = agents[i].get_collision_buff_r()+agents[agt_idx].get_collision_buff_r()
-		for j in range(traj.shape[1]):
-			if la.norm(traj[:2,j]-ct[:2,min(j,ct_len-1)]) < d:
-				# pdb.set_trace()
-				if j < coll_time:
-					coll_time = j
+		r_i = agents[i].get_collision_buff_r()
+		d = r_i+r
+		# Trajectories whose inflated bounding boxes do not overlap cannot collide
+		if len(get_overlapping_pairs([traj_box, get_inflated_box(ct[:2], r_i)])) == 0:
+			continue
+		ct_idxs = np.minimum(np.arange(traj.shape[1]), ct_len-1)
+		coll_idxs = np.nonzero(la.norm(traj[:2]-ct[:2,ct_idxs], 2, axis=0) < d)[0]
+		if coll_idxs.size > 0 and coll_idxs[0] < coll_time:
+			coll_time = coll_idxs[0]
 
 	return coll_time
@@ -0,0 +1,59 @@
+"""
+Vertices of the kinematic bicycle footprint for whole trajectories. State arrays have the states along the last axis,
+i.e. shape (..., T, n_x) with (x, y, psi) as the first three states, e.g. (n_a, T, 4) for n_a agents stacked with
+stack_trajs. Vehicle parameters are scalars or arrays over the leading (agent) dimensions, so all agents and all time
+steps are computed in a single vectorized call
+"""
+
+from __future__ import division
+
+import numpy as np
+
+def _expand(p, ndim):
+	# Append trailing axes to a parameter so that it broadcasts over the time dimension
+	p = np.asarray(p, dtype=np.float64)
+	return p.reshape(p.shape + (1,)*(ndim-p.ndim))
+
+def stack_trajs(trajs):
+	# Stack a list of (n_x, T_i) trajectories into an (n, T_max, n_x) array. Trajectories shorter than T_max hold their
+	# last state, which is how agents that have already arrived are drawn. Also returns the trajectory lengths
+	lens = np.array([tr.shape[1] for tr in trajs])
+	T = np.amax(lens)
+	t_idxs = np.minimum(np.arange(T), lens.reshape((-1,1))-1)
+	stacked = np.stack([np.asarray(tr)[:,t_idxs[i]].T for (i, tr) in enumerate(trajs)])
+	return stacked, lens
+
+def get_car_vertices(x, l_f, l_r, w):
+	# Corners of the car outline, shape (..., T, 4, 2), starting at the front left corner
+	pos_x, pos_y, psi = x[...,0], x[...,1], x[...,2]
+	l_f, l_r, w = [_expand(p, psi.ndim) for p in [l_f, l_r, w]]
+	c, s = np.cos(psi), np.sin(psi)
+
+	car_x = np.stack((pos_x + l_f*c + w*s/2, pos_x + l_f*c - w*s/2, pos_x - l_r*c - w*s/2, pos_x - l_r*c + w*s/2), axis=-1)
+	car_y = np.stack((pos_y + l_f*s - w*c/2, pos_y + l_f*s + w*c/2, pos_y - l_r*s + w*c/2, pos_y - l_r*s - w*c/2), axis=-1)
+
+	return np.stack((car_x, car_y), axis=-1)
+
+def get_wheel_vertices(x, df, l_f, wheel_l=0.15):
+	# End points of the front wheel segment with half length wheel_l, shape (..., T, 2, 2)
+	pos_x, pos_y, psi = x[...,0], x[...,1], x[...,2]
+	l_f, wheel_l = [_expand(p, psi.ndim) for p in [l_f, wheel_l]]
+
+	center = np.stack((pos_x + l_f*np.cos(psi), pos_y + l_f*np.sin(psi)), axis=-1)
+	d = wheel_l[...,None]*np.stack((np.cos(psi+df), np.sin(psi+df)), axis=-1)
+
+	return np.stack((center + d, center - d), axis=-2)
+
+def get_circle_vertices(x, r, n_pts=100):
+	# Points on the collision buffer circle of radius r, shape (..., T, n_pts, 2)
+	r = _expand(r, x.ndim-1)
+	ang = np.linspace(0, 2*np.pi, n_pts)
+	circle = np.stack((np.cos(ang), np.sin(ang)), axis=-1)
+
+	return x[...,None,:2] + r[...,None,None]*circle
+
+def get_vehicle_geometry(x, df, l_f, l_r, w, r=None, wheel_l=0.15, n_pts=100):
+	geometry = {'car' : get_car_vertices(x, l_f, l_r, w), 'wheel' : get_wheel_vertices(x, df, l_f, wheel_l=wheel_l)}
+	if r is not None:
+		geometry['circle'] = get_circle_vertices(x, r, n_pts=n_pts)
+	return geometry
@@ -0,0 +1,93 @@
+from __future__ import division
+
+import multiprocessing as mp
+import os
+
+def _viz_worker(queue, vis_kwargs):
+	# Render without a display, this has to be set before the plotting modules are imported
+	os.environ['MPLBACKEND'] = 'Agg'
+	import matplotlib
+	matplotlib.use('Agg')
+	import matplotlib.pyplot as plt
+	plt.switch_backend('Agg')
+
+	from utils.lmpc_visualizer import lmpc_visualizer
+	from utils.plot_bike_utils import plot_bike_agent_trajs
+
+	vis = [lmpc_visualizer(**kw) for kw in vis_kwargs]
+	expl_con = [None for _ in vis]
+	while True:
+		event = queue.get()
+		if event is None:
+			break
+		(name, a, args, kwargs) = event
+		if name == 'set_expl_con':
+			expl_con[a] = args[0]
+		elif name == 'plot_traj':
+			kwargs['expl_con'] = expl_con[a]
+			vis[a].plot_traj(*args, **kwargs)
+		elif name == 'plot_bike_agent_trajs':
+			plot_bike_agent_trajs(*args, **kwargs)
+			plt.close('all')
+		else:
+			getattr(vis[a], name)(*args, **kwargs)
+
+	for v in vis:
+		v.close_figure()
+
+class Viz_Event_Stream(object):
+	"""
+	Runs visualization in a separate process which consumes a stream of trajectory events, so that the control loop only
+	pays for putting the event data on a queue. The visualizers of the agents live in the rendering process and are driven
+	through the proxies returned by get_visualizer, which have the same interface as lmpc_visualizer. Events are consumed
+	in order, putting an event blocks only if max_events events are waiting to be rendered
+	"""
+	def __init__(self, vis_kwargs, max_events=1000):
+		# Start the rendering process from a fresh interpreter so that it does not inherit the GUI state of this one
+		ctx = mp.get_context('spawn')
+		self.queue = ctx.Queue(max_events)
+		self.process = ctx.Process(target=_viz_worker, args=(self.queue, vis_kwargs))
+		self.process.daemon = True
+		self.process.start()
+
+		self.visualizers = [_Visualizer_Proxy(self, a) for a in range(len(vis_kwargs))]
+
+	def put(self, name, a=None, *args, **kwargs):
+		self.queue.put((name, a, args, kwargs))
+
+	def get_visualizer(self, a):
+		return self.visualizers[a]
+
+	def plot_bike_agent_trajs(self, *args, **kwargs):
+		self.put('plot_bike_agent_trajs', None, *args, **kwargs)
+
+	def close(self):
+		# Wait for all queued events to be rendered
+		self.queue.put(None)
+		self.process.join()
+
+class _Visualizer_Proxy(object):
+	# Stand-in for the lmpc_visualizer of agent a in the rendering process
+	def __init__(self, stream, a):
+		self.stream = stream
+		self.a = a
+		self.n_prev_trajs = 0
+		self.expl_con_id = None
+
+	def set_save_dir(self, save_dir):
+		self.stream.put('set_save_dir', self.a, save_dir)
+
+	def update_prev_trajs(self, state_traj, act_traj=None):
+		# The rendering process keeps the history, only send the iterations it has not seen yet
+		state_trajs = [] if state_traj is None else state_traj[self.n_prev_trajs:]
+		act_trajs = None if act_traj is None else act_traj[self.n_prev_trajs:]
+		self.stream.put('append_prev_trajs', self.a, state_trajs, act_trajs)
+		if state_traj is not None:
+			self.n_prev_trajs = len(state_traj)
+
+	def plot_traj(self, state_cl, act_cl, state_preds, act_preds, t, SS=None, expl_con=None, shade=False):
+		# Exploration constraints change once per iteration, only send them when they do
+		if id(expl_con) != self.expl_con_id:
+			self.stream.put('set_expl_con', self.a, expl_con)
+			self.expl_con_id = id(expl_con)
+		self.stream.put('plot_traj', self.a, state_cl, act_cl, state_preds, act_preds, t, SS=SS, shade=shade)